@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+"""
+Benchmark the latency of an AI move.
+
+Compares the original full minimax search against the solved-table lookup
+used by `find_best_move`. Run from the backend directory with:
+
+    python -m benchmarks.ai_move
+"""
+import time
+
+from src.game import find_best_move, minimax
+from src.search import PERFECT_PLAY
+from src.state import GameState, O
+
+
+# Positions where the AI ('O') is to move, from the opening to the endgame
+POSITIONS = [
+    ["X", "", "", "", "", "", "", "", ""],
+    ["", "", "", "", "X", "", "", "", ""],
+    ["X", "", "", "", "O", "", "", "", "X"],
+    ["X", "X", "", "", "O", "", "", "", ""],
+    ["X", "O", "X", "", "X", "", "", "", "O"],
+]
+
+
+def to_state(board):
+    """Build the GameState for a board with a perfect-play AI ('O') to move"""
+    x_mask = sum(1 << tile for tile, cell in enumerate(board) if cell == "X")
+    o_mask = sum(1 << tile for tile, cell in enumerate(board) if cell == "O")
+    return GameState(x_mask, o_mask, O, difficulty=PERFECT_PLAY)
+
+
+def minimax_best_move(state):
+    """The pre-table move search: a full minimax from the current position"""
+    best_score, best_move = -float("inf"), None
+    for tile in state.free_tiles():
+        state.play(tile)
+        score = minimax(state, 0, False, "O", "X")
+        state.undo(tile)
+        if score > best_score:
+            best_score, best_move = score, tile
+    return best_move
+
+
+def measure(pick_move, repeat):
+    """Return the mean time per move in microseconds"""
+    states = [to_state(board) for board in POSITIONS]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for state in states:
+            pick_move(state)
+    return (time.perf_counter() - start) / (repeat * len(POSITIONS)) * 1e6
+
+
+if __name__ == "__main__":
+    before = measure(minimax_best_move, 3)
+    after = measure(find_best_move, 2000)
+    print(f"minimax search: {before:12.1f} us/move")
+    print(f"solved table:   {after:12.1f} us/move")
+    print(f"speedup:        {before / after:12.0f}x")
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+"""
+Hammer a single game room with concurrent moves.
+
+Many threads race to play every tile of the same game through `apply_move`,
+and the script reports the latency of a move attempt under that contention.
+The consistency of the results is checked by tests/test_moves.py. Run from
+the backend directory against a local Redis with:
+
+    python -m benchmarks.concurrent_moves [--threads N] [--games N] [--fake]
+
+--fake runs against fakeredis (which needs lupa for Lua) instead.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+if "--fake" in sys.argv:
+    import fakeredis
+    import redis
+    redis.Redis = fakeredis.FakeRedis
+    redis.from_url = fakeredis.FakeRedis.from_url
+
+from src import redis_conn
+from src.game import MOVE_OK, apply_move, create_game_state, players_key, save_game_state
+from src.state import O, X
+
+
+def play_game(code, threads):
+    """Race `threads` workers on one game; returns (accepted moves, latencies)"""
+    save_game_state(code, create_game_state())
+    redis_conn.hset(players_key(code), mapping={"player-x": X, "player-o": O})
+    accepted, latencies = [], []
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker():
+        tiles = list(range(9))
+        random.shuffle(tiles)
+        start.wait()
+        for tile in tiles:
+            for player in ("player-x", "player-o"):
+                began = time.perf_counter()
+                status, state = apply_move(code, tile, player)
+                elapsed = time.perf_counter() - began
+                with lock:
+                    latencies.append(elapsed)
+                    if status == MOVE_OK:
+                        accepted.append((state.version, tile, player, state))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return accepted, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--fake", action="store_true")
+    args = parser.parse_args()
+
+    latencies = []
+    for game in range(args.games):
+        code = f"bench-concurrent-{game}"
+        _, game_latencies = play_game(code, args.threads)
+        latencies.extend(game_latencies)
+        redis_conn.delete(code, players_key(code))
+
+    latencies.sort()
+    print(f"{args.games} games, {args.threads} threads, {len(latencies)} move attempts")
+    for label, quantile in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        print(f"{label}: {latencies[int(quantile * (len(latencies) - 1))] * 1000:.3f} ms")
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""
+Time exporting the moves table as gzip-compressed NDJSON.
+
+Fills a SQLite database with --moves moves (10 million by default), nine
+to a game, then exports them all, and then the last tenth of them as an
+incremental export since a timestamp. Reports rows per second, the size of
+the output and the peak memory of the process, which stays flat however
+many moves there are. Run from the backend directory with:
+
+    python -m benchmarks.export [--moves 10000000] [--level 6] [--fake]
+
+--fake runs against fakeredis instead of a local Redis.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+if "--fake" in sys.argv:
+    import fakeredis
+    import redis
+    redis.Redis = fakeredis.FakeRedis
+    redis.from_url = fakeredis.FakeRedis.from_url
+
+_database = os.path.join(tempfile.mkdtemp(), "export.db")
+os.environ["DATABASE_URI"] = f"sqlite:///{_database}"
+
+from src import app, db, export
+from src.models import Move
+
+INSERT_BATCH = 20000
+
+
+def add_moves(count):
+    """Bulk-inserts count moves, written one millisecond apart. Returns when the last tenth starts"""
+    start = datetime.utcnow() - timedelta(days=1)
+    rows = []
+    for number in range(count):
+        if number % 9 == 0:
+            game_id = str(uuid.uuid4())
+        written_at = start + timedelta(milliseconds=number)
+        rows.append({"id": str(uuid.uuid4()), "game_id": game_id, "number": number % 9 + 1,
+                     "tile_number": number % 9, "player_id": None,
+                     "created_at": written_at, "updated_at": written_at})
+        if len(rows) == INSERT_BATCH:
+            db.session.execute(db.insert(Move), rows)
+            rows = []
+    if rows:
+        db.session.execute(db.insert(Move), rows)
+    db.session.commit()
+    return start + timedelta(milliseconds=count - count // 10)
+
+
+def measure(since, level):
+    """Returns (rows, compressed bytes, seconds) of exporting the moves written since"""
+    rows, size = 0, 0
+
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += chunk.count(b"\n")
+            yield chunk
+
+    start = time.perf_counter()
+    for data in export.gzipped(counted(export.rows("moves", since, datetime.utcnow())), level):
+        size += len(data)
+    return rows, size, time.perf_counter() - start
+
+
+def peak_memory():
+    """Most memory the process has used so far, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--moves", type=int, default=10_000_000)
+    parser.add_argument("--level", type=int, default=export.COMPRESS_LEVEL, help="gzip level")
+    parser.add_argument("--fake", action="store_true")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        tenth = add_moves(args.moves)
+        print(f"inserted {args.moves} moves in {time.perf_counter() - start:.1f} s, "
+              f"peak {peak_memory():.0f} MB")
+
+        print(f"{'export':>12} {'rows':>10} {'seconds':>8} {'rows/s':>10} {'MB':>8} {'peak MB':>8}")
+        for name, since in (("full", None), ("incremental", tenth)):
+            rows, size, elapsed = measure(since, args.level)
+            print(f"{name:>12} {rows:>10} {elapsed:>8.1f} {rows / elapsed:>10.0f} "
+                  f"{size / 1e6:>8.1f} {peak_memory():>8.0f}")
+    os.remove(_database)
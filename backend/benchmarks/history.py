@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""
+Time serving /history and /game_details for growing game histories.
+
+Creates players with growing numbers of finished games, each with moves and
+chat messages, then walks every /history page and reports the time and SQL
+queries per page. That the query count stays fixed is checked by
+tests/test_history.py. Run from the backend directory with:
+
+    python -m benchmarks.history [--fake]
+
+--fake runs against fakeredis instead of a local Redis.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+if "--fake" in sys.argv:
+    import fakeredis
+    import redis
+    redis.Redis = fakeredis.FakeRedis
+    redis.from_url = fakeredis.FakeRedis.from_url
+
+_database = os.path.join(tempfile.mkdtemp(), "history.db")
+os.environ["DATABASE_URI"] = f"sqlite:///{_database}"
+
+from sqlalchemy import event
+
+from src import app, db
+from src.models import Game, GamePlayerAssociation, Message, Move, Player
+
+GAME_COUNTS = (10, 100, 500)
+
+
+class QueryCounter():
+    """Counts the statements sent to the database while active"""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(db.engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+    def measure(self, function):
+        """Returns (result, queries, milliseconds) of calling function"""
+        self.count = 0
+        start = time.perf_counter()
+        result = function()
+        return result, self.count, (time.perf_counter() - start) * 1000
+
+
+def add_games(player, opponent, count):
+    """Bulk-inserts count finished games between the two players"""
+    start = datetime.utcnow() - timedelta(days=1)
+    games, players, moves, messages = [], [], [], []
+    for number in range(count):
+        game_id = str(uuid.uuid4())
+        games.append({"id": game_id, "code": uuid.uuid4().hex[:10], "finished": True,
+                      "winner_id": player.id, "created_at": start + timedelta(seconds=number)})
+        players += [{"game_id": game_id, "player_id": player.id},
+                    {"game_id": game_id, "player_id": opponent.id}]
+        for tile in range(5):
+            moves.append({"id": str(uuid.uuid4()), "game_id": game_id, "number": tile + 1,
+                          "tile_number": tile, "player_id": (player, opponent)[tile % 2].id})
+        messages.append({"id": str(uuid.uuid4()), "game_id": game_id,
+                         "player_id": opponent.id, "text": "good game"})
+    for model, rows in ((Game, games), (GamePlayerAssociation, players),
+                        (Move, moves), (Message, messages)):
+        db.session.execute(db.insert(model), rows)
+    db.session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fake", action="store_true")
+    parser.parse_args()
+
+    with app.app_context():
+        counter = QueryCounter()
+    print(f"{'games':>6} {'pages':>6} {'queries/page':>13} {'ms/page':>8} {'details q':>10}")
+    for count in GAME_COUNTS:
+        client = app.test_client()
+        client.post("/register", json={"email": f"history{count}@bench", "password": "-",
+                                       "username": f"history{count}"})
+        with app.app_context():
+            player = Player.query.filter_by(username=f"history{count}").first()
+            opponent = Player(username=f"opponent{count}", email=f"opponent{count}@bench",
+                              password="-")
+            db.session.add(opponent)
+            db.session.commit()
+            add_games(player, opponent, count)
+
+        queries, elapsed, pages, cursor = set(), 0.0, 0, None
+        while True:
+            url = "/history" + (f"?cursor={cursor}" if cursor else "")
+            response, page_queries, ms = counter.measure(lambda: client.get(url))
+            queries.add(page_queries)
+            elapsed += ms
+            pages += 1
+            cursor = response.json["next_cursor"]
+            if not cursor:
+                break
+        game_id = response.json["games"][0]["id"]
+        _, details, _ = counter.measure(lambda: client.get(f"/game_details/{game_id}"))
+        print(f"{count:>6} {pages:>6} {max(queries):>13} {elapsed / pages:>8.2f} {details:>10}")
+    os.remove(_database)
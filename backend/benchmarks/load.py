@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+"""
+Load generator for the real-time game server.
+
+Simulates pairs of players who register, create and join a game, play it to
+the end with make_move and chat along the way. Reports throughput and
+p50/p95/p99 latency for every event, and can write them as JSON to diff
+between releases.
+
+By default the server runs in this process on a scratch SQLite database and
+a local Redis (or fakeredis with --fake), driven through Flask-SocketIO test
+clients. With --url the clients connect over the network to running workers
+instead (comma-separate several URLs to spread players over them), which
+needs python-socketio[client] and requests. Run from the backend directory:
+
+    python -m benchmarks.load [--games 1000] [--concurrency 16] [--output load.json]
+    python -m benchmarks.load --url http://127.0.0.1:5000,http://127.0.0.1:5001
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+if "--url" not in " ".join(sys.argv):
+    # The in-process server must be configured before it is imported
+    if "--fake" in sys.argv:
+        import fakeredis
+        import redis
+        redis.Redis = fakeredis.FakeRedis
+        redis.from_url = fakeredis.FakeRedis.from_url
+    _database = os.path.join(tempfile.mkdtemp(), "load.db")
+    os.environ["DATABASE_URI"] = f"sqlite:///{_database}"
+    os.environ["SOCKETIO_MESSAGE_QUEUE"] = ""  # The test client can't use one
+
+from src.state import GameState
+
+CHAT_LINES = ("gl hf", "nice move", "hmm", "gg")
+
+
+class Recorder():
+    """Collects the latency and outcome of every event, thread-safely"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, event, seconds, ok=True):
+        with self._lock:
+            self.latencies[event].append(seconds)
+            if not ok:
+                self.errors[event] += 1
+
+    def report(self, elapsed):
+        """Summary per event, with latencies in milliseconds"""
+        def percentile(values, quantile):
+            return values[min(int(quantile * len(values)), len(values) - 1)] * 1000
+
+        events = {}
+        for event, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            events[event] = {
+                "count": len(values),
+                "errors": self.errors[event],
+                "throughput": len(values) / elapsed,
+                "mean_ms": sum(values) / len(values) * 1000,
+                "p50_ms": percentile(values, 0.50),
+                "p95_ms": percentile(values, 0.95),
+                "p99_ms": percentile(values, 0.99),
+            }
+        total = sum(event["count"] for event in events.values())
+        return {"elapsed_s": elapsed, "events_per_s": total / elapsed, "events": events}
+
+
+class InProcessClient():
+    """A player talking to the in-process server through Flask-SocketIO test clients"""
+
+    def __init__(self, username):
+        from src import app, socketio
+        self._app = app
+        self._socketio = socketio
+        self.username = username
+        self.events = []
+
+    def register(self):
+        self._http = self._app.test_client()
+        response = self._http.post("/register", json={
+            "email": f"{self.username}@load", "password": "load", "username": self.username})
+        self._socket = self._socketio.test_client(self._app, flask_test_client=self._http)
+        return response.status_code == 200
+
+    def emit(self, event, data):
+        self._socket.emit(event, data)
+        self.events += [(item["name"], item["args"]) for item in self._socket.get_received()]
+
+    def close(self):
+        self._socket.disconnect()
+
+
+class NetworkClient():
+    """A player talking to a running worker over HTTP and Socket.IO"""
+
+    def __init__(self, username, url):
+        self.username = username
+        self.url = url
+        self.events = []
+
+    def register(self):
+        import requests
+        import socketio
+        http = requests.Session()
+        response = http.post(self.url + "/register", json={
+            "email": f"{self.username}@load", "password": "load", "username": self.username})
+        self._socket = socketio.Client()
+        self._socket.on("*", lambda event, *args: self.events.append((event, list(args))))
+        cookies = "; ".join(f"{key}={value}" for key, value in http.cookies.items())
+        self._socket.connect(self.url, headers={"Cookie": cookies}, transports=["websocket"])
+        return response.ok
+
+    def emit(self, event, data):
+        # Waiting for the acknowledgement makes the latency cover the whole handler
+        self._socket.call(event, data, timeout=10)
+
+    def close(self):
+        self._socket.disconnect()
+
+
+def timed(recorder, event, function, *args):
+    """Run function, recording its latency under event; returns its result"""
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception:
+        recorder.record(event, time.perf_counter() - start, ok=False)
+        raise
+    recorder.record(event, time.perf_counter() - start, ok=result is not False)
+    return result
+
+
+def find_event(client, name, timeout=10):
+    """Wait for the client to receive an event and return its arguments"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for event, args in client.events:
+            if event == name:
+                return args
+        time.sleep(0.001)
+    return None
+
+
+def play_game(make_client, recorder, chat_rate):
+    """Simulate one two-player game from registration to the final move"""
+    tag = uuid.uuid4().hex[:10]
+    players = [make_client(f"x{tag}"), make_client(f"o{tag}")]
+    if not all([timed(recorder, "register", player.register) for player in players]):
+        return
+    creator, joiner = players
+
+    timed(recorder, "create_game", creator.emit, "create_game", {"difficulty": 1})
+    created = find_event(creator, "game_created")
+    if not created:
+        recorder.record("create_game", 0, ok=False)
+        return
+    code = created[0].split()[-1]
+    timed(recorder, "join_game", joiner.emit, "join_game", {"game_code": code})
+
+    # Both players are simulated here, so the board is tracked locally
+    state = GameState()
+    while not state.finished:
+        player = players[state.turn]
+        tile = random.choice(state.free_tiles())
+        timed(recorder, "make_move", player.emit, "make_move",
+              {"game_code": code, "tile_number": tile})
+        state.play(tile)
+        if random.random() < chat_rate:
+            timed(recorder, "chat_message", player.emit, "chat_message",
+                  {"game_code": code, "text": random.choice(CHAT_LINES)})
+    for player in players:
+        if any(event == "move_error" for event, _ in player.events):
+            recorder.record("make_move", 0, ok=False)
+        player.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--chat-rate", type=float, default=0.3,
+                        help="chance of a chat message after each move")
+    parser.add_argument("--url", help="comma-separated worker URLs; in-process if omitted")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--fake", action="store_true", help="use fakeredis in-process")
+    args = parser.parse_args()
+
+    if args.url:
+        urls = args.url.split(",")
+        make_client = lambda username: NetworkClient(username, random.choice(urls))
+    else:
+        from src import app, db
+        with app.app_context():
+            db.create_all()
+        make_client = InProcessClient
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        futures = [pool.submit(play_game, make_client, recorder, args.chat_rate)
+                   for _ in range(args.games)]
+        failed = sum(1 for future in futures if future.exception())
+    results = recorder.report(time.perf_counter() - start)
+    results.update(games=args.games, failed_games=failed, concurrency=args.concurrency,
+                   mode="network" if args.url else "in-process")
+
+    print(f"{args.games} games ({failed} failed), {results['events_per_s']:.0f} events/s")
+    print(f"{'event':>13} {'count':>7} {'errors':>6} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for event, stats in results["events"].items():
+        print(f"{event:>13} {stats['count']:>7} {stats['errors']:>6} {stats['throughput']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if not args.url:
+        os.remove(_database)
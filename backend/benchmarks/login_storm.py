@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""
+Measure move latency while a storm of logins hashes passwords.
+
+A game is played over and over through the Socket.IO test client while
+--threads threads keep logging in. That runs three times: without logins,
+with bcrypt inline in the request threads (PASSWORD_WORKERS=0), and with
+bcrypt in the password pool. Run from the backend directory with:
+
+    python -m benchmarks.login_storm [--seconds 10] [--threads 8] [--fake]
+
+--fake runs against fakeredis instead of a local Redis.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+if "--fake" in sys.argv:
+    import fakeredis
+    import redis
+    redis.Redis = fakeredis.FakeRedis
+    redis.from_url = fakeredis.FakeRedis.from_url
+
+_database = os.path.join(tempfile.mkdtemp(), "login_storm.db")
+os.environ["DATABASE_URI"] = f"sqlite:///{_database}"
+os.environ["SOCKETIO_MESSAGE_QUEUE"] = ""  # The test client can't use one
+
+from src import app, db, socketio
+
+GAME = (0, 3, 1, 4, 2)  # X wins on the fifth move
+
+
+def register(username):
+    client = app.test_client()
+    client.post("/register", json={"email": f"{username}@storm", "password": "storm",
+                                   "username": username})
+    return client
+
+
+def play_games(creator, joiner, seconds):
+    """Play games until seconds have passed; returns the latency of every move"""
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        creator.emit("create_game", {"difficulty": 1})
+        created = [event for event in creator.get_received() if event["name"] == "game_created"]
+        code = created[0]["args"][0].split()[-1]
+        joiner.emit("join_game", {"game_code": code})
+        for number, tile in enumerate(GAME):
+            start = time.perf_counter()
+            (creator, joiner)[number % 2].emit("make_move", {"game_code": code, "tile_number": tile})
+            latencies.append(time.perf_counter() - start)
+        creator.get_received()
+        joiner.get_received()
+    return latencies
+
+
+def storm(stop, counts):
+    client = app.test_client()
+    while not stop.is_set():
+        response = client.post("/login", json={"email": "storm@storm", "password": "storm"})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+def measure(creator, joiner, seconds, threads):
+    stop, counts = threading.Event(), {}
+    stormers = [threading.Thread(target=storm, args=(stop, counts)) for _ in range(threads)]
+    for thread in stormers:
+        thread.start()
+    latencies = sorted(play_games(creator, joiner, seconds))
+    stop.set()
+    for thread in stormers:
+        thread.join()
+    return latencies, counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--fake", action="store_true")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+    register("storm")
+    creator = socketio.test_client(app, flask_test_client=register("creator"))
+    joiner = socketio.test_client(app, flask_test_client=register("joiner"))
+
+    print(f"bcrypt cost {app.config['BCRYPT_LOG_ROUNDS']}, {args.threads} login threads, "
+          f"{app.config['PASSWORD_WORKERS']} pool workers")
+    print(f"{'logins':>8} {'moves':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  login responses")
+    workers = app.config["PASSWORD_WORKERS"]
+    for label, threads, pool in (("none", 0, workers), ("inline", args.threads, 0),
+                                 ("pool", args.threads, workers)):
+        app.config["PASSWORD_WORKERS"] = pool
+        latencies, counts = measure(creator, joiner, args.seconds, threads)
+        quantiles = [latencies[int(q * (len(latencies) - 1))] * 1000 for q in (0.5, 0.95, 0.99)]
+        print(f"{label:>8} {len(latencies):>6} " + " ".join(f"{q:>8.2f}" for q in quantiles)
+              + f"  {dict(sorted(counts.items()))}")
+    os.remove(_database)
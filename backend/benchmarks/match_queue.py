@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+"""
+Benchmark the matchmaking queue with many players waiting.
+
+--players players with random scores join the queue, spread over the last
+minute, and the script times the pairing ticks of `pair_waiting` until the
+queue is empty or no pair is left in reach, then single joins against the
+full queue. Run from the backend directory with:
+
+    python -m benchmarks.match_queue [--players 100000] [--fake]
+
+--fake runs against fakeredis instead of a local Redis.
+"""
+import argparse
+import random
+import sys
+import time
+
+if "--fake" in sys.argv:
+    import fakeredis
+    import redis
+    redis.Redis = fakeredis.FakeRedis
+    redis.from_url = fakeredis.FakeRedis.from_url
+
+from src import app, matchmaking, redis_conn
+
+CHUNK = 10000
+
+
+def fill(players, rng):
+    """Queue players with scores up to 5000 who joined during the last minute"""
+    now = time.time()
+    for start in range(0, players, CHUNK):
+        numbers = range(start, min(start + CHUNK, players))
+        with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.zadd(matchmaking.QUEUE_KEY, {f"bench-{n}": rng.randrange(5000) for n in numbers})
+            pipe.zadd(matchmaking.WAITING_KEY, {f"bench-{n}": now - rng.random() * 60 for n in numbers})
+            pipe.execute()
+
+
+def clear():
+    redis_conn.delete(matchmaking.QUEUE_KEY, matchmaking.WAITING_KEY)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--players", type=int, default=100000)
+    parser.add_argument("--fake", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with app.app_context():
+        clear()
+        fill(args.players, rng)
+        print(f"{args.players} players queued, batches of {app.config['MATCHMAKING_BATCH']}")
+        print(f"{'tick':>5} {'queued':>8} {'pairs':>6} {'ms':>8}")
+        tick, slowest = 0, 0
+        while True:
+            queued = redis_conn.zcard(matchmaking.QUEUE_KEY)
+            start = time.perf_counter()
+            matches = matchmaking.pair_waiting()
+            elapsed = (time.perf_counter() - start) * 1000
+            slowest = max(slowest, elapsed)
+            tick += 1
+            if tick <= 5 or not matches or not tick % 20:
+                print(f"{tick:>5} {queued:>8} {len(matches):>6} {elapsed:>8.2f}")
+            if not matches:
+                break
+        print(f"slowest tick {slowest:.2f} ms")
+
+        clear()
+        fill(args.players, rng)
+        joins = 1000
+        start = time.perf_counter()
+        paired = sum(matchmaking.join(f"joiner-{n}", rng.randrange(5000)) is not None for n in range(joins))
+        print(f"join: {(time.perf_counter() - start) / joins * 1000:.3f} ms each, {paired} of {joins} paired at once")
+        clear()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""
+Benchmark open-game listing and random joins against a growing game history.
+
+Finished games are bulk-inserted into a scratch SQLite database in steps up
+to --max-games. At each step the script times a page of `get_available_games`
+and `join_random_game`, which use the Redis open-games index, and, for small
+histories, the old full scan for comparison. Run from the backend directory:
+
+    python -m benchmarks.matchmaking [--max-games 1000000] [--fake]
+
+--fake runs against fakeredis instead of a local Redis.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+if "--fake" in sys.argv:
+    import fakeredis
+    import redis
+    redis.Redis = fakeredis.FakeRedis
+    redis.from_url = fakeredis.FakeRedis.from_url
+
+_database = os.path.join(tempfile.mkdtemp(), "matchmaking.db")
+os.environ["DATABASE_URI"] = f"sqlite:///{_database}"
+
+from src import app, db, redis_conn
+from src.models import OPEN_GAMES_KEY, Game, GamePlayerAssociation, Player
+
+OPEN_GAMES = 50
+SCAN_LIMIT = 10000
+CHUNK = 50000
+
+
+def add_history(start, stop, player):
+    """Bulk-insert finished games numbered start..stop-1 played by player"""
+    for chunk in range(start, stop, CHUNK):
+        games, players = [], []
+        for number in range(chunk, min(chunk + CHUNK, stop)):
+            game_id = str(uuid.uuid4())
+            games.append({"id": game_id, "code": f"H{number:09d}", "finished": True})
+            players.append({"game_id": game_id, "player_id": player.id})
+        db.session.execute(db.insert(Game), games)
+        db.session.execute(db.insert(GamePlayerAssociation), players)
+        db.session.commit()
+
+
+def timed(function, repeat):
+    """Mean milliseconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def old_scan():
+    """The listing before the index: every game plus one query per game"""
+    return [game for game in Game.query.all() if len(game.game_players) == 1]
+
+
+def join_and_replace(creator, joiner):
+    """Join a random open game, then open a new one so the pool stays the same size"""
+    assert joiner.join_random_game() is not None
+    creator.create_game(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-games", type=int, default=1000000)
+    parser.add_argument("--fake", action="store_true")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        redis_conn.delete(OPEN_GAMES_KEY)
+        creator = Player(username="bench-creator", email="creator@bench", password="-")
+        joiner = Player(username="bench-joiner", email="joiner@bench", password="-")
+        db.session.add_all([creator, joiner])
+        db.session.commit()
+        for _ in range(OPEN_GAMES):
+            creator.create_game(1)
+
+        print(f"{'history':>10} {'list ms':>9} {'join ms':>9} {'scan ms':>9}")
+        size, step = 0, 1000
+        while size < args.max_games:
+            target = min(step, args.max_games)
+            add_history(size, target, creator)
+            size, step = target, step * 10
+            listing = timed(lambda: joiner.get_available_games(1, 20), 200)
+            joining = timed(lambda: join_and_replace(creator, joiner), 20)
+            scan = f"{timed(old_scan, 1):9.1f}" if size <= SCAN_LIMIT else f"{'-':>9}"
+            print(f"{size:>10} {listing:9.3f} {joining:9.3f} {scan}")
+    os.remove(_database)
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+"""
+Micro-benchmark of the AI search for each difficulty level.
+
+Reports the nodes searched, the deepest completed iteration and the time per
+move. Each level runs against a cold transposition table first and then a
+warm one. Run from the backend directory with:
+
+    python -m benchmarks.search
+"""
+import time
+
+from src.search import DIFFICULTY_LEVELS, SearchEngine, TranspositionTable, search_limits
+from src.state import GameState, O, X
+
+# Opening and middle-game positions as (x tiles, o tiles, side to move)
+POSITIONS = [
+    ((), (), X),
+    ((4,), (), O),
+    ((0,), (4,), X),
+    ((0, 8), (4,), O),
+    ((0, 4), (8, 2), X),
+]
+
+
+def to_state(x_tiles, o_tiles, turn):
+    """Build a GameState from the tiles held by each marker"""
+    return GameState(sum(1 << t for t in x_tiles), sum(1 << t for t in o_tiles), turn)
+
+
+def run(max_depth, time_budget, table):
+    """Search every position once, returning (nodes, max depth, mean ms per move)"""
+    nodes, depth, elapsed = 0, 0, 0.0
+    for position in POSITIONS:
+        engine = SearchEngine(table)
+        start = time.perf_counter()
+        engine.search(to_state(*position), max_depth, time_budget)
+        elapsed += time.perf_counter() - start
+        nodes += engine.nodes
+        depth = max(depth, engine.depth)
+    return nodes, depth, elapsed / len(POSITIONS) * 1000
+
+
+if __name__ == "__main__":
+    # Levels from PERFECT_PLAY up use the solved table; "full" shows what an
+    # unbounded search would cost instead
+    levels = [(str(level), *search_limits(level)) for level in sorted(DIFFICULTY_LEVELS)]
+    levels.append(("full", 9, 10.0))
+    print(f"{'difficulty':>10} {'table':>5} {'nodes':>8} {'depth':>5} {'ms/move':>8}")
+    for name, max_depth, time_budget in levels:
+        table = TranspositionTable()
+        for label in ("cold", "warm"):
+            nodes, depth, ms = run(max_depth, time_budget, table)
+            print(f"{name:>10} {label:>5} {nodes:>8} {depth:>5} {ms:>8.3f}")
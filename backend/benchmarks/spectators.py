@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""
+Measure what broadcasting a game's moves to its spectators costs on the server.
+
+Spectator sockets are registered directly with the Socket.IO server, which
+encodes every packet written to them the way the WebSocket transport does
+but sends nothing, so only the server's own work is timed. For each
+spectator count, a game of --moves moves is broadcast three ways:
+
+    per socket  one emit per spectator and move, each serialized separately
+    per move    one room emit per move (SPECTATOR_TICK = 0)
+    per tick    one room emit per --batch moves, as `src.spectators` does
+
+Run from the backend directory with:
+
+    python -m benchmarks.spectators [--spectators 10,100,1000,10000] [--moves 500] [--batch 4]
+"""
+import argparse
+import os
+import time
+import uuid
+
+os.environ["SOCKETIO_MESSAGE_QUEUE"] = ""  # Measure this process only
+
+from src import app, socketio, spectators
+from src.state import GameState
+
+NAMESPACE = "/"
+
+
+def add_spectators(code, count):
+    """Registers count fake spectator sockets in the game's spectator room; returns their sids"""
+    manager = socketio.server.manager
+    sids = []
+    for _ in range(count):
+        sid = manager.connect(uuid.uuid4().hex, NAMESPACE)
+        manager.enter_room(sid, NAMESPACE, spectators.room(code))
+        sids.append(sid)
+    return sids
+
+
+def remove_spectators(sids):
+    for sid in sids:
+        socketio.server.manager.disconnect(sid, NAMESPACE)
+
+
+def deltas(count):
+    """count deltas of successive moves, starting a new game whenever one ends"""
+    state, result = GameState(), []
+    for version in range(1, count + 1):
+        previous = state.copy()
+        tile = state.free_tiles()[0]
+        state.play(tile)
+        state.version = version
+        result.append(state.delta(previous))
+        if state.finished:
+            state = GameState(version=version)
+    return result
+
+
+def per_socket(code, sids, moves, batch):
+    for delta in moves:
+        for sid in sids:
+            socketio.emit("game_deltas", [delta], to=sid)
+
+
+def per_move(code, sids, moves, batch):
+    for delta in moves:
+        socketio.emit("game_deltas", [delta], to=spectators.room(code))
+
+
+def per_tick(code, sids, moves, batch):
+    for start in range(0, len(moves), batch):
+        for delta in moves[start:start + batch]:
+            spectators.publish(code, delta)
+        spectators.broadcast()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--spectators", default="10,100,1000,10000")
+    parser.add_argument("--moves", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=4, help="moves per tick")
+    args = parser.parse_args()
+
+    written = [0]
+
+    def write(eio_sid, eio_packet):
+        eio_packet.encode()  # What the transport does for every socket
+        written[0] += 1
+    socketio.server._send_eio_packet = write
+    app.config["SPECTATOR_TICK"] = 1  # Only broadcast() sends
+
+    moves = deltas(args.moves)
+    print(f"{args.moves} moves, {args.batch} per tick; server time per move")
+    print(f"{'spectators':>10} {'per socket':>12} {'per move':>12} {'per tick':>12} "
+          f"{'per spectator (tick)':>21}")
+    for count in map(int, args.spectators.split(",")):
+        code = uuid.uuid4().hex[:8]
+        sids = add_spectators(code, count)
+        costs = []
+        for strategy in (per_socket, per_move, per_tick):
+            written[0] = 0
+            start = time.perf_counter()
+            strategy(code, sids, moves, args.batch)
+            costs.append((time.perf_counter() - start) / args.moves)
+        remove_spectators(sids)
+        print(f"{count:>10} " + " ".join(f"{cost * 1e6:>9.0f} µs" for cost in costs)
+              + f" {costs[2] / count * 1e9:>18.0f} ns")
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+"""
+Benchmark the engine on boards of every size, from 3x3 up to 15x15.
+
+For each variant it reports:
+
+    check µs     win check per move, testing only the lines through the tile
+    scan µs      the same check testing every line of the board, as before variants
+    games/s      random games played to the end with GameState.play
+    script µs    a move through the Lua move script, which stores it in Redis
+    AI ms        the AI's reply in the middle of a game, per search difficulty
+    AI max ms    the slowest of those replies, which should stay near the 5/10/20 ms budgets
+
+Run from the backend directory with:
+
+    python -m benchmarks.variants [--games 200] [--fake]
+
+--fake runs the move script on fakeredis instead of a local Redis.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+if "--fake" in sys.argv:
+    import fakeredis
+    import redis
+    redis.Redis = fakeredis.FakeRedis
+    redis.from_url = fakeredis.FakeRedis.from_url
+os.environ["SOCKETIO_MESSAGE_QUEUE"] = ""
+
+from src import app, redis_conn
+from src.game import apply_move, players_key, save_game_state
+from src.search import SearchEngine, TranspositionTable, search_limits
+from src.state import GameState, O, X, variant
+
+VARIANTS = ((3, 3), (7, 4), (10, 5), (15, 5))
+
+
+def random_games(game_variant, count, rng):
+    """Plays count random games; returns the tiles of each"""
+    games = []
+    for _ in range(count):
+        state, tiles = GameState(variant=game_variant), []
+        free = state.free_tiles()
+        rng.shuffle(free)
+        while not state.finished:
+            tiles.append(free.pop())
+            state.play(tiles[-1])
+        games.append(tiles)
+    return games
+
+
+def time_checks(game_variant, games):
+    """Seconds per move of the incremental check and of a scan of every line"""
+    def scan(mask, tile):
+        return any(mask & line == line for line in game_variant.win_masks)
+
+    results = []
+    for check in (game_variant.wins, scan):
+        moves, start = 0, time.perf_counter()
+        for tiles in games:
+            masks = [0, 0]
+            for number, tile in enumerate(tiles):
+                masks[number % 2] |= 1 << tile
+                check(masks[number % 2], tile)
+            moves += len(tiles)
+        results.append((time.perf_counter() - start) / moves)
+    return results
+
+
+def time_playouts(game_variant, games):
+    start = time.perf_counter()
+    for tiles in games:
+        state = GameState(variant=game_variant)
+        for tile in tiles:
+            state.play(tile)
+    return len(games) / (time.perf_counter() - start)
+
+
+def time_script(game_variant, games):
+    """Seconds per move through the move script"""
+    moves, start = 0, time.perf_counter()
+    for number, tiles in enumerate(games[:20]):
+        code = f"bench-variant-{number}"
+        save_game_state(code, GameState(variant=game_variant))
+        redis_conn.hset(players_key(code), mapping={"x": X, "o": O})
+        for turn, tile in enumerate(tiles):
+            apply_move(code, tile, ("x", "o")[turn % 2])
+        moves += len(tiles)
+        redis_conn.delete(code, players_key(code), f"{code}:moves", f"{code}:history")
+    return (time.perf_counter() - start) / moves
+
+
+def time_ai(game_variant, games, difficulty):
+    """Mean and most seconds of an AI reply a third of the way into the games"""
+    max_depth, budget = search_limits(difficulty)
+    elapsed, worst = 0, 0
+    positions = games[:10]
+    for tiles in positions:
+        state = GameState(variant=game_variant)
+        for tile in tiles[:max(1, len(tiles) // 3)]:
+            state.play(tile)
+        if state.finished:
+            state.undo(tiles[len(tiles) // 3 - 1])
+        start = time.perf_counter()
+        SearchEngine(TranspositionTable()).search(state, max_depth, budget)
+        elapsed += time.perf_counter() - start
+        worst = max(worst, time.perf_counter() - start)
+    return elapsed / len(positions), worst
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--fake", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"{'variant':>12} {'lines':>6} {'check µs':>9} {'scan µs':>8} {'games/s':>8} "
+          f"{'script µs':>10} {'AI ms (1/2/3)':>20} {'AI max ms (1/2/3)':>20}")
+    with app.app_context():
+        for size, length in VARIANTS:
+            game_variant = variant(size, length)
+            games = random_games(game_variant, args.games, rng)
+            check, scan = time_checks(game_variant, games)
+            ai = [time_ai(game_variant, games, difficulty) for difficulty in (1, 2, 3)]
+            print(f"{f'{size}x{size}/{length}':>12} {len(game_variant.lines):>6} {check * 1e6:>9.2f} "
+                  f"{scan * 1e6:>8.2f} {time_playouts(game_variant, games):>8.0f} "
+                  f"{time_script(game_variant, games) * 1e6:>10.0f} "
+                  + "/".join(f"{mean * 1000:.1f}" for mean, _ in ai).rjust(20) + " "
+                  + "/".join(f"{worst * 1000:.1f}" for _, worst in ai).rjust(20))
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""
+Start several Socket.IO workers that share rooms through the message queue.
+
+This is a launcher for local development and tests: the workers run
+Werkzeug's development server, which it opts into with
+ALLOW_UNSAFE_WERKZEUG. For production, run wsgi.py under gunicorn as the
+README describes. Worker i listens on port + i. Put them behind a load balancer with sticky
+sessions, since a Socket.IO connection must keep talking to the same worker.
+All workers need the same SECRET_KEY to accept each other's session cookies;
+one is generated for this launch if it is not set.
+"""
+import argparse
+import os
+import secrets
+import signal
+import subprocess
+import sys
+
+RUN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run.py")
+
+
+def start_workers(count, host="127.0.0.1", port=5000, env=None):
+    """Start count workers on consecutive ports and return their processes"""
+    env = dict(os.environ if env is None else env)
+    env.setdefault("SECRET_KEY", secrets.token_hex(32))
+    env.setdefault("SOCKETIO_MESSAGE_QUEUE", env.get("REDIS_URL", "redis://127.0.0.1:6379/0"))
+    if not env["SOCKETIO_MESSAGE_QUEUE"]:
+        sys.exit("Several workers need a SOCKETIO_MESSAGE_QUEUE")
+    env["FLASK_DEBUG"] = "0"
+    env["ALLOW_UNSAFE_WERKZEUG"] = "1"  # Development server, see the module docstring
+    env["HOST"] = host
+    workers = []
+    for number in range(count):
+        env["PORT"] = str(port + number)
+        workers.append(subprocess.Popen([sys.executable, RUN_SCRIPT], env=dict(env),
+                                        cwd=os.path.dirname(RUN_SCRIPT)))
+    return workers
+
+
+def stop_workers(workers):
+    """Stop the workers and wait for them to exit"""
+    for worker in workers:
+        worker.send_signal(signal.SIGTERM)
+    for worker in workers:
+        worker.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    workers = start_workers(args.workers, args.host, args.port)
+    print(f"Started {args.workers} development workers on ports "
+          f"{args.port}-{args.port + args.workers - 1}; not for production use")
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(workers)
@@ -0,0 +1,56 @@
+"""Number the moves of a game and allow AI moves without a player
+
+Revision ID: 5b1c2d7e9a01
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+Databases created with `db.create_all()` before this revision lack the
+moves.number column and have moves.player_id as NOT NULL. Databases created
+after it already match, so each step checks the current schema first.
+Existing moves are numbered in the order they were created.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1c2d7e9a01'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _moves_columns():
+    return {column['name']: column for column in sa.inspect(op.get_bind()).get_columns('moves')}
+
+
+def upgrade():
+    columns = _moves_columns()
+    with op.batch_alter_table('moves', schema=None) as batch_op:
+        if 'number' not in columns:
+            batch_op.add_column(sa.Column('number', sa.Integer(), nullable=True))
+        if not columns['player_id']['nullable']:
+            batch_op.alter_column('player_id', existing_type=sa.String(length=36), nullable=True)
+
+    if 'number' not in columns:
+        bind = op.get_bind()
+        moves = sa.table('moves', sa.column('id'), sa.column('game_id'),
+                         sa.column('created_at'), sa.column('number'))
+        rows = bind.execute(sa.select(moves.c.id, moves.c.game_id)
+                            .order_by(moves.c.game_id, moves.c.created_at, moves.c.id))
+        numbers, game_id, number = [], None, 0
+        for move_id, move_game_id in rows:
+            number = number + 1 if move_game_id == game_id else 1
+            game_id = move_game_id
+            numbers.append({'move_id': move_id, 'move_number': number})
+        if numbers:
+            bind.execute(moves.update().where(moves.c.id == sa.bindparam('move_id'))
+                         .values(number=sa.bindparam('move_number')), numbers)
+
+
+def downgrade():
+    # AI moves have no player, so they can't be kept once player_id is NOT NULL again
+    op.execute("DELETE FROM moves WHERE player_id IS NULL")
+    with op.batch_alter_table('moves', schema=None) as batch_op:
+        batch_op.alter_column('player_id', existing_type=sa.String(length=36), nullable=False)
+        batch_op.drop_column('number')
@@ -0,0 +1,29 @@
+"""Index game_players.game_id for the open games lookups
+
+Revision ID: 8d3f4a6b2c10
+Revises: 5b1c2d7e9a01
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f4a6b2c10'
+down_revision = '5b1c2d7e9a01'
+branch_labels = None
+depends_on = None
+
+
+def _game_players_indexes():
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('game_players')}
+
+
+def upgrade():
+    if 'ix_game_players_game_id' not in _game_players_indexes():
+        op.create_index('ix_game_players_game_id', 'game_players', ['game_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_game_players_game_id', table_name='game_players')
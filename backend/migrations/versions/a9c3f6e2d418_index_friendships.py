@@ -0,0 +1,34 @@
+"""Index friendships by either player and friend requests by receiver
+
+Revision ID: a9c3f6e2d418
+Revises: f5d1e8a3b692
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c3f6e2d418'
+down_revision = 'f5d1e8a3b692'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_friendships_player1_id', 'friendships', 'player1_id'),
+    ('ix_friendships_player2_id', 'friendships', 'player2_id'),
+    ('ix_friend_requests_receiver_id', 'friend_requests', 'receiver_id'),
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, column in INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, [column], unique=False)
+
+
+def downgrade():
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,30 @@
+"""Store the analysis of each finished game's moves
+
+Revision ID: b7e4d2a9c615
+Revises: a9c3f6e2d418
+Create Date: 2026-10-17 14:00:00.000000
+
+Games finished earlier are analysed by the background task over time, or
+all at once with `flask --app src analyse-games`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d2a9c615'
+down_revision = 'a9c3f6e2d418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('games')}
+    if 'analysis' not in columns:
+        with op.batch_alter_table('games', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('analysis', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.drop_column('analysis')
@@ -0,0 +1,28 @@
+"""Keep the final state of archived games
+
+Revision ID: c4e7a9d2f315
+Revises: 8d3f4a6b2c10
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a9d2f315'
+down_revision = '8d3f4a6b2c10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('games')}
+    if 'state' not in columns:
+        with op.batch_alter_table('games', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('state', sa.LargeBinary(length=16), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.drop_column('state')
@@ -0,0 +1,37 @@
+"""Index games, moves and messages by their last write for incremental exports
+
+Revision ID: d3a8f1c6e527
+Revises: b7e4d2a9c615
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a8f1c6e527'
+down_revision = 'b7e4d2a9c615'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_games_updated_at_id', 'games'),
+    ('ix_moves_updated_at_id', 'moves'),
+    ('ix_messages_updated_at_id', 'messages'),
+)
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    for name, table in INDEXES:
+        if name not in _indexes(table):
+            op.create_index(name, table, ['updated_at', 'id'], unique=False)
+
+
+def downgrade():
+    for name, table in INDEXES:
+        op.drop_index(name, table_name=table)
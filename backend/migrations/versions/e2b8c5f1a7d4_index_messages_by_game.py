@@ -0,0 +1,30 @@
+"""Index messages by game and time for paging the chat history
+
+Revision ID: e2b8c5f1a7d4
+Revises: c4e7a9d2f315
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8c5f1a7d4'
+down_revision = 'c4e7a9d2f315'
+branch_labels = None
+depends_on = None
+
+
+def _messages_indexes():
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('messages')}
+
+
+def upgrade():
+    if 'ix_messages_game_id_created_at' not in _messages_indexes():
+        op.create_index('ix_messages_game_id_created_at', 'messages',
+                        ['game_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_game_id_created_at', table_name='messages')
@@ -0,0 +1,33 @@
+"""Keep each player's wins, losses, draws and streaks
+
+Revision ID: f5d1e8a3b692
+Revises: e2b8c5f1a7d4
+Create Date: 2026-10-17 12:00:00.000000
+
+Fill them in for games that ended earlier with `flask --app src rebuild-stats`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5d1e8a3b692'
+down_revision = 'e2b8c5f1a7d4'
+branch_labels = None
+depends_on = None
+
+STATS = ('wins', 'losses', 'draws', 'streak', 'best_streak')
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('players')}
+    with op.batch_alter_table('players', schema=None) as batch_op:
+        for name in STATS:
+            if name not in columns:
+                batch_op.add_column(sa.Column(name, sa.Integer(), nullable=True, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('players', schema=None) as batch_op:
+        for name in STATS:
+            batch_op.drop_column(name)
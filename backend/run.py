@@ -2,7 +2,20 @@
 """
 Run the flask app when executed
 """
-from src import app, socketio
+import os
+
+from src import analysis, app, chat, socketio, spectators
+from src.game import game_sweeper, matchmaker, move_flusher
 
 if __name__ == "__main__":
-    socketio.run(app, debug=True)
\ No newline at end of file
+    socketio.start_background_task(move_flusher)
+    socketio.start_background_task(game_sweeper)
+    socketio.start_background_task(spectators.broadcaster)
+    socketio.start_background_task(chat.chat_flusher)
+    socketio.start_background_task(analysis.game_analyser)
+    socketio.start_background_task(matchmaker)
+    # Werkzeug is a development server and refuses to run outside debug mode
+    # unless ALLOW_UNSAFE_WERKZEUG=1; deploy with wsgi.py instead (see README)
+    socketio.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", 5000)),
+                 debug=os.getenv("FLASK_DEBUG", "1") == "1",
+                 allow_unsafe_werkzeug=os.getenv("ALLOW_UNSAFE_WERKZEUG") == "1")
@@ -24,10 +24,15 @@ login_manager = LoginManager(app)
 bcrypt = Bcrypt(app) 
 login_manager = LoginManager(app)
 server_session = Session(app)
-socketio = SocketIO(app, manage_session=False)
+socketio = SocketIO(app, manage_session=False,
+                    message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"] or None)
 
 # Initialize Redis for socket.io session management
-redis_conn = redis.Redis(host='localhost', port=6379, db=0)
+redis_conn = redis.from_url(app.config["REDIS_URL"])
+
+# Registered before the routes so request timings include every other hook
+from src import metrics
+from src import identity
 
 cors = CORS(app, resources={
     r"/*": {"origins": "*"}
@@ -35,4 +40,5 @@ cors = CORS(app, resources={
 
 from src.models import *
 from src.game import *
-from src.routes import *
\ No newline at end of file
+from src.routes import *
+from src.commands import *
\ No newline at end of file
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""
+Post-game analysis, telling players which of their moves lost ground.
+
+Every position of a finished game is searched, to the end on a 3x3 board
+and ANALYSIS_DEPTH plies deep on larger ones, and each move is rated
+against the best move there:
+
+    best        nothing was lost
+    inaccuracy  the score dropped, but best play still reaches the same result
+    blunder     a forced win was given up, or a forced loss let in
+
+Openings and common lines repeat from game to game, so scores are memoized
+by position across games. A background task analyses the archived games
+that have no analysis yet, ANALYSIS_BATCH at a time, and stores it in their
+row, where `/game_details` serves it as it is, dropping the game's cached JSON.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+from src import app, db, redis_conn, response_cache, socketio
+from src.models import Game, Move
+from src.search import WIN_SCORE, SearchEngine, TranspositionTable
+from src.state import CLASSIC, GameState, variant
+
+BEST, INACCURACY, BLUNDER = "best", "inaccuracy", "blunder"
+# Positions whose scores are kept between batches
+CACHE_SIZE = 100000
+# Only one worker analyses at a time
+ANALYSIS_LOCK_KEY = "games:analysing"
+
+# Positions seen while analysing are kept apart from the live AI's table
+_table = TranspositionTable()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def position_score(size, win_length, x_mask, o_mask, depth):
+    """
+    Returns (score, best move) of an unfinished position for the side to move,
+    searched depth plies deep. X moves first, so the markers tell whose turn it is.
+    """
+    state = GameState(x_mask, o_mask, variant=variant(size, win_length))
+    state.turn = state.moves % 2
+    return SearchEngine(_table).score(state, depth)
+
+
+def _search_depth(state):
+    """Plies to search a position: all that are left on 3x3, else at most ANALYSIS_DEPTH"""
+    remaining = state.variant.tiles - state.moves
+    if state.variant is CLASSIC:
+        return remaining
+    return min(app.config["ANALYSIS_DEPTH"], remaining)
+
+
+def _score(state, depth):
+    """(score, best move) of the state for the side to move; a finished game has no move"""
+    if state.finished:
+        empty = state.variant.tiles - state.moves
+        return (0 if state.winner == "Draw" else -(WIN_SCORE + empty)), None
+    game_variant = state.variant
+    return position_score(game_variant.size, game_variant.win_length,
+                          state.x_mask, state.o_mask, depth)
+
+
+def rate(best, played):
+    """Rating of a move scoring played where the best move scores best, for the side that moved"""
+    if played >= best:
+        return BEST
+    if best >= WIN_SCORE > played or played <= -WIN_SCORE < best:
+        return BLUNDER
+    return INACCURACY
+
+
+def analyse_moves(game_variant, tiles):
+    """
+    Rate each move of a game, given the tiles played in order. Analysis stops
+    at a move that could not have been played.
+    Returns a list of dicts with the move's 'number', 'tile', 'rating', the
+    score it 'lost' and the 'best_tile' in its place.
+    """
+    state = GameState(variant=game_variant)
+    annotations = []
+    for number, tile in enumerate(tiles, start=1):
+        if state.finished or not state.is_free(tile):
+            break
+        depth = _search_depth(state)
+        best, best_tile = _score(state, depth)
+        state.play(tile)
+        played = -_score(state, depth - 1)[0]
+        annotations.append({
+            "number": number,
+            "tile": tile,
+            "rating": rate(best, played),
+            "lost": max(best - played, 0),
+            "best_tile": best_tile,
+        })
+    return annotations
+
+
+def analyse_games(games):
+    """
+    Analyse finished games together and store the results in their rows, in one
+    statement. Their moves are loaded in one query. Returns the number analysed.
+    """
+    if not games:
+        return 0
+    tiles = {game.id: [] for game in games}
+    moves = (db.session.query(Move.game_id, Move.tile_number)
+             .filter(Move.game_id.in_(tiles))
+             .order_by(Move.game_id, Move.number))
+    for game_id, tile_number in moves:
+        tiles[game_id].append(tile_number)
+
+    analysed_at = datetime.utcnow()
+    rows = []
+    for game in games:
+        game_variant = GameState.unpack(game.state).variant if game.state else CLASSIC
+        rows.append({"id": game.id, "analysis": analyse_moves(game_variant, tiles[game.id]),
+                     "updated_at": analysed_at})
+    db.session.execute(db.update(Game), rows)
+    db.session.commit()
+    response_cache.invalidate(*(row["id"] for row in rows))
+    return len(rows)
+
+
+def analyse_pending(limit):
+    """
+    Analyse up to limit archived games that have no analysis yet, oldest first.
+    Returns the number analysed, or None if another worker is analysing.
+    """
+    if not redis_conn.set(ANALYSIS_LOCK_KEY, 1, nx=True, ex=60):
+        return None
+    try:
+        games = (Game.query
+                 .filter(Game.finished.is_(True), Game.state.isnot(None), Game.analysis.is_(None))
+                 .order_by(Game.updated_at)
+                 .limit(limit)
+                 .all())
+        return analyse_games(games)
+    finally:
+        redis_conn.delete(ANALYSIS_LOCK_KEY)
+
+
+def game_analyser():
+    """Background task that analyses finished games every ANALYSIS_INTERVAL seconds"""
+    if not app.config["ANALYSIS_INTERVAL"]:
+        return
+    while True:
+        socketio.sleep(app.config["ANALYSIS_INTERVAL"])
+        with app.app_context():
+            try:
+                analyse_pending(app.config["ANALYSIS_BATCH"])
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Analysing games failed")
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+"""
+Game chat, kept in Redis while it is live and written to SQL in batches.
+
+A message goes to its game's capped list of recent messages, which joining
+players get straight away, and to a queue that a background task
+bulk-inserts into the messages table every CHAT_FLUSH_INTERVAL seconds.
+The queue survives restarts, and a failed insert puts its batch back.
+Older messages are paged from SQL with `Game.get_messages`.
+
+Each connection may send CHAT_BURST messages at once and CHAT_RATE per
+second after that; the buckets live in the worker holding the connection.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from src import app, db, redis_conn, response_cache, socketio
+from src.models import Game, Message
+
+# Queue of messages not yet written to the messages table
+PENDING_MESSAGES_KEY = "chat:pending"
+# How many recent messages of a game are kept in Redis for joining players
+RECENT_MESSAGES = 50
+# Most messages written by one insert
+FLUSH_BATCH = 1000
+# Longest message accepted, in characters
+MAX_LENGTH = 500
+# Most game ids remembered per worker, far more than it has games being chatted in
+GAME_IDS_CACHED = 10000
+
+_lock = threading.Lock()
+# sid -> [tokens left, time they were counted]
+_buckets = {}
+# game code -> game id, which never changes, least recently used first
+_game_ids = OrderedDict()
+
+
+def recent_key(game_code):
+    """Redis key of the list of a game's recent messages"""
+    return f"{game_code}:chat"
+
+
+def allow(sid):
+    """Whether the connection may send a message now, taking a token if so"""
+    now = time.monotonic()
+    burst = app.config["CHAT_BURST"]
+    with _lock:
+        bucket = _buckets.setdefault(sid, [burst, now])
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * app.config["CHAT_RATE"])
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+
+def forget(sid):
+    """Drops the rate limit bucket of a closed connection"""
+    with _lock:
+        _buckets.pop(sid, None)
+
+
+def game_id(game_code):
+    """
+    The id of the game with the given code, or None if there is no such game.
+    Ids are remembered for the GAME_IDS_CACHED games chatted in most recently.
+    """
+    with _lock:
+        if game_code in _game_ids:
+            _game_ids.move_to_end(game_code)
+            return _game_ids[game_code]
+    found = db.session.query(Game.id).filter_by(code=game_code).scalar()
+    if found is None:
+        return None
+    with _lock:
+        _game_ids[game_code] = found
+        if len(_game_ids) > GAME_IDS_CACHED:
+            _game_ids.popitem(last=False)
+    return found
+
+
+def post(game_code, game_id, player_id, text):
+    """Adds a message to a game's recent messages and queues it for SQL. Returns its dict"""
+    message = {
+        "id": str(uuid.uuid4()),
+        "text": text,
+        "player_id": player_id,
+        "game_id": game_id,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    entry = json.dumps(message)
+    key = recent_key(game_code)
+    with redis_conn.pipeline() as pipe:
+        pipe.rpush(key, entry)
+        pipe.ltrim(key, -RECENT_MESSAGES, -1)
+        pipe.expire(key, app.config["GAME_TTL"])
+        pipe.rpush(PENDING_MESSAGES_KEY, entry)
+        pipe.execute()
+    return message
+
+
+def recent(game_code):
+    """A game's recent messages, oldest first"""
+    return [json.loads(entry) for entry in redis_conn.lrange(recent_key(game_code), 0, -1)]
+
+
+def flush_messages(limit=FLUSH_BATCH):
+    """
+    Write up to limit queued messages to the messages table in one insert.
+    The batch is taken out of the queue atomically, and put back if the insert fails.
+    Returns the number of messages written.
+    """
+    with redis_conn.pipeline() as pipe:
+        pipe.lrange(PENDING_MESSAGES_KEY, 0, limit - 1)
+        pipe.ltrim(PENDING_MESSAGES_KEY, limit, -1)
+        entries = pipe.execute()[0]
+    if not entries:
+        return 0
+
+    written_at = datetime.utcnow()
+    rows = []
+    for entry in entries:
+        message = json.loads(entry)
+        created_at = datetime.fromisoformat(message["created_at"])
+        rows.append(dict(message, created_at=created_at, updated_at=written_at))
+    try:
+        db.session.execute(db.insert(Message), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        redis_conn.lpush(PENDING_MESSAGES_KEY, *reversed(entries))
+        raise
+    response_cache.invalidate(*(row["game_id"] for row in rows))
+    return len(rows)
+
+
+def flush_all():
+    """Write out every queued message, in batches. Returns the number written"""
+    written = 0
+    while True:
+        count = flush_messages()
+        written += count
+        if count < FLUSH_BATCH:
+            return written
+
+
+def chat_flusher():
+    """Background task that writes the queued messages every CHAT_FLUSH_INTERVAL seconds"""
+    while True:
+        socketio.sleep(app.config["CHAT_FLUSH_INTERVAL"])
+        with app.app_context():
+            try:
+                flush_all()
+            except Exception:
+                app.logger.exception("Writing chat messages failed")
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""
+Maintenance commands, run with `flask --app src <command>`
+"""
+import os
+
+import click
+
+from src.game import recount_archived_games
+from src.models import Game, Player
+from src import analysis, app, db, export, leaderboard
+
+
+@app.cli.command("rebuild-open-games")
+def rebuild_open_games():
+    """Rebuild the Redis index of games waiting for a second player"""
+    size = Game.rebuild_open_games_index()
+    click.echo(f"Indexed {size} open games")
+
+
+@app.cli.command("rebuild-leaderboard")
+def rebuild_leaderboard():
+    """Rebuild the Redis leaderboard from the players table"""
+    players = db.session.query(Player.id, Player.username, Player.score).yield_per(1000)
+    count = leaderboard.rebuild(players)
+    click.echo(f"Ranked {count} players")
+
+
+@app.cli.command("recount-archived-games")
+def recount_archived():
+    """Reset the Redis count of archived games from the games table"""
+    count = recount_archived_games()
+    click.echo(f"Counted {count} archived games")
+
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats():
+    """Recompute the players' wins, losses, draws and streaks from the finished games"""
+    count = Player.rebuild_stats()
+    click.echo(f"Updated the stats of {count} players")
+
+
+@app.cli.command("selfplay")
+@click.option("--players", default="random,1,2,3,4", show_default=True,
+              help="Comma separated difficulties, or random; every ordered pair plays")
+@click.option("--games", default=1000, show_default=True, help="Games per pair of players and opening")
+@click.option("--size", default=3, show_default=True, help="Board size")
+@click.option("--win-length", default=3, show_default=True, help="Markers in a row that win")
+@click.option("--opening", "openings", type=int, multiple=True,
+              help="Tile of X's first move, repeatable; every tile by default")
+@click.option("--workers", default=os.cpu_count(), show_default=True, help="Processes, 0 to play inline")
+@click.option("--seed", default=0, show_default=True)
+def self_play(players, games, size, win_length, openings, workers, seed):
+    """Play the AI against itself and random players, and print the outcomes per opening"""
+    from src import selfplay as simulator  # Imported here, as only this command needs NumPy
+
+    players = [player.strip() for player in players.split(",")]
+    for player in players:
+        if player != simulator.RANDOM and not player.isdigit():
+            raise click.BadParameter(f"{player} is neither a difficulty nor {simulator.RANDOM}",
+                                     param_hint="--players")
+    openings = openings or list(range(size * size))
+    outcomes = simulator.simulate(size, win_length, players, games, openings, workers, seed)
+
+    click.echo(f"{'X':>8} {'O':>8} {'opening':>8} {'games':>8} {'X wins':>8} {'draws':>8} {'O wins':>8}")
+    for (x_player, o_player), counts in outcomes.items():
+        for opening, row in zip(list(openings) + ["all"], list(counts) + [counts.sum(axis=0)]):
+            rates = "".join(f"{count / row.sum():>9.1%}" for count in row)
+            click.echo(f"{x_player:>8} {o_player:>8} {opening:>8} {row.sum():>8}{rates}")
+
+
+@app.cli.command("analyse-games")
+@click.option("--batch", default=500, show_default=True, help="Games analysed together")
+def analyse_games(batch):
+    """Analyse the moves of every finished game that has no analysis yet"""
+    total = 0
+    while True:
+        count = analysis.analyse_pending(batch)
+        if count is None:
+            raise click.ClickException("Another worker is analysing games, try again later")
+        if not count:
+            break
+        total += count
+    click.echo(f"Analysed {total} games")
+
+
+def _time_option(context, param, value):
+    """Parses a time option given in ISO 8601"""
+    try:
+        return value and export.parse_time(value)
+    except ValueError:
+        raise click.BadParameter(f"{value} is not an ISO 8601 time")
+
+
+@app.cli.command("export")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--table", "tables", type=click.Choice(list(export.TABLES)), multiple=True,
+              help="Table to export, repeatable; every table by default")
+@click.option("--since", callback=_time_option,
+              help="Only rows written since this UTC time, e.g. the until of the last export")
+@click.option("--until", callback=_time_option,
+              help="Only rows written before this UTC time; a minute ago by default")
+@click.option("--level", default=export.COMPRESS_LEVEL, show_default=True, help="gzip level")
+def export_tables(directory, tables, since, until, level):
+    """Export tables as gzip-compressed NDJSON, to <table>.ndjson.gz in directory"""
+    until = until or export.default_until()
+    os.makedirs(directory, exist_ok=True)
+    for table in tables or export.TABLES:
+        path = os.path.join(directory, f"{table}.ndjson.gz")
+        chunks = _LineCounter(export.rows(table, since, until))
+        # Written under another name first, so a file that is there is complete
+        try:
+            with open(path + ".part", "wb") as output:
+                for data in export.gzipped(chunks, level):
+                    output.write(data)
+        except BaseException:
+            os.remove(path + ".part")
+            raise
+        os.replace(path + ".part", path)
+        click.echo(f"Exported {chunks.lines} {table} to {path}")
+    click.echo(f"Until {until.isoformat()}")
+
+
+class _LineCounter():
+    """Passes chunks of NDJSON through, counting their lines"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.lines = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.lines += chunk.count(b"\n")
+            yield chunk
@@ -7,7 +7,8 @@ import os, redis
 
 class Config:
     """Configuration class for the flask application"""
-    SECRET_KEY = os.urandom(32)
+    # Set SECRET_KEY when running several workers, so they all accept the same session cookies
+    SECRET_KEY = os.getenv("SECRET_KEY") or os.urandom(32)
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URI", 'sqlite:///users.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
@@ -15,4 +16,75 @@ class Config:
     SESSION_TYPE = "redis"
     SESSION_PERMANENT = False
     SESSION_USE_SIGNER = True
-    SESSION_REDIS = redis.from_url("redis://127.0.0.1:6379")
+    REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+    SESSION_REDIS = redis.from_url(REDIS_URL)
+
+    # Message queue through which Socket.IO workers share rooms and broadcasts,
+    # so several processes can serve the same games. Set it to an empty string
+    # to run a single process without one.
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", REDIS_URL)
+
+    # Moves are queued in Redis during play and written to SQL when the game ends.
+    # Games without a move for MOVE_FLUSH_IDLE seconds are written out by a
+    # background task running every MOVE_FLUSH_INTERVAL seconds.
+    MOVE_FLUSH_INTERVAL = int(os.getenv("MOVE_FLUSH_INTERVAL", 60))
+    MOVE_FLUSH_IDLE = int(os.getenv("MOVE_FLUSH_IDLE", 600))
+
+    # Passwords are hashed with bcrypt at a cost of 2 ** BCRYPT_LOG_ROUNDS, in a pool
+    # of PASSWORD_WORKERS processes (0 hashes inline) holding at most
+    # PASSWORD_QUEUE waiting or running calls before logins get a 503
+    BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+    PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", 2))
+    PASSWORD_QUEUE = int(os.getenv("PASSWORD_QUEUE", 32))
+
+    # Seconds an HTTP request may reuse the player loaded by an earlier request.
+    # Socket.IO connections keep theirs until they disconnect.
+    IDENTITY_CACHE_TTL = int(os.getenv("IDENTITY_CACHE_TTL", 5))
+
+    # A game's state lives in Redis for GAME_TTL seconds after its last move. Every
+    # SWEEP_INTERVAL seconds, games idle for GAME_IDLE_TIMEOUT are finished and
+    # archived to SQL, like games that end normally. Their Redis keys expire
+    # FINISHED_GAME_TTL seconds after archiving.
+    GAME_TTL = int(os.getenv("GAME_TTL", 86400))
+    GAME_IDLE_TIMEOUT = int(os.getenv("GAME_IDLE_TIMEOUT", 3600))
+    FINISHED_GAME_TTL = int(os.getenv("FINISHED_GAME_TTL", 300))
+    SWEEP_INTERVAL = int(os.getenv("SWEEP_INTERVAL", 300))
+
+    # Spectators get a game's moves gathered into one broadcast every
+    # SPECTATOR_TICK seconds. 0 sends every move to them straight away.
+    SPECTATOR_TICK = float(os.getenv("SPECTATOR_TICK", 0.25))
+
+    # Chat messages are written to SQL in batches every CHAT_FLUSH_INTERVAL
+    # seconds. A connection may send CHAT_BURST messages at once, then
+    # CHAT_RATE per second.
+    CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", 1))
+    CHAT_RATE = float(os.getenv("CHAT_RATE", 1))
+    CHAT_BURST = int(os.getenv("CHAT_BURST", 5))
+
+    # Every ANALYSIS_INTERVAL seconds, up to ANALYSIS_BATCH finished games are
+    # analysed move by move. Boards larger than 3x3 are searched ANALYSIS_DEPTH
+    # plies deep. 0 turns the analysis off, e.g. to run `analyse-games` elsewhere.
+    ANALYSIS_INTERVAL = float(os.getenv("ANALYSIS_INTERVAL", 10))
+    ANALYSIS_BATCH = int(os.getenv("ANALYSIS_BATCH", 50))
+    ANALYSIS_DEPTH = int(os.getenv("ANALYSIS_DEPTH", 2))
+
+    # Players looking for an opponent are paired with the nearest score within
+    # MATCHMAKING_WINDOW points, a window that widens by MATCHMAKING_WIDENING points
+    # per second waited. Every MATCHMAKING_TICK seconds the MATCHMAKING_BATCH
+    # players who have waited longest are tried again.
+    MATCHMAKING_WINDOW = float(os.getenv("MATCHMAKING_WINDOW", 100))
+    MATCHMAKING_WIDENING = float(os.getenv("MATCHMAKING_WIDENING", 20))
+    MATCHMAKING_TICK = float(os.getenv("MATCHMAKING_TICK", 1))
+    MATCHMAKING_BATCH = int(os.getenv("MATCHMAKING_BATCH", 1000))
+
+    # The JSON of finished games served by /game_details and /history is kept in
+    # Redis, at most RESPONSE_CACHE_BYTES of it, evicting the least recently served.
+    RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024))
+
+    # Bearer token of /export, which streams tables for analytics. Empty turns it
+    # off; `flask --app src export` writes the same files.
+    EXPORT_TOKEN = os.getenv("EXPORT_TOKEN", "")
+
+    # Log HTTP requests and Socket.IO events slower than this many milliseconds,
+    # with the SQL they ran. 0 turns the log off.
+    SLOW_EVENT_MS = int(os.getenv("SLOW_EVENT_MS", 0))
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+"""
+Streaming exports of games, their players, moves and chat messages for analytics.
+
+Each table is written as gzip-compressed NDJSON, one JSON object per row, in
+constant memory however big the table is. Rows are read in keyset pages of
+PAGE_SIZE, each through a server-side cursor CHUNK_SIZE rows at a time, and
+every chunk is encoded and compressed before the next one is read. Each page
+is its own short transaction, so an export never keeps one open for long.
+
+An export covers the rows written before its `until`, by default a minute
+ago, which leaves transactions that stamped their rows time to commit.
+Passing a previous export's `until` as `since` exports what was written in
+between. Moves and messages are stamped when they are written out of Redis,
+games when they finish, are archived or are analysed. Game players have no
+timestamps of their own and go with their game.
+"""
+import itertools
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import msgspec
+
+from src import db
+from src.models import Game, GamePlayerAssociation, Message, Move
+from src.state import GameState
+
+# Rows read per query
+PAGE_SIZE = 10000
+# Rows fetched from the cursor, encoded and compressed at a time
+CHUNK_SIZE = 1000
+# Exports stop this long before they start, for rows whose transactions haven't committed
+SETTLE_TIME = timedelta(minutes=1)
+# Level 1 compresses about twice as fast as the default 6, for a tenth more bytes
+COMPRESS_LEVEL = 1
+
+# table -> the model walked and the columns read, which include its id and updated_at
+TABLES = {
+    "games": (Game, (Game.id, Game.code, Game.difficulty, Game.finished, Game.winner_id,
+                     Game.state, Game.analysis, Game.created_at, Game.updated_at)),
+    "game_players": (Game, (Game.id, Game.updated_at)),
+    "moves": (Move, (Move.id, Move.game_id, Move.number, Move.tile_number, Move.player_id,
+                     Move.created_at, Move.updated_at)),
+    "messages": (Message, (Message.id, Message.game_id, Message.player_id, Message.text,
+                           Message.created_at, Message.updated_at)),
+}
+# Rows are encoded from structs, which msgspec builds and encodes faster than dicts
+GameRow = msgspec.defstruct("GameRow", ("id", "code", "difficulty", "finished", "winner_id",
+                                        "size", "win_length", "analysis", "created_at", "updated_at"))
+GamePlayerRow = msgspec.defstruct("GamePlayerRow", ("game_id", "player_id"))
+ROWS = {
+    "games": GameRow,
+    "game_players": GamePlayerRow,
+    "moves": msgspec.defstruct("MoveRow", [column.key for column in TABLES["moves"][1]]),
+    "messages": msgspec.defstruct("MessageRow", [column.key for column in TABLES["messages"][1]]),
+}
+
+_encoder = msgspec.json.Encoder()
+
+
+def parse_time(text):
+    """
+    A time given in ISO 8601, as the naive UTC the tables store.
+    Raises ValueError if it is malformed.
+    """
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def default_until():
+    """The `until` of an export started now"""
+    return datetime.utcnow() - SETTLE_TIME
+
+
+def _chunks(model, columns, since, until):
+    """
+    Yields the rows of the columns written in [since, until), in chunks of at most
+    CHUNK_SIZE. A full export walks the primary key, an incremental one the
+    (updated_at, id) index. A page's last chunk is only yielded once its cursor is
+    done, so the consumer may query then, and the next page is read after that.
+    """
+    keys = (model.id,) if since is None else (model.updated_at, model.id)
+    positions = [columns.index(key) for key in keys]
+    query = db.select(*columns).order_by(*keys).limit(PAGE_SIZE)
+    if since is None:
+        query = query.where(db.or_(model.updated_at < until, model.updated_at.is_(None)))
+    else:
+        query = query.where(model.updated_at >= since, model.updated_at < until)
+
+    after = None
+    while True:
+        page = query
+        if after is not None:
+            condition = keys[-1] > after[-1]
+            for key, value in zip(keys[-2::-1], after[-2::-1]):
+                condition = db.or_(key > value, db.and_(key == value, condition))
+            page = page.where(condition)
+        # Run on the connection, as the ORM would only slow plain rows down
+        result = db.session.connection().execute(page, execution_options={"stream_results": True,
+                                                                          "yield_per": CHUNK_SIZE})
+        count, last = 0, []
+        for chunk in result.partitions():
+            if last:
+                yield last
+            count += len(chunk)
+            last = chunk
+        db.session.commit()
+        if last:
+            after = tuple(last[-1][position] for position in positions)
+            yield last
+        if count < PAGE_SIZE:
+            return
+
+
+def _game_rows(rows):
+    """Games with the size and win length of their board instead of its state"""
+    for game_id, code, difficulty, finished, winner_id, state, analysis, created_at, updated_at in rows:
+        # Only archived games know their board; moves' tile numbers count along its rows
+        game_variant = GameState.unpack(state).variant if state else None
+        yield GameRow(game_id, code, difficulty, finished, winner_id,
+                      game_variant and game_variant.size, game_variant and game_variant.win_length,
+                      analysis, created_at, updated_at)
+
+
+def _game_players(chunks):
+    """
+    The players of the games in the chunks. Their game ids are gathered a page at a
+    time, so the players are only queried between pages (PAGE_SIZE is a multiple of
+    CHUNK_SIZE), when no cursor is open.
+    """
+    game_ids = []
+    for chunk in chunks:
+        game_ids += [game_id for game_id, _ in chunk]
+        if len(game_ids) < PAGE_SIZE:
+            continue
+        yield from _players_of(game_ids)
+        game_ids = []
+    yield from _players_of(game_ids)
+
+
+def _players_of(game_ids):
+    """Chunks of the players of the given games"""
+    for start in range(0, len(game_ids), CHUNK_SIZE):
+        rows = db.session.connection().execute(
+            db.select(GamePlayerAssociation.game_id, GamePlayerAssociation.player_id)
+            .where(GamePlayerAssociation.game_id.in_(game_ids[start:start + CHUNK_SIZE]))
+            .order_by(GamePlayerAssociation.game_id, GamePlayerAssociation.player_id))
+        yield list(itertools.starmap(GamePlayerRow, rows))
+
+
+def rows(table, since=None, until=None):
+    """
+    Yields the NDJSON of the rows of a table written in [since, until), a chunk of
+    lines at a time. Without since the whole table is exported; until defaults to
+    `default_until()`. Raises KeyError for an unknown table.
+    """
+    model, columns = TABLES[table]
+    chunks = _chunks(model, columns, since, until or default_until())
+    if table == "game_players":
+        chunks = _game_players(chunks)
+    for chunk in chunks:
+        if table == "games":
+            chunk = list(_game_rows(chunk))
+        elif table != "game_players":
+            chunk = list(itertools.starmap(ROWS[table], chunk))
+        if chunk:
+            yield _encoder.encode_lines(chunk)
+
+
+def gzipped(chunks, level=COMPRESS_LEVEL):
+    """Compresses chunks of bytes into a gzip stream, as they come"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""
+The friend graph and the presence of friends, served from Redis.
+
+A player's friend ids are loaded with one query the first time they are
+needed and kept in a Redis set, which is dropped whenever one of their
+friend requests is accepted or rejected. A player is online while they
+have a Socket.IO connection on any worker (see `src.identity`), and
+usernames and scores come from the leaderboard (see `src.leaderboard`), so
+listing friends with their presence costs two Redis round trips and no SQL.
+
+Every connection joins its player's own room. When a player comes online or
+goes offline, their friends get a 'friend_presence' event through one emit
+to all their rooms.
+"""
+from flask_socketio import join_room
+
+from src import db, leaderboard, redis_conn, socketio
+from src.identity import sockets_key
+
+# Member of every cached friends set, so that players without friends are cached too
+_LOADED = ""
+# Seconds a cached friends set is kept after it was loaded
+CACHE_TTL = 86400
+
+
+def friends_key(player_id):
+    """Redis key of the set of a player's friend ids"""
+    return f"{player_id}:friends"
+
+
+def player_room(player_id):
+    """Name of the Socket.IO room of all of a player's connections"""
+    return f"player:{player_id}"
+
+
+def friend_ids(player_id):
+    """The ids of a player's friends, from Redis, loading them with one query if not cached"""
+    key = friends_key(player_id)
+    members = redis_conn.smembers(key)
+    if members:
+        return {member.decode() for member in members} - {_LOADED}
+    from src.models import Friendship
+    ids = set(db.session.execute(Friendship.ids_of(player_id)).scalars())
+    with redis_conn.pipeline() as pipe:
+        pipe.sadd(key, _LOADED, *ids)
+        pipe.expire(key, CACHE_TTL)
+        pipe.execute()
+    return ids
+
+
+def are_friends(player_id, other_id):
+    """Whether two players are friends"""
+    return other_id in friend_ids(player_id)
+
+
+def forget(*player_ids):
+    """Drops the cached friends of players whose friendships changed"""
+    redis_conn.delete(*[friends_key(player_id) for player_id in player_ids])
+
+
+def with_presence(player_id):
+    """
+    A player's friends as dictionaries with their 'id', 'username', 'score' and
+    whether they are 'online', sorted by username
+    """
+    ids = sorted(friend_ids(player_id))
+    if not ids:
+        return []
+    with redis_conn.pipeline() as pipe:
+        pipe.hmget(leaderboard.USERNAMES_KEY, ids)
+        pipe.zmscore(leaderboard.LEADERBOARD_KEY, ids)
+        for friend_id in ids:
+            pipe.exists(sockets_key(friend_id))
+        usernames, scores, *online = pipe.execute()
+    return sorted(({
+        "id": friend_id,
+        "username": username.decode() if username else None,
+        "score": int(score or 0),
+        "online": bool(is_online),
+    } for friend_id, username, score, is_online in zip(ids, usernames, scores, online)),
+        key=lambda friend: friend["username"] or "")
+
+
+def connected(player_id):
+    """
+    Joins the connection of the current event to its player's room, and tells the
+    player's friends they are online if this is their first connection
+    """
+    join_room(player_room(player_id))
+    if redis_conn.scard(sockets_key(player_id)) == 1:
+        _announce(player_id, True)
+
+
+def disconnected(player_id):
+    """
+    Tells a player's friends they went offline if that was their last connection.
+    Returns whether it was.
+    """
+    if redis_conn.exists(sockets_key(player_id)):
+        return False
+    _announce(player_id, False)
+    return True
+
+
+def _announce(player_id, online):
+    ids = friend_ids(player_id)
+    if ids:
+        socketio.emit("friend_presence", {"id": player_id, "online": online},
+                      to=[player_room(friend_id) for friend_id in ids])
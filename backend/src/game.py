@@ -2,57 +2,163 @@
 """
 Contains the game logic
 """
-from flask import request, session, json
+import time
+from datetime import datetime
+
+from flask import request
 from flask_login import current_user
 from flask_socketio import emit, join_room, send
 
-from src.models import Player, Game, Message
-from src import db,  redis_conn, socketio, login_manager
+from src.models import Player, Game, Message, Move
+from src import app, db,  redis_conn, socketio, login_manager
+from src import chat, friends, identity, matchmaking, metrics, response_cache, search, solver, spectators
+from src.state import CLASSIC, GameState, MARKERS, MAX_DIFFICULTY, X, variant
+
+
+@socketio.on('connect')
+@metrics.instrument
+def on_connect(auth=None):
+    """
+    Socket event handler for a new connection. The logged-in player is resolved
+    here once and cached for the connection, see `src.identity`, and their friends
+    learn they are online, see `src.friends`.
+    """
+    player = identity.connect(request.sid)
+    if player is not None:
+        friends.connected(player.id)
 
+@socketio.on('disconnect')
+@metrics.instrument
+def on_disconnect():
+    """Socket event handler for a closed connection, dropping its cached player"""
+    player_id = identity.disconnect(request.sid)
+    chat.forget(request.sid)
+    if player_id is not None and friends.disconnected(player_id):
+        # Nobody is left to play a match found for them
+        matchmaking.leave(player_id)
 
 @socketio.on('create_game')
+@metrics.instrument
 def on_create_game(data):
     """
     Socket event handler for creating a new game.
     This function is triggered when a client sends a 'create_game' event. It creates a new game 
     instance, adds it to the database, commits the changes, joins the creator to the game room, 
     initializes the game state, and sends a message to the room announcing the creation of the game.
+    The board is 'board_size' tiles square and won by 'win_length' markers in a row, e.g. 3 and 3
+    (the default), 7 and 4 or 15 and 5; a combination `src.state.variant` refuses gets the default.
     
     """
-    difficulty = data.get("difficulty", 1)
-    user: Player = Player.query.get(session["user_id"])
+    try:
+        difficulty = min(max(int(data.get("difficulty", 1)), 1), MAX_DIFFICULTY)
+    except (TypeError, ValueError):
+        # Anything that isn't a number gets the default level
+        difficulty = 1
+    try:
+        game_variant = variant(int(data.get("board_size", 3)), int(data.get("win_length", 3)))
+    except (TypeError, ValueError):
+        game_variant = CLASSIC
+    user: Player = identity.socket_player()
     game = user.create_game(difficulty)
     room = game.code
     join_room(room)
-    save_game_state(room, create_game_state())
+    # The creator plays 'X' against the AI until an opponent joins
+    state = create_game_state(single_player_mode=True, difficulty=difficulty, game_variant=game_variant)
+    save_game_state(room, state, players={user.id: X})
     emit("game_created", f"{user.username} has created game {room}", room=room)
+    emit("game_state_update", state.to_dict(), room=request.sid)
 
 @socketio.on('join_game')
+@metrics.instrument
 def on_join_game(data):
     """
     Socket event handler for joining an existing game.
     This function is triggered when a client sends a 'join_game' event. It checks if the game exists and is not finished.
     If the game is valid, it adds the client to the game room and sends a message to the room announcing the user joined.
+    The client gets a full 'game_state_update' snapshot and the game's recent messages as a
+    'chat_history' list; when a second player takes 'O' over from the AI,
+    the players already in the room get that change as a 'game_delta'.
     If the game is not found or already finished, it sends an error message back to the client.
     
     Args:
         data (dict): The data sent from the client, expected to contain the 'game_code' to identify the game to join.
     """
-    user: Player = Player.query.get(session["user_id"])
+    user: Player = identity.socket_player()
     room = data.get('game_code')
+    joined = None
     if room:
         game = Game.query.filter_by(code=room).first()
         if game and not game.finished:
-            user.join_game_with_code(room)
+            joined = user.join_game_with_code(room)
     else:
-        game = user.join_random_game()
+        game = joined = user.join_random_game()
     if game and not game.finished:
+        room = game.code
+        state = None
+        if joined:
+            # A second player takes 'O' over from the AI
+            packed = _join_script(keys=[room, players_key(room), ACTIVE_GAMES_KEY, history_key(room)],
+                                  args=[user.id, app.config["GAME_TTL"], time.time(), DELTA_HISTORY])
+            if packed:
+                state = GameState.unpack(packed)
+                previous = state.copy()
+                previous.single_player = True
+                delta = state.delta(previous)
+                emit("game_delta", delta, room=room)
+                spectators.publish(room, delta)
         join_room(room)
         emit("game_joined", f"{user.username} has joined the game {room}", room=room)
+        emit("game_state_update", (state or get_game_state(room)).to_dict(), room=request.sid)
+        emit("chat_history", chat.recent(room), room=request.sid)
     else:
         emit("join_error", "Game not found or already finished.", room=request.sid)
 
+@socketio.on('find_match')
+@metrics.instrument
+def on_find_match(data=None):
+    """
+    Socket event handler putting the player in the matchmaking queue, to be paired
+    with an opponent of a similar score (see `src.matchmaking`).
+    Emits 'matchmaking_queued' to the sender while they wait. Once paired, both
+    players' connections get 'match_found' with the 'game_code' and their 'marker',
+    and take their seats by sending 'join_game' with that code.
+    """
+    user: Player = identity.socket_player()
+    match = matchmaking.join(user.id)
+    if match:
+        start_match(match)
+    else:
+        emit("matchmaking_queued", {"window": matchmaking.window(0)}, room=request.sid)
+
+@socketio.on('cancel_match')
+@metrics.instrument
+def on_cancel_match(data=None):
+    """Socket event handler taking the player out of the matchmaking queue; answers 'matchmaking_cancelled'"""
+    matchmaking.leave(identity.socket_player_id())
+    emit("matchmaking_cancelled", room=request.sid)
+
+def start_match(match):
+    """
+    Create the game of a match made by `src.matchmaking` and tell both players,
+    putting them back in the queue if it can't be created.
+    Args:
+        match (tuple): (player id, score, joined) of the player who plays 'X', then of the opponent.
+    """
+    player_ids = [player_id for player_id, _, _ in match]
+    try:
+        game = Game.create_match(player_ids)
+        save_game_state(game.code, create_game_state(),
+                        players={player_id: marker for marker, player_id in enumerate(player_ids)})
+    except Exception:
+        db.session.rollback()
+        matchmaking.restore(match)
+        raise
+    for marker, player_id in enumerate(player_ids):
+        socketio.emit("match_found", {"game_code": game.code, "marker": MARKERS[marker]},
+                      to=friends.player_room(player_id))
+
 @socketio.on('make_move')
+@metrics.instrument
 def on_make_move(data):
     """
     Handle a player's move in a Tic-Tac-Toe game.
@@ -63,25 +169,34 @@ def on_make_move(data):
             - 'game_code' (string): The unique code identifying the game room.
             - 'tile_number' (int): The index of the tile where the player wants to make a move.
     Session:
-        - 'user_id' (string): The ID of the current player making the move, retrieved from the session.
+        - 'user_id' (string): The ID of the current player making the move, cached for the connection (see `src.identity`).
     Game Logic:
-        - If it's the AI's turn (player 'O') in single-player mode, the AI makes a move.
-        - Checks if the selected tile is empty and the game is not finished.
-        - Updates the game board with the player's move and switches the turn.
-        - Checks if the current move resulted in a win or draw:
-            - Updates the game state to indicate a win or draw.
-            - Calls `declare_winner()` to set the winner if applicable.
+        - `apply_move()` runs a Lua script in Redis that, in one atomic round trip, checks that
+          the game is not finished, that it is this player's turn and that the tile is empty,
+          plays the move, detects a win or draw and stores the new state.
+        - If the move resulted in a win, calls `declare_winner()` to set the winner.
+        - In single-player mode the AI ('O') then replies in the same way, guarded by the
+          state version so it never plays on a position that changed meanwhile.
     Emits:
-        - 'game_state_update' (dict): The updated game state to all players in the game room.
+        - 'game_delta' (dict): What the move changed, to all players in the game room (see `announce_move`).
+        - 'move_error' (string): The reason a move was rejected, to the sender only.
     Sends:
         - A message indicating the game is over and announcing the winner to all players in the game room.
 
     Game State:
-        - The game state is a dictionary with the following structure:
+        - The game state is a `GameState` (see `src.state`) stored packed in Redis:
+            - 'x_mask'/'o_mask' (int): Bitmasks of the tiles held by each marker.
+            - 'turn' (int): Whose turn it is (`X` or `O`).
+            - 'result' (int): The result code, from which the winner and finished flag derive.
+            - 'single_player' (bool): Whether the AI plays 'O'.
+            - 'version' (int): Incremented on every change, for optimistic checks and resyncs.
+        - Full snapshots ('game_state_update', on join and on `resync`) come from `GameState.to_dict()`:
+            - 'version' (int): The version of the state.
             - 'board' (list): A list representing the game board, where each element is 'X', 'O', or ''.
             - 'turn' (string): Indicates whose turn it is ('X' or 'O').
             - 'winner' (string or None): The winner of the game ('X', 'O', or 'Draw').
             - 'finished' (bool): Indicates whether the game has finished.
+            - 'single_player' (bool): Whether the AI plays 'O'.
     Examples:
         Player's move:
             data = {
@@ -93,107 +208,555 @@ def on_make_move(data):
     """
     room = data['game_code']
     tile_number = data['tile_number']
-    player_id = session.get('user_id')
+    player_id = identity.socket_player_id()
 
-    state = get_game_state(room)
-    
-    # If it's the AI's turn, let the AI make a move
-    if state["turn"] == "O" and is_single_player_mode(room):
-        ai_move = find_best_move(state["board"])
-        tile_number = ai_move
-        player_id = None  # AI has no player_id
-
-    # Check for a valid move
-    if state["board"][tile_number] == "" and not state["finished"]:
-        state["board"][tile_number] = state["turn"]
-        state["turn"] = "O" if state["turn"] == "X" else "X"
-        winner = check_winner(state["board"])
-
-        if winner:
-            state["winner"] = winner
-            state["finished"] = True
-            if winner == "X" or winner == "O":
-                game = Game.query.filter_by(code=room).first()
-                game.declare_winner(player_id)  # For 'O', player_id is None (AI)
-            send(f"Game over! Winner: {winner}", room=room)
-
-        save_game_state(room, state)
-        emit('game_state_update', state, room=room)
+    status, state = apply_move(room, tile_number, player_id)
+    if status != MOVE_OK:
+        emit("move_error", status, room=request.sid)
+        return
+    announce_move(room, state, tile_number, player_id)
+
+    # In single-player mode the AI answers straight away
+    if state.single_player and not state.finished:
+        tile_number = find_best_move(state)
+        status, state = apply_move(room, tile_number, None, state.version)
+        if status == MOVE_OK:
+            announce_move(room, state, tile_number, None)  # AI has no player_id
+
+def announce_move(room, state, tile_number, player_id):
+    """
+    Emit what a move changed to the room, and record the result if the move ended the game.
+    The 'game_delta' carries the new 'version', the 'tile' and 'marker' played, the new
+    'turn', 'winner' and 'finished'. A client that sees a version gap asks for a `resync`.
+    Args:
+        room (str): The game code.
+        state (GameState): The state after the move.
+        tile_number (int): The tile played.
+        player_id (str or None): The id of the player who moved, None for the AI.
+    """
+    winner = check_winner(state)
+    if winner:
+        game = Game.query.filter_by(code=room).first()
+        if winner == "X" or winner == "O":
+            game.declare_winner(player_id)  # For 'O', player_id is None (AI)
+        else:
+            game.declare_draw()
+        try:
+            flush_moves(game)
+            archive_game(game)
+        except Exception:
+            # The moves are back in Redis, where the idle flusher picks them up
+            # and the sweeper archives the game afterwards
+            app.logger.exception("Writing the moves of game %s failed", room)
+        send(f"Game over! Winner: {winner}", room=room)
+    previous = state.copy()
+    previous.undo(tile_number)
+    delta = state.delta(previous)
+    emit('game_delta', delta, room=room)
+    spectators.publish(room, delta)
+
+@socketio.on('spectate_game')
+@metrics.instrument
+def on_spectate_game(data):
+    """
+    Socket event handler for watching a game without playing in it.
+    The client joins the game's spectator room (see `src.spectators`), gets a full
+    'game_state_update' snapshot and from then on the game's deltas, batched into
+    'game_deltas' lists. Nobody needs to be logged in to watch.
+    Args:
+        data (dict): 'game_code' (str), the game to watch.
+    """
+    room = data.get("game_code")
+    game = Game.query.filter_by(code=room).first() if room else None
+    if game is None:
+        emit("spectate_error", "Game not found.", room=request.sid)
+        return
+    spectators.watch(room)
+    emit("game_state_update", get_game_state(room).to_dict(), room=request.sid)
+
+@socketio.on('stop_spectating')
+@metrics.instrument
+def on_stop_spectating(data):
+    """Socket event handler for no longer watching a game. data holds its 'game_code'"""
+    spectators.unwatch(data.get("game_code"))
+
+@socketio.on('resync')
+@metrics.instrument
+def on_resync(data):
+    """
+    Socket event handler for a client that reconnected or missed a 'game_delta'.
+    The client sends the last version it saw and gets the deltas since then as one
+    'game_deltas' list, or a full 'game_state_update' snapshot when they are no longer
+    kept (see `DELTA_HISTORY`) or no version was given. A player of the game
+    rejoins its room, which a reconnected socket has left.
+    Args:
+        data (dict): 'game_code' (str) and 'version' (int or None), the last version seen.
+    """
+    room = data.get("game_code")
+    seen = data.get("version")
+    with redis_conn.pipeline() as pipe:
+        pipe.lrange(history_key(room), 0, -1)
+        pipe.hexists(players_key(room), identity.socket_player_id() or "")
+        history, is_player = pipe.execute()
+    if is_player:
+        join_room(room)
+    states = [GameState.unpack(packed) for packed in history]
+    if isinstance(seen, int) and states and states[0].version <= seen <= states[-1].version:
+        start = seen - states[0].version
+        emit("game_deltas", [state.delta(previous) for previous, state
+                             in zip(states[start:], states[start + 1:])], room=request.sid)
+        return
+    game = Game.query.filter_by(code=room).first() if room else None
+    if game is None:
+        emit("resync_error", "Game not found.", room=request.sid)
+        return
+    emit("game_state_update", get_game_state(room).to_dict(), room=request.sid)
 
 @socketio.on("chat_message")
+@metrics.instrument
 def send_message(data):
     """
     Socket event handler for sending a message in the chat of the game.
-    This function is triggered when a client sends a 'chat_message' event. It checks if the game
-    is a valid and unfinished game, creates the Message object and emits the message to all players in room.
+    This function is triggered when a client sends a 'chat_message' event. It checks that the sender
+    is within the chat rate limit and that the game is live and unfinished in Redis, queues the message
+    (see `src.chat`) and emits it to all players in room. Nothing is written to SQL here.
     Args:
         data (dict): The data sent from the client, expected to contain 'game_code' to identify the game, and
         'text' containing the text of the message
+    Emits:
+        - 'chat_message' (dict): The message, to all players in the game room.
+        - 'chat_error' (string): Why the message was refused, to the sender only.
     """
-    user: Player = Player.query.get(session["user_id"])
+    player_id = identity.socket_player_id()
+    if player_id is None:
+        return
+    if not chat.allow(request.sid):
+        emit("chat_error", "Too many messages, slow down.", room=request.sid)
+        return
+    text = str(data.get("text", "")).strip()
+    if not text or len(text) > chat.MAX_LENGTH:
+        emit("chat_error", f"Messages must have 1 to {chat.MAX_LENGTH} characters.", room=request.sid)
+        return
     room = data["game_code"]
-    game = Game.query.filter_by(code=room)
-    if game and not game.finished:
-        text = data["text"]
-        message = user.send_message(game.id, text)
-        emit("chat_message", message.to_dict(), json=True, room=room)
+    packed = redis_conn.get(room)
+    if packed is None or GameState.unpack(packed).finished:
+        return
+    game_id = chat.game_id(room)
+    if game_id:
+        message = chat.post(room, game_id, player_id, text)
+        emit("chat_message", message, json=True, room=room)
 
 
-def check_winner(board):
+def check_winner(state):
     """
-    Check the game board for a winner or a draw.
-    This function checks all possible winning combinations in the Tic-Tac-Toe game board to see if there is a winner. 
-    It returns 'X' or 'O' if one of the players has won, 'Draw' if the game is a draw, and None if there is no winner yet.
+    Check the game state for a winner or a draw.
+    The result is kept up to date by `GameState.play`, which tests the mover's mask
+    against the winning line masks, so this only translates the result code.
     Args:
-        board (list): A list representing the current state of the game board.
-        
+        state (GameState): The current state of the game.
+
     Returns:
         str: The winner ('X' or 'O'), 'Draw' if no spaces are left, or None if there is no winner yet.
     """
+    return state.winner
+
+def create_game_state(single_player_mode=False, difficulty=1, game_variant=CLASSIC):
+    """Initialize a new game state with an empty board of the given variant"""
+    return GameState(single_player=single_player_mode, difficulty=difficulty, variant=game_variant)
+
 
-    # Logic to check the winner in Tic-Tac-Toe
-    winning_combinations = [
-        (0, 1, 2), (3, 4, 5), (6, 7, 8),
-        (0, 3, 6), (1, 4, 7), (2, 5, 8),
-        (0, 4, 8), (2, 4, 6)
-    ]
-    for a, b, c in winning_combinations:
-        if board[a] == board[b] == board[c] and board[a] != "":
-            return board[a]
-    if "" not in board:
-        return "Draw"
-    return None
+def players_key(game_code):
+    """Redis key of the hash mapping a game's player ids to their markers"""
+    return f"{game_code}:players"
 
-def create_game_state(single_player_mode=False):
-    # Initialize a new game state with an empty board
-    state = {"board": [""] * 9, "turn": "X", "winner": None, "finished": False}
-    if single_player_mode:
-        state["player_x_id"] = session.get('user_id')  # Player
-        state["player_o_id"] = None  # AI
-    return state
+def moves_key(game_code):
+    """Redis key of the list of a game's moves not yet written to the moves table"""
+    return f"{game_code}:moves"
 
+def history_key(game_code):
+    """Redis key of the list of a game's last packed states, from which deltas are replayed"""
+    return f"{game_code}:history"
 
-def save_game_state(game_code, state):
-    redis_conn.set(game_code, json.dumps(state))
+# How many of a game's states are kept for resyncing clients; an older version gets a snapshot
+DELTA_HISTORY = 32
+
+# Sorted set of game codes with pending moves, scored by the time of their last move
+PENDING_MOVES_KEY = "moves:pending"
+# Sorted set of the codes of games live in Redis, scored by the time of their last activity
+ACTIVE_GAMES_KEY = "games:active"
+# Number of games whose final state has been archived in SQL
+ARCHIVED_GAMES_KEY = "games:archived"
+
+def save_game_state(game_code, state, players=None):
+    """
+    Store a game's state in Redis, with the players' markers if given, for GAME_TTL
+    seconds. Every move renews the expiry, so only abandoned games run out. The state
+    starts the game's history again.
+    """
+    ttl = app.config["GAME_TTL"]
+    packed = state.pack()
+    with redis_conn.pipeline() as pipe:
+        pipe.set(game_code, packed, ex=ttl)
+        pipe.delete(history_key(game_code))
+        pipe.rpush(history_key(game_code), packed)
+        pipe.expire(history_key(game_code), ttl)
+        if players:
+            pipe.hset(players_key(game_code), mapping=players)
+            pipe.expire(players_key(game_code), ttl)
+        pipe.zadd(ACTIVE_GAMES_KEY, {game_code: time.time()})
+        pipe.execute()
 
 def get_game_state(game_code):
+    """The state of a game from Redis, or from its archived row once it has left Redis"""
     state = redis_conn.get(game_code)
-    return json.loads(state) if state else create_game_state()
+    if state is None:
+        game = Game.query.filter_by(code=game_code).first()
+        state = game.state if game else None
+    return GameState.unpack(state) if state else create_game_state()
+
+
+# Applies one move to the packed state (see `src.state`) inside Redis, so that
+# validating, playing, storing and queueing it for the moves table is atomic and
+# costs a single round trip. A win is found by counting the mover's markers in a
+# row through the tile in each direction, so only the lines through it are read;
+# a draw by the move counter reaching the number of tiles.
+# KEYS: game state, players hash, pending moves list, pending games sorted set,
+# active games sorted set, state history list.
+# ARGV: tile, player id ('' for the AI), expected version ('' for any), timestamp,
+# TTL of the game's keys, number of states kept in the history.
+# Returns {status} or {status, new packed state}.
+_MOVE_SCRIPT = """
+local data = redis.call('GET', KEYS[1])
+if not data then return {'missing'} end
 
+local version = ((string.byte(data, 1) * 256 + string.byte(data, 2)) * 256
+                 + string.byte(data, 3)) * 256 + string.byte(data, 4)
+local flags = string.byte(data, 5)
+local turn = flags % 2
+local result = math.floor(flags / 2) % 4
+local single = math.floor(flags / 8) % 2
+local size, win_length, played, header = 3, 3, nil, 5
+if #data ~= 9 then  -- 9 bytes is a 3x3 state packed before there were variants
+    size, win_length = string.byte(data, 6), string.byte(data, 7)
+    played = string.byte(data, 8) * 256 + string.byte(data, 9)
+    header = 9
+end
+local tiles = size * size
+local length = (#data - header) / 2
+local masks = {{string.byte(data, header + 1, header + length)},
+               {string.byte(data, header + length + 1, header + 2 * length)}}
 
+local function has(mask, tile)
+    return math.floor(mask[math.floor(tile / 8) + 1] / 2 ^ (tile % 8)) % 2 == 1
+end
+
+if result ~= 0 then return {'finished'} end
+if ARGV[3] ~= '' and tonumber(ARGV[3]) ~= version then return {'stale'} end
+if ARGV[2] == '' then
+    if single == 0 or turn ~= 1 then return {'turn'} end
+else
+    local marker = redis.call('HGET', KEYS[2], ARGV[2])
+    if not marker or tonumber(marker) ~= turn then return {'turn'} end
+end
+
+local tile = tonumber(ARGV[1])
+if not tile or tile < 0 or tile >= tiles or tile ~= math.floor(tile)
+        or has(masks[1], tile) or has(masks[2], tile) then
+    return {'invalid'}
+end
+if not played then
+    played = 0
+    for cell = 0, tiles - 1 do
+        if has(masks[1], cell) or has(masks[2], cell) then played = played + 1 end
+    end
+end
+
+local mine = masks[turn + 1]
+local index = math.floor(tile / 8) + 1
+mine[index] = mine[index] + 2 ^ (tile % 8)
+played = played + 1
+
+local row, column = math.floor(tile / size), tile % size
+local function run(row_step, column_step)
+    local count, r, c = 0, row + row_step, column + column_step
+    while r >= 0 and r < size and c >= 0 and c < size and has(mine, r * size + c) do
+        count, r, c = count + 1, r + row_step, c + column_step
+    end
+    return count
+end
+for _, step in ipairs({{0, 1}, {1, 0}, {1, 1}, {1, -1}}) do
+    if 1 + run(step[1], step[2]) + run(-step[1], -step[2]) >= win_length then
+        result = turn + 1
+        break
+    end
+end
+if result == 0 and played == tiles then result = 3 end
+
+version = version + 1
+flags = flags - flags % 8 + result * 2 + (1 - turn)
+local packed = string.char(math.floor(version / 16777216) % 256, math.floor(version / 65536) % 256,
+                           math.floor(version / 256) % 256, version % 256, flags,
+                           size, win_length, math.floor(played / 256), played % 256)
+    .. string.char(unpack(masks[1])) .. string.char(unpack(masks[2]))
+redis.call('SET', KEYS[1], packed, 'EX', ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+redis.call('RPUSH', KEYS[3], played .. ',' .. tile .. ',' .. ARGV[2] .. ',' .. ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+redis.call('ZADD', KEYS[4], ARGV[4], KEYS[1])
+redis.call('ZADD', KEYS[5], ARGV[4], KEYS[1])
+redis.call('RPUSH', KEYS[6], packed)
+redis.call('LTRIM', KEYS[6], -tonumber(ARGV[6]), -1)
+redis.call('EXPIRE', KEYS[6], ARGV[5])
+return {'ok', packed}
+"""
+_move_script = redis_conn.register_script(_MOVE_SCRIPT)
 
-def minimax(board, depth, is_maximizing, ai_marker, player_marker):
+# Hands 'O' from the AI to a joining player and renews the game's expiry.
+# KEYS: game state, players hash, active games sorted set, state history list.
+# ARGV: player id, TTL of the game's keys, timestamp, number of states kept in the history.
+# Returns the new packed state, or 0 if the game is missing or already has two players.
+_JOIN_SCRIPT = """
+local data = redis.call('GET', KEYS[1])
+if not data then return 0 end
+local flags = string.byte(data, 5)
+if math.floor(flags / 8) % 2 == 0 then return 0 end
+local version = ((string.byte(data, 1) * 256 + string.byte(data, 2)) * 256
+                 + string.byte(data, 3)) * 256 + string.byte(data, 4) + 1
+local packed = string.char(math.floor(version / 16777216) % 256, math.floor(version / 65536) % 256,
+                           math.floor(version / 256) % 256, version % 256, flags - 8)
+    .. string.sub(data, 6)
+redis.call('SET', KEYS[1], packed, 'EX', ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], 1)
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('ZADD', KEYS[3], ARGV[3], KEYS[1])
+redis.call('RPUSH', KEYS[4], packed)
+redis.call('LTRIM', KEYS[4], -tonumber(ARGV[4]), -1)
+redis.call('EXPIRE', KEYS[4], ARGV[2])
+return packed
+"""
+_join_script = redis_conn.register_script(_JOIN_SCRIPT)
+
+MOVE_OK = "ok"
+
+def apply_move(game_code, tile_number, player_id, expected_version=None):
+    """
+    Atomically validate and play a move on the stored game state.
+    Args:
+        game_code (str): The game code.
+        tile_number (int): The tile to play.
+        player_id (str or None): The moving player's id, None for the AI.
+        expected_version (int or None): Reject the move if the state has changed since this version.
+    Returns:
+        tuple: (status, state). The status is MOVE_OK, or one of 'missing', 'finished',
+        'stale', 'turn' or 'invalid' when the move is rejected, in which case state is None.
+    """
+    if not isinstance(tile_number, int) or tile_number < 0:
+        return "invalid", None
+    reply = _move_script(keys=[game_code, players_key(game_code), moves_key(game_code),
+                               PENDING_MOVES_KEY, ACTIVE_GAMES_KEY, history_key(game_code)],
+                         args=[tile_number, player_id or "",
+                               "" if expected_version is None else expected_version,
+                               time.time(), app.config["GAME_TTL"], DELTA_HISTORY])
+    status = reply[0].decode() if isinstance(reply[0], bytes) else reply[0]
+    if status != MOVE_OK:
+        return status, None
+    return status, GameState.unpack(reply[1])
+
+
+
+def flush_moves(game):
+    """
+    Write a game's pending moves from Redis to the moves table in one transaction.
+    The moves are taken out of Redis atomically, and put back if the insert fails.
+    Args:
+        game (Game): The game whose moves to write.
+    Returns:
+        int: The number of moves written.
+    """
+    key = moves_key(game.code)
+    with redis_conn.pipeline() as pipe:
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        pipe.zrem(PENDING_MOVES_KEY, game.code)
+        entries = pipe.execute()[0]
+    if not entries:
+        return 0
+
+    written_at = datetime.utcnow()
+    rows = []
+    for entry in entries:
+        number, tile_number, player_id, timestamp = entry.decode().split(",")
+        moved_at = datetime.utcfromtimestamp(float(timestamp))
+        rows.append({
+            "game_id": game.id,
+            "number": int(number),
+            "tile_number": int(tile_number),
+            "player_id": player_id or None,  # None for the AI
+            "created_at": moved_at,
+            "updated_at": written_at,  # Incremental exports pick rows up by when they were written
+        })
+    try:
+        db.session.execute(db.insert(Move), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        redis_conn.lpush(key, *reversed(entries))
+        redis_conn.zadd(PENDING_MOVES_KEY, {game.code: time.time()})
+        raise
+    response_cache.invalidate(game.id)
+    return len(rows)
+
+def flush_idle_moves(idle_seconds):
+    """Write out the pending moves of every game with no move in the last idle_seconds"""
+    codes = redis_conn.zrangebyscore(PENDING_MOVES_KEY, "-inf", time.time() - idle_seconds)
+    for code in codes:
+        code = code.decode()
+        game = Game.query.filter_by(code=code).first()
+        if game:
+            flush_moves(game)
+        else:
+            redis_conn.delete(moves_key(code))
+            redis_conn.zrem(PENDING_MOVES_KEY, code)
+
+def move_flusher():
+    """Background task that periodically writes out the moves of abandoned games"""
+    while True:
+        socketio.sleep(app.config["MOVE_FLUSH_INTERVAL"])
+        with app.app_context():
+            try:
+                flush_idle_moves(app.config["MOVE_FLUSH_IDLE"])
+            except Exception:
+                app.logger.exception("Flushing idle moves failed")
+
+
+def archive_game(game):
+    """
+    Move a finished game's final state out of Redis into its row. The Redis keys
+    are left to expire FINISHED_GAME_TTL seconds later, for clients still reading.
+    Args:
+        game (Game): The finished game, whose moves have been written out.
+    """
+    packed = redis_conn.get(game.code)
+    if packed is not None and game.state is None:
+        # Conditional, so a game archived by two workers at once is only counted once
+        result = db.session.execute(
+            db.update(Game).where(Game.id == game.id, Game.state.is_(None))
+            .values(state=packed, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        if result.rowcount == 1:
+            redis_conn.incr(ARCHIVED_GAMES_KEY)
+    ttl = app.config["FINISHED_GAME_TTL"]
+    with redis_conn.pipeline() as pipe:
+        pipe.expire(game.code, ttl)
+        pipe.expire(players_key(game.code), ttl)
+        pipe.expire(history_key(game.code), ttl)
+        pipe.expire(chat.recent_key(game.code), ttl)
+        pipe.zrem(ACTIVE_GAMES_KEY, game.code)
+        pipe.execute()
+
+def abandon_game(game):
+    """
+    Finish a game nobody has played for a while. A result already reached in Redis
+    is recorded as it is; otherwise the game ends in a draw.
+    """
+    packed = redis_conn.get(game.code)
+    state = GameState.unpack(packed) if packed else None
+    if state is not None and state.winner in ("X", "O"):
+        markers = redis_conn.hgetall(players_key(game.code))
+        winners = [player_id.decode() for player_id, marker in markers.items()
+                   if int(marker) == MARKERS.index(state.winner)]
+        game.declare_winner(winners[0] if winners else None)  # None for the AI
+    else:
+        game.declare_draw()
+
+# Only one worker sweeps at a time
+SWEEP_LOCK_KEY = "games:sweeping"
+
+def sweep_games(idle_seconds):
+    """
+    Finish the games with no activity in the last idle_seconds, write out their moves
+    and archive them. Finished games whose archiving failed earlier are retried too.
+    Returns the number of games swept, or None if another worker is sweeping.
+    """
+    if not redis_conn.set(SWEEP_LOCK_KEY, 1, nx=True, ex=max(idle_seconds, 60)):
+        return None
+    try:
+        swept = 0
+        for code in redis_conn.zrangebyscore(ACTIVE_GAMES_KEY, "-inf", time.time() - idle_seconds):
+            code = code.decode()
+            game = Game.query.filter_by(code=code).first()
+            if game is None:
+                redis_conn.delete(code, players_key(code), moves_key(code), history_key(code),
+                                  chat.recent_key(code))
+                redis_conn.zrem(ACTIVE_GAMES_KEY, code)
+                continue
+            try:
+                if not game.finished:
+                    abandon_game(game)
+                flush_moves(game)
+                archive_game(game)
+                swept += 1
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Sweeping game %s failed", code)
+        return swept
+    finally:
+        redis_conn.delete(SWEEP_LOCK_KEY)
+
+def game_sweeper():
+    """Background task that periodically finishes and archives abandoned games"""
+    while True:
+        socketio.sleep(app.config["SWEEP_INTERVAL"])
+        with app.app_context():
+            try:
+                sweep_games(app.config["GAME_IDLE_TIMEOUT"])
+            except Exception:
+                app.logger.exception("Sweeping games failed")
+
+def matchmaker():
+    """Background task pairing the players waiting for a match every MATCHMAKING_TICK seconds"""
+    while True:
+        socketio.sleep(app.config["MATCHMAKING_TICK"])
+        with app.app_context():
+            try:
+                matches = matchmaking.pair_waiting() or ()
+            except Exception:
+                app.logger.exception("Pairing players failed")
+                continue
+            for match in matches:
+                try:
+                    start_match(match)
+                except Exception:
+                    app.logger.exception("Starting a match between %s and %s failed",
+                                         match[0][0], match[1][0])
+
+
+metrics.gauge("tictactoe_games_live", "Games whose state is live in Redis",
+              lambda: redis_conn.zcard(ACTIVE_GAMES_KEY))
+metrics.gauge("tictactoe_games_archived", "Finished games whose state is archived in SQL",
+              lambda: int(redis_conn.get(ARCHIVED_GAMES_KEY) or 0))
+
+
+def recount_archived_games():
+    """Resets the archived games counter from the games table and returns it"""
+    count = db.session.query(db.func.count(Game.id)).filter(Game.state.isnot(None)).scalar()
+    redis_conn.set(ARCHIVED_GAMES_KEY, count)
+    return count
+
+
+def minimax(state, depth, is_maximizing, ai_marker, player_marker):
     """
     Minimax algorithm to determine the best move for the AI.
 
-    :param board: List representing the game board
+    :param state: GameState holding the position; it is restored before returning
     :param depth: Current depth in the game tree
     :param is_maximizing: Boolean to check if the current move is maximizing or minimizing
     :param ai_marker: The marker used by the AI ('X' or 'O')
     :param player_marker: The marker used by the player ('X' or 'O')
     :return: Best score
     """
-    winner = check_winner(board)
+    winner = check_winner(state)
     if winner == ai_marker:
         return 1
     elif winner == player_marker:
@@ -201,39 +764,28 @@ def minimax(board, depth, is_maximizing, ai_marker, player_marker):
     elif winner == "Draw":
         return 0
 
-    if is_maximizing:
-        best_score = -float("inf")
-        for i in range(9):
-            if board[i] == "":
-                board[i] = ai_marker
-                score = minimax(board, depth + 1, False, ai_marker, player_marker)
-                board[i] = ""
-                best_score = max(score, best_score)
-        return best_score
-    else:
-        best_score = float("inf")
-        for i in range(9):
-            if board[i] == "":
-                board[i] = player_marker
-                score = minimax(board, depth + 1, True, ai_marker, player_marker)
-                board[i] = ""
-                best_score = min(score, best_score)
-        return best_score
-
-def find_best_move(board):
-    best_score = -float('inf')
-    best_move = None
-    for i in range(9):
-        if board[i] == "":
-            board[i] = "O"
-            score = minimax(board, 0, False)
-            board[i] = ""
-            if score > best_score:
-                best_score = score
-                best_move = i
-    return best_move
-
-def is_single_player_mode(room):
-    state = get_game_state(room)
-    return state.get("player_o_id") is None
+    best_score = -float("inf") if is_maximizing else float("inf")
+    for tile in state.free_tiles():
+        state.play(tile)
+        score = minimax(state, depth + 1, not is_maximizing, ai_marker, player_marker)
+        state.undo(tile)
+        best_score = max(score, best_score) if is_maximizing else min(score, best_score)
+    return best_score
 
+def find_best_move(state):
+    """
+    Pick the AI's move for the given state, according to the game's difficulty.
+    Lower difficulties run the depth and time limited search in `src.search`.
+    From `search.PERFECT_PLAY` up, a classic 3x3 game reads the move from the
+    precomputed perfect-play table in `src.solver`, so no search happens at all;
+    larger boards get the search at its strongest level.
+    Args:
+        state (GameState): The current state of the game.
+    Returns:
+        int: The index of the best tile, or None if the game is already over.
+    """
+    if state.difficulty >= search.PERFECT_PLAY and state.variant is CLASSIC:
+        best_move, _ = solver.lookup(state)
+        return best_move
+    best_move, _ = search.search_best_move(state, state.difficulty)
+    return best_move
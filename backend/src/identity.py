@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+"""
+Resolves the logged-in player without a lookup on every request or event.
+
+A Socket.IO connection resolves its player once, on connect. The player is
+kept per sid for as long as the connection lives, and the connection's
+events skip loading the Flask session from Redis altogether. HTTP requests
+look the player up at most once per request and share the result for
+IDENTITY_CACHE_TTL seconds.
+
+Cached players are detached copies of their rows. They are merged into the
+current database session without a query, so they are only fit for the
+identity fields (id, username, email) and for loading relationships.
+Logging out disconnects the player's sockets on every worker, which drops
+their cached identity.
+"""
+import time
+
+from flask import g, request, session
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from src import app, db, redis_conn, socketio
+
+# Marks the environ of a Socket.IO connection whose player is cached
+ENVIRON_KEY = "tictactoe.player_id"
+# Above this many entries, expired HTTP cache entries are purged on insert
+HTTP_CACHE_SIZE = 10000
+
+# sid -> detached Player of the connection
+_sockets = {}
+# player id -> (expiry time, detached Player), for HTTP requests
+_recent = {}
+
+
+def sockets_key(player_id):
+    """Redis key of the set of a player's Socket.IO sids, across all workers"""
+    return f"{player_id}:sockets"
+
+
+def _load(player_id):
+    """Loads a player and returns a detached copy, or None if there is no such player"""
+    from src.models import Player
+    player = db.session.get(Player, player_id)
+    if player is None:
+        return None
+    db.session.expunge(player)
+    return player
+
+
+def _attach(player):
+    """The cached player as an instance of the current database session"""
+    if player is None:
+        return None
+    player = db.session.merge(player, load=False)
+    # The cached values of these may be stale, so they are reloaded if used
+    db.session.expire(player, ["password", "playing", "score", "updated_at"])
+    return player
+
+
+def connect(sid):
+    """
+    Resolves the player of a new Socket.IO connection from its session and caches it
+    for the connection's lifetime. Returns the player, or None if nobody is logged in.
+    """
+    player_id = session.get("user_id")
+    player = _load(player_id) if player_id else None
+    if player is None:
+        return None
+    _sockets[sid] = player
+    request.environ[ENVIRON_KEY] = player.id
+    redis_conn.sadd(sockets_key(player.id), sid)
+    return _attach(player)
+
+
+def disconnect(sid):
+    """Forgets the player of a closed Socket.IO connection. Returns their id, or None"""
+    player = _sockets.pop(sid, None)
+    if player is not None:
+        redis_conn.srem(sockets_key(player.id), sid)
+        return player.id
+    return None
+
+
+def socket_player():
+    """The player of the current Socket.IO event, or None if nobody is logged in"""
+    player = _sockets.get(request.sid)
+    if player is None:
+        # Logged in after the connection was opened
+        return connect(request.sid)
+    return _attach(player)
+
+
+def socket_player_id():
+    """The id of the player of the current Socket.IO event, without touching the database"""
+    player = _sockets.get(request.sid)
+    if player is None:
+        player = connect(request.sid)
+    return player.id if player is not None else None
+
+
+def current_player():
+    """The player of the current HTTP request, or None if nobody is logged in"""
+    if "player" not in g:
+        player_id = session.get("user_id")
+        g.player = _attach(_cached(player_id)) if player_id else None
+    return g.player
+
+
+@app.teardown_request
+def _end_request(exc):
+    # g outlives the request when an app context was already pushed
+    g.pop("player", None)
+
+
+def _cached(player_id):
+    now = time.monotonic()
+    expires, player = _recent.get(player_id, (0, None))
+    if expires > now:
+        return player
+    player = _load(player_id)
+    if player is not None:
+        if len(_recent) >= HTTP_CACHE_SIZE:
+            for key, (expires, _) in list(_recent.items()):
+                if expires <= now:
+                    _recent.pop(key, None)
+        _recent[player_id] = (now + app.config["IDENTITY_CACHE_TTL"], player)
+    return player
+
+
+def forget(player_id):
+    """
+    Drops every cached identity of a player, e.g. on logout or a profile change.
+    The player's sockets are disconnected on whichever worker holds them.
+    """
+    _recent.pop(player_id, None)
+    g.pop("player", None)
+    for sid in redis_conn.smembers(sockets_key(player_id)):
+        socketio.server.disconnect(sid.decode(), namespace="/")
+    redis_conn.delete(sockets_key(player_id))
+
+
+class SocketSessionInterface(SessionInterface):
+    """
+    Wraps the app's session interface so Socket.IO events of connections with a
+    cached player get a session holding only the player id, instead of reading
+    the session from Redis. Such sessions are never saved back.
+    """
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def open_session(self, app, request):
+        player_id = request.environ.get(ENVIRON_KEY)
+        if player_id is not None:
+            return _SocketSession({"user_id": player_id})
+        return self.interface.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        if not isinstance(session, _SocketSession):
+            self.interface.save_session(app, session, response)
+
+    def make_null_session(self, app):
+        return self.interface.make_null_session(app)
+
+    def is_null_session(self, obj):
+        return self.interface.is_null_session(obj)
+
+    def __getattr__(self, name):
+        return getattr(self.interface, name)
+
+
+class _SocketSession(SecureCookieSession):
+    """Session of a Socket.IO event whose player is cached"""
+
+
+app.session_interface = SocketSessionInterface(app.session_interface)
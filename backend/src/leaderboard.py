@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""
+Leaderboard kept in a Redis sorted set of player ids scored by player score.
+
+Scores are updated incrementally when a game is won, and every query is a
+sorted set lookup, so none of them touch the database. Usernames are kept
+in a hash next to the set so the entries can be returned as they are.
+"""
+from src import redis_conn
+
+LEADERBOARD_KEY = "leaderboard"
+USERNAMES_KEY = "leaderboard:usernames"
+
+
+def add_player(player):
+    """Adds a player to the leaderboard, keeping their score if already there"""
+    with redis_conn.pipeline() as pipe:
+        pipe.zadd(LEADERBOARD_KEY, {player.id: player.score or 0}, nx=True)
+        pipe.hset(USERNAMES_KEY, player.id, player.username)
+        pipe.execute()
+
+
+def add_score(player_id, points):
+    """Adds points to a player's leaderboard score; their username is set by `add_player`"""
+    redis_conn.zincrby(LEADERBOARD_KEY, points, player_id)
+
+
+def _entries(start, stop):
+    """Leaderboard entries for the 0-based ranks start to stop, inclusive"""
+    if stop < start:
+        return []
+    ranked = redis_conn.zrevrange(LEADERBOARD_KEY, start, stop, withscores=True)
+    if not ranked:
+        return []
+    usernames = redis_conn.hmget(USERNAMES_KEY, [player_id for player_id, _ in ranked])
+    return [{
+        "rank": start + offset + 1,
+        "username": username.decode() if username else None,
+        "score": int(score),
+    } for offset, ((player_id, score), username) in enumerate(zip(ranked, usernames))]
+
+
+def top(page=1, per_page=10):
+    """A page of the leaderboard, best players first"""
+    start = (page - 1) * per_page
+    return _entries(start, start + per_page - 1)
+
+
+def rank(player_id):
+    """The 1-based rank of a player, or None if they are not on the leaderboard"""
+    position = redis_conn.zrevrank(LEADERBOARD_KEY, player_id)
+    return None if position is None else position + 1
+
+
+def around(player_id, radius=5):
+    """The player's entry with up to radius players above and below it"""
+    position = redis_conn.zrevrank(LEADERBOARD_KEY, player_id)
+    if position is None:
+        return []
+    return _entries(max(position - radius, 0), position + radius)
+
+
+def rebuild(players):
+    """
+    Recreates the leaderboard from (id, username, score) rows, e.g. after
+    Redis lost its data. Returns the number of players added.
+    """
+    count = 0
+    with redis_conn.pipeline() as pipe:
+        pipe.delete(LEADERBOARD_KEY, USERNAMES_KEY)
+        for player_id, username, score in players:
+            pipe.zadd(LEADERBOARD_KEY, {player_id: score or 0})
+            pipe.hset(USERNAMES_KEY, player_id, username)
+            count += 1
+        pipe.execute()
+    return count
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+"""
+Matchmaking queue pairing players of similar skill.
+
+Players looking for an opponent sit in a Redis sorted set scored by their
+score (`Player.score`, as on the leaderboard), and in a second one scored by
+when they joined. A player's nearest opponent by score is always right next
+to them in the first set, so pairing them is a rank lookup, O(log n). They
+are only paired with an opponent within their search window, which starts
+at MATCHMAKING_WINDOW points and widens by MATCHMAKING_WIDENING points for
+every second they have waited.
+
+A player joining is paired straight away if an opponent is within reach.
+Otherwise a background task pairs the players who have waited longest, up
+to MATCHMAKING_BATCH of them every MATCHMAKING_TICK seconds, in one Lua
+call; only one worker pairs at a time. How long matched players waited goes
+to the `tictactoe_matchmaking_wait_seconds` histogram.
+"""
+import time
+
+from src import app, leaderboard, metrics, redis_conn
+
+# Players waiting, scored by their score
+QUEUE_KEY = "matchmaking:queue"
+# The same players, scored by when they joined
+WAITING_KEY = "matchmaking:waiting"
+# Only one worker pairs at a time
+PAIRING_LOCK_KEY = "matchmaking:pairing"
+
+# Pairs each of the given players with the nearest waiting player by score, if
+# within the player's window, and takes both out of the queue.
+# KEYS: queue, waiting. ARGV: player id and window, for each player.
+# Returns, for each pair, the player's id, score and join time, then the opponent's.
+_PAIR_SCRIPT = """
+local matches = {}
+for i = 1, #ARGV, 2 do
+    local player = ARGV[i]
+    local rank = redis.call('ZRANK', KEYS[1], player)
+    if rank then
+        local around = redis.call('ZRANGE', KEYS[1], math.max(rank - 1, 0), rank + 1, 'WITHSCORES')
+        local score = tonumber(redis.call('ZSCORE', KEYS[1], player))
+        local window = tonumber(ARGV[i + 1])
+        local opponent, opponent_score, gap
+        for j = 1, #around, 2 do
+            local distance = math.abs(tonumber(around[j + 1]) - score)
+            if around[j] ~= player and distance <= window and (not gap or distance < gap) then
+                opponent, opponent_score, gap = around[j], around[j + 1], distance
+            end
+        end
+        if opponent then
+            local joined = redis.call('ZMSCORE', KEYS[2], player, opponent)
+            redis.call('ZREM', KEYS[1], player, opponent)
+            redis.call('ZREM', KEYS[2], player, opponent)
+            for _, value in ipairs({player, tostring(score), joined[1], opponent, opponent_score, joined[2]}) do
+                table.insert(matches, value)
+            end
+        end
+    end
+end
+return matches
+"""
+_pair_script = redis_conn.register_script(_PAIR_SCRIPT)
+
+metrics.histogram("tictactoe_matchmaking_wait_seconds",
+                  "Time matched players waited in the matchmaking queue",
+                  (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+
+def window(waited):
+    """Score distance within which a player who waited that many seconds takes an opponent"""
+    return app.config["MATCHMAKING_WINDOW"] + app.config["MATCHMAKING_WIDENING"] * max(waited, 0)
+
+
+def _pair(windows, now):
+    """
+    Runs the pairing script for (player id, window) tuples. Returns the matches as
+    ((player id, score, joined), (opponent id, score, joined)) tuples.
+    """
+    if not windows:
+        return []
+    reply = _pair_script(keys=[QUEUE_KEY, WAITING_KEY],
+                         args=[value for player in windows for value in player])
+    matches = []
+    for i in range(0, len(reply), 6):
+        sides = tuple((reply[j].decode(), float(reply[j + 1]), float(reply[j + 2])) for j in (i, i + 3))
+        for _, _, joined in sides:
+            metrics.observe("tictactoe_matchmaking_wait_seconds", now - joined)
+        matches.append(sides)
+    return matches
+
+
+def join(player_id, score=None):
+    """
+    Puts a player in the queue, with their leaderboard score unless given, and pairs
+    them straight away if an opponent is within the starting window. A player already
+    waiting keeps their place. Returns the match, as `pair_waiting` does, or None.
+    """
+    if score is None:
+        score = redis_conn.zscore(leaderboard.LEADERBOARD_KEY, player_id) or 0
+    now = time.time()
+    with redis_conn.pipeline() as pipe:
+        pipe.zadd(WAITING_KEY, {player_id: now}, nx=True)
+        pipe.zadd(QUEUE_KEY, {player_id: score})
+        pipe.zscore(WAITING_KEY, player_id)
+        joined = pipe.execute()[-1]
+    matches = _pair([(player_id, window(now - joined))], now)
+    return matches[0] if matches else None
+
+
+def leave(player_id):
+    """Takes a player out of the queue. Returns whether they were waiting"""
+    with redis_conn.pipeline() as pipe:
+        pipe.zrem(QUEUE_KEY, player_id)
+        pipe.zrem(WAITING_KEY, player_id)
+        return bool(pipe.execute()[0])
+
+
+def restore(match):
+    """Puts the players of a match that could not be started back in the queue, in their places"""
+    with redis_conn.pipeline() as pipe:
+        for player_id, score, joined in match:
+            pipe.zadd(QUEUE_KEY, {player_id: score})
+            pipe.zadd(WAITING_KEY, {player_id: joined})
+        pipe.execute()
+
+
+def pair_waiting(now=None):
+    """
+    Pairs the MATCHMAKING_BATCH players who have waited longest, each with the
+    nearest opponent within their window. Returns the matches as ((player id, score,
+    joined), (opponent id, score, joined)) tuples, or None if another worker is pairing.
+    """
+    if not redis_conn.set(PAIRING_LOCK_KEY, 1, nx=True, ex=60):
+        return None
+    try:
+        now = time.time() if now is None else now
+        waiting = redis_conn.zrange(WAITING_KEY, 0, app.config["MATCHMAKING_BATCH"] - 1, withscores=True)
+        return _pair([(player_id, window(now - joined)) for player_id, joined in waiting], now)
+    finally:
+        redis_conn.delete(PAIRING_LOCK_KEY)
+
+
+def _longest_wait():
+    oldest = redis_conn.zrange(WAITING_KEY, 0, 0, withscores=True)
+    return round(time.time() - oldest[0][1], 3) if oldest else 0
+
+
+metrics.gauge("tictactoe_matchmaking_queued", "Players waiting in the matchmaking queue",
+              lambda: redis_conn.zcard(QUEUE_KEY))
+metrics.gauge("tictactoe_matchmaking_longest_wait_seconds",
+              "How long the player waiting longest in the matchmaking queue has waited", _longest_wait)
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+"""
+Per-handler metrics, exposed in the Prometheus text format on /metrics.
+
+Every HTTP request and every Socket.IO event decorated with `instrument` is
+timed into a latency histogram, along with its error count and the number
+of SQL queries and Redis commands it issued. The counters live in this
+process; with several workers, each one is scraped on its own.
+
+Set SLOW_EVENT_MS to log every call slower than that, with its SQL queries.
+"""
+import bisect
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src import app, redis_conn
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+# (kind, handler) -> [bucket counts..., +Inf count, sum, errors, sql queries, redis commands]
+_series = {}
+# (name, description, function returning the value)
+_gauges = []
+# name -> (description, bucket bounds, [bucket counts..., +Inf count, sum])
+_histograms = {}
+
+
+def _begin():
+    """Starts measuring the handler running in the current context"""
+    g.metrics_call = {"start": time.perf_counter(), "sql": 0, "redis": 0,
+                      "queries": [] if app.config["SLOW_EVENT_MS"] else None}
+
+
+def _end(kind, handler, error):
+    """Records the handler running in the current context"""
+    call = g.pop("metrics_call", None)
+    if call is None:
+        return
+    elapsed = time.perf_counter() - call["start"]
+    with _lock:
+        series = _series.get((kind, handler))
+        if series is None:
+            series = _series[(kind, handler)] = [0] * (len(BUCKETS) + 5)
+        series[bisect.bisect_left(BUCKETS, elapsed)] += 1
+        series[-4] += elapsed
+        series[-3] += bool(error)
+        series[-2] += call["sql"]
+        series[-1] += call["redis"]
+
+    slow = app.config["SLOW_EVENT_MS"]
+    if slow and elapsed * 1000 >= slow:
+        app.logger.warning("Slow %s %s: %.1f ms, %d queries, %d Redis commands%s",
+                           kind, handler, elapsed * 1000, call["sql"], call["redis"],
+                           "".join("\n  " + query for query in call["queries"]))
+
+
+def _current_call():
+    return g.get("metrics_call") if has_app_context() else None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    call = _current_call()
+    if call is not None:
+        call["sql"] += 1
+        if call["queries"] is not None:
+            call["queries"].append(statement)
+
+
+def count_redis_commands(client):
+    """Counts the commands sent through a Redis client, including those in pipelines"""
+    execute_command = client.execute_command
+    make_pipeline = client.pipeline
+
+    def counted_command(*args, **kwargs):
+        call = _current_call()
+        if call is not None:
+            call["redis"] += 1
+        return execute_command(*args, **kwargs)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = make_pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def counted_execute(*args, **kwargs):
+            call = _current_call()
+            if call is not None:
+                call["redis"] += len(pipe.command_stack)
+            return execute(*args, **kwargs)
+        pipe.execute = counted_execute
+        return pipe
+
+    client.execute_command = counted_command
+    client.pipeline = counted_pipeline
+
+
+def instrument(handler):
+    """Decorator recording a Socket.IO event handler; goes below `@socketio.on`"""
+    @wraps(handler)
+    def instrumented(*args, **kwargs):
+        name = request.event["message"] if getattr(request, "event", None) else handler.__name__
+        _begin()
+        error = True
+        try:
+            result = handler(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            _end("socketio", name, error)
+    return instrumented
+
+
+@app.before_request
+def _begin_request():
+    _begin()
+
+
+@app.after_request
+def _note_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def _end_request(exc):
+    handler = request.url_rule.rule if request.url_rule else "unmatched"
+    _end("http", handler, exc is not None or g.get("metrics_status", 500) >= 500)
+
+
+def render():
+    """The metrics in the Prometheus text exposition format"""
+    with _lock:
+        snapshot = sorted((key, list(series)) for key, series in _series.items())
+    lines = [
+        "# HELP tictactoe_handler_seconds Time spent in HTTP requests and Socket.IO events",
+        "# TYPE tictactoe_handler_seconds histogram",
+    ]
+    for (kind, handler), series in snapshot:
+        labels = f'kind="{kind}",handler="{_escape(handler)}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), series):
+            cumulative += count
+            lines.append(f'tictactoe_handler_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"tictactoe_handler_seconds_sum{{{labels}}} {series[-4]:.6f}")
+        lines.append(f"tictactoe_handler_seconds_count{{{labels}}} {cumulative}")
+    for offset, name, description in (
+            (-3, "errors", "Handlers that raised or answered with a 5xx status"),
+            (-2, "sql_queries", "SQL queries issued by handlers"),
+            (-1, "redis_commands", "Redis commands issued by handlers")):
+        lines.append(f"# HELP tictactoe_handler_{name}_total {description}")
+        lines.append(f"# TYPE tictactoe_handler_{name}_total counter")
+        for (kind, handler), series in snapshot:
+            lines.append(f'tictactoe_handler_{name}_total{{kind="{kind}",handler="{_escape(handler)}"}} '
+                         f"{series[offset]}")
+    with _lock:
+        histograms = sorted((name, description, buckets, list(series))
+                            for name, (description, buckets, series) in _histograms.items())
+    for name, description, buckets, series in histograms:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(buckets + ("+Inf",), series):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f"{name}_sum {series[-1]:.6f}", f"{name}_count {cumulative}"]
+    for name, description, read in _gauges:
+        try:
+            value = read()
+        except Exception:
+            app.logger.exception("Reading gauge %s failed", name)
+            continue
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def gauge(name, description, read):
+    """Registers a gauge, whose value is read by calling read() on every scrape"""
+    _gauges.append((name, description, read))
+
+
+def histogram(name, description, buckets=BUCKETS):
+    """Registers a histogram with the given bucket bounds; `observe` records values into it"""
+    _histograms[name] = (description, buckets, [0] * (len(buckets) + 2))
+
+
+def observe(name, value):
+    """Records a value into a histogram registered with `histogram`"""
+    _, buckets, series = _histograms[name]
+    with _lock:
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-1] += value
+
+
+def reset():
+    """Forgets everything recorded so far"""
+    with _lock:
+        _series.clear()
+        for _, _, series in _histograms.values():
+            series[:] = [0] * len(series)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+count_redis_commands(redis_conn)
+count_redis_commands(app.config["SESSION_REDIS"])
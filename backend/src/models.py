@@ -4,10 +4,45 @@ Contains the models of the application.
 """
 import string
 import random, uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src import db, friends, redis_conn, leaderboard
+from src.state import GameState
+
+# Sorted set of the ids of games waiting for a second player, scored by creation time
+OPEN_GAMES_KEY = "games:open"
+# How many open games to sample per attempt when joining a random one
+OPEN_GAME_SAMPLE = 5
+# Seconds a claim on a game is held, long enough to add the second player
+CLAIM_TTL = 60
+
+# Claims a game for a joining player. Taking the game out of the open games index
+# and setting its claim marker happen together, so exactly one player wins a game
+# whether it was found in the index or, if it is missing from there, by its code.
+# KEYS: open games index, claim marker. ARGV: game id, player id, claim TTL.
+_CLAIM_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+if redis.call('SET', KEYS[2], ARGV[2], 'NX', 'EX', ARGV[3]) then return 1 end
+return 0
+"""
+_claim_script = redis_conn.register_script(_CLAIM_SCRIPT)
+
+
+def encode_cursor(row):
+    """Opaque pagination cursor pointing just after the given game or message"""
+    return urlsafe_b64encode(f"{row.created_at.isoformat()}|{row.id}".encode()).decode()
 
-from src import db
+def decode_cursor(cursor):
+    """Returns the (created_at, id) encoded in a cursor"""
+    try:
+        created_at, row_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, UnicodeError) as error:
+        raise ValueError("Invalid cursor") from error
 
 
 class BaseModel():
@@ -26,7 +61,7 @@ class GamePlayerAssociation(db.Model):
     """Association table between players and games"""
     __tablename__ = "game_players"
     player_id = db.Column(db.String(36), db.ForeignKey("players.id"), primary_key=True, nullable=True)
-    game_id = db.Column(db.String(36), db.ForeignKey("games.id"), primary_key=True)
+    game_id = db.Column(db.String(36), db.ForeignKey("games.id"), primary_key=True, index=True)
     player = db.relationship("Player", backref="played_games")
     game = db.relationship("Game", backref="game_players")
 
@@ -40,6 +75,12 @@ class Player(BaseModel, db.Model, UserMixin):
     password = db.Column(db.String(60), nullable=False)
     playing = db.Column(db.Boolean, default=False) # This would come in handy if we choose to prohibit a user playing multiple games simultaneously
     score = db.Column(db.Integer, default=0)
+    # Results, kept up to date as games end rather than counted from game_players
+    wins = db.Column(db.Integer, default=0)
+    losses = db.Column(db.Integer, default=0)
+    draws = db.Column(db.Integer, default=0)
+    streak = db.Column(db.Integer, default=0) # Consecutive wins if positive, losses if negative
+    best_streak = db.Column(db.Integer, default=0) # Most consecutive wins
     won_games = db.relationship("Game", backref="winner")
     moves = db.relationship("Move", backref="moving_player")
     messages = db.relationship("Message", backref="messaging_player")
@@ -52,6 +93,11 @@ class Player(BaseModel, db.Model, UserMixin):
             "username": self.username,
             "playing": self.playing,
             "score": self.score,
+            "wins": self.wins,
+            "losses": self.losses,
+            "draws": self.draws,
+            "streak": self.streak,
+            "best_streak": self.best_streak,
         }
 
     def create_game(self, difficulty):
@@ -66,31 +112,37 @@ class Player(BaseModel, db.Model, UserMixin):
         gp_assoc.game_id = new_game.id
         db.session.add(gp_assoc)
         db.session.commit()
+        new_game.open()
 
         return new_game
 
     def join_game_with_code(self, code):
-        """Joins an existing game with the given code"""
+        """
+        Joins an existing game with the given code. The game is claimed the same way
+        as in `join_random_game`, so a player joining by code can't race another one
+        into the same game.
+        """
         game = Game.query.filter_by(code=code).first()
 
-        if game:
+        if game and not game.finished and Game.claim(game.id, self.id):
             if len(game.game_players) == 1:
                 player1 = game.game_players[0].player
                 if self is not player1:
                     gp_assoc = GamePlayerAssociation()
                     gp_assoc.player_id = self.id
                     gp_assoc.game_id = game.id
-                    print(gp_assoc.player_id)
                     db.session.add(gp_assoc)
                     db.session.commit()
                     return game
+                # The creator can't join their own game, which stays open
+                Game.release(game.id)
+                game.open()
         return None
     
     def join_random_game(self):
         """Joins a random game from the available games"""
-        available_games = self.get_available_games()
-        if available_games:
-            random_game = random.choice(available_games)
+        random_game = Game.claim_open_game(self)
+        if random_game:
             assoc = GamePlayerAssociation()
             assoc.game_id = random_game.id
             assoc.player_id = self.id
@@ -99,11 +151,15 @@ class Player(BaseModel, db.Model, UserMixin):
             return random_game
         return None
     
-    def get_available_games(self):
-        """Returns a list of all available/joinable games"""
-        all_games = Game.query.all()
-        available_games = [game for game in all_games if len(game.game_players) == 1]
-        return available_games
+    def get_available_games(self, page=1, per_page=20):
+        """Returns a page of the available/joinable games, newest first"""
+        start = (page - 1) * per_page
+        game_ids = [game_id.decode() for game_id in
+                    redis_conn.zrevrange(OPEN_GAMES_KEY, start, start + per_page - 1)]
+        if not game_ids:
+            return []
+        games = {game.id: game for game in Game.query.with_details().filter(Game.id.in_(game_ids))}
+        return [games[game_id] for game_id in game_ids if game_id in games]
 
     def send_message(self, game_id, text):
         """Sends a message in the game chat"""
@@ -117,9 +173,9 @@ class Player(BaseModel, db.Model, UserMixin):
         return message
 
     def send_friend_request(self, player_username):
-        """Sends a friend request to the player with given id"""
+        """Sends a friend request to the player with given username, unless they are friends already"""
         player = Player.query.filter_by(username=player_username).first()
-        if player and player is not self and player not in self.get_all_friends():
+        if player and player.id != self.id and not friends.are_friends(self.id, player.id):
             friend_request = FriendRequest()
             friend_request.sender_id = self.id
             friend_request.receiver_id = player.id
@@ -129,13 +185,15 @@ class Player(BaseModel, db.Model, UserMixin):
         return None
     
     def get_friend_requests(self):
-        """Gets all friend requests sent to this player"""
-        return FriendRequest.query.filter_by(receiver_id=self.id).all()
+        """Gets all friend requests sent to this player, with their players, in one query"""
+        return (FriendRequest.query.options(joinedload(FriendRequest.sender),
+                                            joinedload(FriendRequest.receiver))
+                .filter_by(receiver_id=self.id).all())
     
     def accept_friend_request(self, request_id):
-        """Accepts a friend request"""
-        request = FriendRequest.query.get(request_id)
-        if request:
+        """Accepts a friend request sent to this player"""
+        request = db.session.get(FriendRequest, request_id) if request_id else None
+        if request and request.receiver_id == self.id:
             friendship = Friendship()
             friendship.player1_id = request.sender_id
             friendship.player2_id = request.receiver_id
@@ -143,26 +201,23 @@ class Player(BaseModel, db.Model, UserMixin):
             db.session.add(friendship)
             db.session.delete(request)
             db.session.commit()
+            friends.forget(request.sender_id, request.receiver_id)
             return friendship
         return None
     
     def reject_friend_request(self, request_id):
-        """Rejects a friend request"""
-        request = FriendRequest.query.get(request_id)
-        if request:
+        """Rejects a friend request sent to this player"""
+        request = db.session.get(FriendRequest, request_id) if request_id else None
+        if request and request.receiver_id == self.id:
             db.session.delete(request)
             db.session.commit()
+            friends.forget(request.sender_id, request.receiver_id)
             return True
         return False
     
     def get_all_friends(self):
-        """Returns all friends of this player"""
-        friendships = Friendship.query.filter((Friendship.player1_id == self.id)
-                                          | (Friendship.player2_id == self.id)).all()
-        return [Player.query.get(f_ship.player1_id)
-                if f_ship.player1_id != self.id
-                else Player.query.get(f_ship.player2_id)
-                for f_ship in friendships]
+        """Returns all friends of this player, in one query"""
+        return Player.query.filter(Player.id.in_(Friendship.ids_of(self.id))).all()
     
     def make_move(self, game_id, tile_number):
         """Makes a move in a single game"""
@@ -180,24 +235,126 @@ class Player(BaseModel, db.Model, UserMixin):
             return move
         return None
     
-    def get_previous_games(self):
-        """Gets the previous games of a player"""
-        return [played_game.game for played_game in self.played_games
-        if played_game.game.finished]
+    def get_previous_games(self, cursor=None, limit=20, details=True):
+        """
+        Gets a page of the finished games of a player, newest first.
+        Pages are keyed on (created_at, id), so every page costs the same few queries
+        however many games came before it. Pass the returned cursor to get the next page.
+        Without details only the games' rows are loaded, in one query.
+        Returns a tuple of the games and the next cursor, None on the last page.
+        Raises ValueError if the cursor is malformed.
+        """
+        query = Game.query.with_details() if details else Game.query
+        query = (query
+                 .join(GamePlayerAssociation, GamePlayerAssociation.game_id == Game.id)
+                 .filter(GamePlayerAssociation.player_id == self.id, Game.finished.is_(True))
+                 .order_by(Game.created_at.desc(), Game.id.desc()))
+        if cursor:
+            created_at, game_id = decode_cursor(cursor)
+            query = query.filter(db.or_(Game.created_at < created_at,
+                                        db.and_(Game.created_at == created_at, Game.id < game_id)))
+        games = query.limit(limit + 1).all()
+        if len(games) > limit:
+            games = games[:limit]
+            return games, encode_cursor(games[-1])
+        return games, None
+
+    @staticmethod
+    def record_result(condition, outcome, points=0):
+        """
+        Counts a win, loss or draw for the players matching condition, adding points
+        to their score. Every column is changed by one UPDATE computing the new values
+        from the old ones in SQL, so nothing is read first and concurrent results for
+        the same player add up. The caller commits.
+        Args:
+            condition: A SQL expression selecting the players, e.g. `Player.id == player_id`.
+            outcome (str): 'win', 'loss' or 'draw'.
+            points (int): Score to add.
+        """
+        if outcome == "win":
+            streak = db.case((Player.streak > 0, Player.streak + 1), else_=1)
+            # best_streak goes first, as MySQL sees the new value of columns set earlier
+            values = ((Player.best_streak, db.case((streak > Player.best_streak, streak),
+                                                   else_=Player.best_streak)),
+                      (Player.streak, streak),
+                      (Player.wins, Player.wins + 1))
+        elif outcome == "loss":
+            values = ((Player.streak, db.case((Player.streak < 0, Player.streak - 1), else_=-1)),
+                      (Player.losses, Player.losses + 1))
+        else:
+            values = ((Player.streak, 0), (Player.draws, Player.draws + 1))
+        if points:
+            values += ((Player.score, Player.score + points),)
+        db.session.execute(db.update(Player).where(condition).ordered_values(*values)
+                           .execution_options(synchronize_session=False))
+
+    @staticmethod
+    def rebuild_stats():
+        """
+        Recompute every player's wins, losses, draws and streaks from the finished games.
+        Only needed once for games that ended before the stats were kept. Games the AI
+        won are told from draws by their archived state, and count as draws without one.
+        Returns the number of players updated.
+        """
+        games = (db.session.query(Game.id, Game.winner_id, Game.state)
+                 .filter(Game.finished.is_(True))
+                 .order_by(Game.created_at, Game.id).all())
+        players = {}
+        for game_id, player_id in db.session.query(GamePlayerAssociation.game_id,
+                                                   GamePlayerAssociation.player_id):
+            if player_id:
+                players.setdefault(game_id, []).append(player_id)
+        stats = {}
+        for game_id, winner_id, state in games:
+            ai_won = winner_id is None and state is not None and GameState.unpack(state).winner == "O"
+            for player_id in players.get(game_id, ()):
+                wins, losses, draws, streak, best = stats.get(player_id, (0, 0, 0, 0, 0))
+                if player_id == winner_id:
+                    wins, streak = wins + 1, max(streak, 0) + 1
+                    best = max(best, streak)
+                elif winner_id is not None or ai_won:
+                    losses, streak = losses + 1, min(streak, 0) - 1
+                else:
+                    draws, streak = draws + 1, 0
+                stats[player_id] = (wins, losses, draws, streak, best)
+        db.session.execute(db.update(Player).values(wins=0, losses=0, draws=0, streak=0, best_streak=0))
+        if stats:
+            db.session.execute(db.update(Player), [
+                {"id": player_id, "wins": wins, "losses": losses, "draws": draws,
+                 "streak": streak, "best_streak": best}
+                for player_id, (wins, losses, draws, streak, best) in stats.items()])
+        db.session.commit()
+        return len(stats)
+
+
+class GameQuery(db.Query):
+    """Query class for games"""
+
+    def with_details(self):
+        """Loads everything `Game.to_dict` needs up front, in a fixed number of queries"""
+        return self.options(
+            selectinload(Game.game_players).joinedload(GamePlayerAssociation.player),
+            selectinload(Game.moves),
+            selectinload(Game.messages),
+        )
 
 
 class Game(BaseModel, db.Model):
     """Model for the tic-tac-toe game"""
     __tablename__ = "games"
+    __table_args__ = (db.Index("ix_games_updated_at_id", "updated_at", "id"),)
+    query_class = GameQuery
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
 
     code = db.Column(db.String(10), unique=True)
     difficulty = db.Column(db.Integer, default=1)
     finished = db.Column(db.Boolean, default=False)
     winner_id = db.Column(db.String(36), db.ForeignKey("players.id"), nullable=True)
-    moves = db.relationship("Move", backref="moved_game", # For lack of a better term
+    state = db.Column(db.LargeBinary(67), nullable=True) # Final packed GameState, once archived
+    analysis = db.Column(db.JSON, nullable=True) # Rating of every move, once analysed (see src.analysis)
+    moves = db.relationship("Move", backref="moved_game", order_by="Move.number", # For lack of a better term
                             cascade="all, delete, delete-orphan")
-    messages = db.relationship("Message", backref="messaged_game")
+    messages = db.relationship("Message", backref="messaged_game", order_by="Message.created_at")
 
     def __init__(self):
         self.code = self.generate_random_code(8)
@@ -213,9 +370,25 @@ class Game(BaseModel, db.Model):
             "winner_id": self.winner_id,
             "game_players": [game_player.player.to_dict() for game_player in game_players],
             "moves": [move.to_dict() for move in self.moves],
-            "messages": [message.to_dict() for message in self.messages]
+            "messages": [message.to_dict() for message in self.messages],
+            "analysis": self.analysis
         }
 
+    @staticmethod
+    def create_match(player_ids, difficulty=1):
+        """
+        Creates a game between the given players, 'X' first, together with their
+        player rows in one transaction, and returns it. It is never listed as open.
+        """
+        game = Game()
+        game.id = str(uuid.uuid4())
+        game.difficulty = difficulty
+        db.session.add(game)
+        db.session.add_all([GamePlayerAssociation(game_id=game.id, player_id=player_id)
+                            for player_id in player_ids])
+        db.session.commit()
+        return game
+
     def generate_random_code(self, length):
         """
         Generate a random string of given length consisting of
@@ -223,39 +396,170 @@ class Game(BaseModel, db.Model):
         """
         return "".join(random.SystemRandom().choice(string.ascii_uppercase + string.digits)
                        for _ in range(length))
+
+    def get_messages(self, cursor=None, limit=50):
+        """
+        Gets a page of the game's chat messages written to the messages table, newest first.
+        Pages are keyed on (created_at, id) like `Player.get_previous_games`.
+        Returns a tuple of the messages and the next cursor, None on the last page.
+        Raises ValueError if the cursor is malformed.
+        """
+        query = (Message.query.filter_by(game_id=self.id)
+                 .order_by(Message.created_at.desc(), Message.id.desc()))
+        if cursor:
+            created_at, message_id = decode_cursor(cursor)
+            query = query.filter(db.or_(Message.created_at < created_at,
+                                        db.and_(Message.created_at == created_at,
+                                                Message.id < message_id)))
+        messages = query.limit(limit + 1).all()
+        if len(messages) > limit:
+            messages = messages[:limit]
+            return messages, encode_cursor(messages[-1])
+        return messages, None
     
+    def open(self):
+        """Adds the game to the index of games waiting for a second player"""
+        created_at = self.created_at or datetime.utcnow()
+        redis_conn.zadd(OPEN_GAMES_KEY, {self.id: created_at.timestamp()})
+
+    def close(self):
+        """Removes the game from the index of open games"""
+        redis_conn.zrem(OPEN_GAMES_KEY, self.id)
+
+    @staticmethod
+    def claim_key(game_id):
+        """Redis key of the marker held by the player claiming a game"""
+        return f"{game_id}:claimed"
+
+    @staticmethod
+    def claim(game_id, player_id):
+        """
+        Atomically claims a game for a joining player and takes it out of the open
+        games index. Returns True for exactly one caller per game; the caller must
+        still check that the game is waiting for a second player.
+        """
+        return bool(_claim_script(keys=[OPEN_GAMES_KEY, Game.claim_key(game_id)],
+                                  args=[game_id, player_id, CLAIM_TTL]))
+
+    @staticmethod
+    def release(game_id):
+        """Gives up a claim on a game, e.g. when it turned out to be the player's own"""
+        redis_conn.delete(Game.claim_key(game_id))
+
+    @staticmethod
+    def claim_open_game(player):
+        """
+        Takes a random open game not created by the given player out of the open games
+        index and returns it, or None if there is none. Games are taken with `claim`,
+        so two players can never claim the same game.
+        """
+        for _ in range(OPEN_GAME_SAMPLE):
+            candidates = redis_conn.zrandmember(OPEN_GAMES_KEY, OPEN_GAME_SAMPLE, withscores=True)
+            if not candidates:
+                return None
+            own_games = {}
+            for game_id, created in zip(candidates[::2], candidates[1::2]):
+                game_id = game_id.decode()
+                if not Game.claim(game_id, player.id):
+                    continue  # Somebody else claimed it first
+                game = Game.query.get(game_id)
+                if game is None or game.finished or len(game.game_players) != 1:
+                    continue  # Stale entry, leave it out of the index
+                if game.game_players[0].player_id == player.id:
+                    Game.release(game_id)
+                    own_games[game_id] = float(created)
+                    continue
+                if own_games:
+                    redis_conn.zadd(OPEN_GAMES_KEY, own_games)
+                return game
+            if own_games:
+                redis_conn.zadd(OPEN_GAMES_KEY, own_games)
+                if len(own_games) == len(candidates) // 2:
+                    return None  # Only the player's own games are open
+        return None
+
+    @staticmethod
+    def rebuild_open_games_index():
+        """Recreates the open games index from the database and returns its size"""
+        open_games = (db.session.query(Game.id, Game.created_at)
+                      .join(GamePlayerAssociation, GamePlayerAssociation.game_id == Game.id)
+                      .filter(Game.finished.is_(False))
+                      .group_by(Game.id, Game.created_at)
+                      .having(db.func.count(GamePlayerAssociation.player_id) == 1))
+        with redis_conn.pipeline() as pipe:
+            pipe.delete(OPEN_GAMES_KEY)
+            for game_id, created_at in open_games.yield_per(1000):
+                pipe.zadd(OPEN_GAMES_KEY, {game_id: (created_at or datetime.utcnow()).timestamp()})
+            pipe.zcard(OPEN_GAMES_KEY)
+            return pipe.execute()[-1]
+
     def declare_winner(self, player_id):
-        """Change game state to finished and set the winner"""
-        player = Player.query.get(player_id)
-        if player:
-            self.winner_id = player_id
-            self.finished = True
-            player.score += (self.difficulty * 100) # Tentative... To be changed on further notice
-            db.session.add(self)
-            db.session.add(player)
-            db.session.commit()
+        """
+        Change game state to finished and set the winner, None when the AI won.
+        The winner's score and every player's stats are updated in SQL without
+        loading the players, and only by whichever call finished the game.
+        """
+        points = self.difficulty * 100 # Tentative... To be changed on further notice
+        if not self._finish(player_id):
+            return
+        if player_id:
+            Player.record_result(Player.id == player_id, "win", points)
+        Player.record_result(Player.id.in_(self._player_ids(exclude=player_id)), "loss")
+        db.session.commit()
+        self.close()
+        if player_id:
+            leaderboard.add_score(player_id, points)
 
     def declare_draw(self):
         """Change game status to finished and set as a draw"""
-        self.finished = True
-        self.winner_id = None
-        db.session.add(self)
+        if not self._finish(None):
+            return
+        Player.record_result(Player.id.in_(self._player_ids()), "draw")
         db.session.commit()
+        self.close()
+
+    def _finish(self, winner_id):
+        """
+        Mark the game finished with the given winner, unless it already is, in one
+        conditional UPDATE. Returns whether this call finished it.
+        """
+        result = db.session.execute(
+            db.update(Game)
+            .where(Game.id == self.id, db.or_(Game.finished.is_(False), Game.finished.is_(None)))
+            .values(finished=True, winner_id=winner_id, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False))
+        if result.rowcount != 1:
+            return False
+        set_committed_value(self, "finished", True)
+        set_committed_value(self, "winner_id", winner_id)
+        return True
+
+    def _player_ids(self, exclude=None):
+        """Subquery of the ids of the game's players, but for exclude"""
+        query = db.select(GamePlayerAssociation.player_id).where(
+            GamePlayerAssociation.game_id == self.id, GamePlayerAssociation.player_id.isnot(None))
+        if exclude:
+            query = query.where(GamePlayerAssociation.player_id != exclude)
+        return query
 
 
 
 class Move(BaseModel, db.Model):
     """Model for a single move in a game"""
     __tablename__ = "moves"
+    # Exports walk rows in order of their last write (see src.export)
+    __table_args__ = (db.Index("ix_moves_updated_at_id", "updated_at", "id"),)
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    number = db.Column(db.Integer) # Position of the move in its game, starting at 1
     tile_number = db.Column(db.Integer, nullable=False)
     game_id = db.Column(db.String(36), db.ForeignKey("games.id"))
-    player_id = db.Column(db.String(36), db.ForeignKey("players.id"), nullable=False)
+    player_id = db.Column(db.String(36), db.ForeignKey("players.id"), nullable=True) # None for the AI
 
     def to_dict(self):
         """Dictionary representation"""
         return {
             "id": self.id,
+            "number": self.number,
             "tile_number": self.tile_number,
             "game_id": self.game_id,
             "player_id": self.player_id
@@ -265,6 +569,8 @@ class Move(BaseModel, db.Model):
 class Message(BaseModel, db.Model):
     """Model for messages sent by players during games"""
     __tablename__ = "messages"
+    __table_args__ = (db.Index("ix_messages_game_id_created_at", "game_id", "created_at", "id"),
+                      db.Index("ix_messages_updated_at_id", "updated_at", "id"))
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     text = db.Column(db.Text, nullable=False)
     player_id = db.Column(db.String(36), db.ForeignKey("players.id"))
@@ -276,7 +582,8 @@ class Message(BaseModel, db.Model):
             "id": self.id,
             "text": self.text,
             "player_id": self.player_id,
-            "game_id": self.game_id
+            "game_id": self.game_id,
+            "created_at": self.created_at.isoformat() if self.created_at else None
         }
 
 
@@ -284,28 +591,39 @@ class Friendship(db.Model):
     """Model for friendship amongst players"""
     __tablename__ = "friendships"
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    player1_id = db.Column(db.String(36), db.ForeignKey("players.id"))
-    player2_id = db.Column(db.String(36), db.ForeignKey("players.id"))
+    player1_id = db.Column(db.String(36), db.ForeignKey("players.id"), index=True)
+    player2_id = db.Column(db.String(36), db.ForeignKey("players.id"), index=True)
+    player1 = db.relationship("Player", foreign_keys=[player1_id])
+    player2 = db.relationship("Player", foreign_keys=[player2_id])
 
     def to_dict(self):
         """Dictionary representation"""
         return {
             "id": self.id,
-            "player1": Player.query.get(self.player1_id).to_dict(),
-            "player2": Player.query.get(self.player2_id).to_dict()
+            "player1": self.player1.to_dict(),
+            "player2": self.player2.to_dict()
         }
 
+    @staticmethod
+    def ids_of(player_id):
+        """Query of the ids of a player's friends, on either side of their friendships"""
+        return (db.select(db.case((Friendship.player1_id == player_id, Friendship.player2_id),
+                                  else_=Friendship.player1_id))
+                .where(db.or_(Friendship.player1_id == player_id, Friendship.player2_id == player_id)))
+
 class FriendRequest(db.Model):
     """Model for friend requests"""
     __tablename__ = "friend_requests"
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     sender_id = db.Column(db.String(36), db.ForeignKey("players.id"))
-    receiver_id = db.Column(db.String(36), db.ForeignKey("players.id"))
+    receiver_id = db.Column(db.String(36), db.ForeignKey("players.id"), index=True)
+    sender = db.relationship("Player", foreign_keys=[sender_id])
+    receiver = db.relationship("Player", foreign_keys=[receiver_id])
 
     def to_dict(self):
         """Dictionary representation"""
         return {
             "id": self.id,
-            "sender": Player.get(self.sender_id).to_dict(),
-            "receiver": Player.get(self.receiver_id).to_dict()
+            "sender": self.sender.to_dict(),
+            "receiver": self.receiver.to_dict()
         }
\ No newline at end of file
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+"""
+Password hashing and checking off the request threads.
+
+bcrypt is deliberately slow, tens of milliseconds of CPU per call at the
+default cost. Calls run in a small process pool whose workers have a lower
+scheduling priority than the server, so a burst of logins queues up there
+instead of delaying live games. At most PASSWORD_QUEUE calls may be queued
+or running at once; beyond that `PasswordsBusy` is raised straight away so
+the route can answer 503.
+
+PASSWORD_WORKERS = 0 hashes inline instead, which suits tests and scripts.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from src import app
+
+# How much lower than the server the pool workers are scheduled (see nice(2))
+WORKER_NICENESS = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(app.config["PASSWORD_QUEUE"])
+
+
+class PasswordsBusy(Exception):
+    """Raised when too many password checks are already waiting"""
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # A fork server, since forking this multi-threaded process is unsafe
+                _pool = ProcessPoolExecutor(app.config["PASSWORD_WORKERS"],
+                                            mp_context=multiprocessing.get_context("forkserver"),
+                                            initializer=os.nice, initargs=(WORKER_NICENESS,))
+    return _pool
+
+
+def _run(function, *args):
+    """Run function in the pool, waiting for its result, or inline without a pool"""
+    if not app.config["PASSWORD_WORKERS"]:
+        return function(*args)
+    if not _slots.acquire(blocking=False):
+        raise PasswordsBusy()
+    try:
+        return _get_pool().submit(function, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    """Hash a password with the configured bcrypt cost. Returns the hash as a string"""
+    salt = bcrypt.gensalt(app.config["BCRYPT_LOG_ROUNDS"])
+    return _run(bcrypt.hashpw, password.encode(), salt).decode()
+
+
+def check_password(password_hash, password):
+    """Whether password matches a hash made by `hash_password` or Flask-Bcrypt"""
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode()
+    try:
+        return _run(bcrypt.checkpw, password.encode(), password_hash)
+    except ValueError:
+        return False  # Not a bcrypt hash
+
+
+def shutdown():
+    """Stop the pool's workers"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+"""
+Cache of the JSON of finished games, served by `/game_details` and `/history`.
+
+Once a game is finished its `Game.to_dict` only changes when its rows are
+written again: moves or chat messages written out after the last move, or
+its analysis arriving. Those writes call `invalidate`. Until then the
+serialized JSON is kept in Redis with a strong ETag, so `/game_details`
+answers with the stored bytes, or 304 to a matching If-None-Match, without
+any SQL, and `/history` assembles its pages from the stored games. The
+players embedded in a cached game are as they were when it was cached.
+
+Clients are only told to keep a game for good once it has settled: archived,
+analysed, and SETTLE_SECONDS past that, by when the last chat messages queued
+before it finished are written out. Until then they revalidate every time.
+
+At most RESPONSE_CACHE_BYTES of JSON are kept, evicting the games served
+least recently first. A render that raced an invalidation isn't stored:
+every invalidation bumps the game's generation, which `store` checks.
+"""
+import hashlib
+import time
+from datetime import timezone
+
+from src import app, redis_conn
+
+# game id -> JSON of the finished game
+BODIES_KEY = "responses:games"
+# game id -> ETag of that JSON
+ETAGS_KEY = "responses:etags"
+# game id scored by when it was last served
+SERVED_KEY = "responses:served"
+# game id -> Unix time from which the game has settled, empty until it is archived and analysed
+SETTLED_KEY = "responses:settled"
+# Total size of the stored JSON, in bytes
+SIZE_KEY = "responses:bytes"
+# Seconds a game's generation outlives its last invalidation, longer than any render takes
+GENERATION_TTL = 300
+# Longer than queued chat messages take to be written out
+SETTLE_SECONDS = 60
+
+# Looks games up and marks them served.
+# KEYS: bodies, ETags, served, settled, then the generation key of each game.
+# ARGV: time, then the game ids.
+# Returns the ETag, JSON, settling time and generation of each game, '' for a game not stored.
+_LOOKUP_SCRIPT = """
+local reply = {}
+for i = 2, #ARGV do
+    local etag = redis.call('HGET', KEYS[2], ARGV[i])
+    if etag then
+        redis.call('ZADD', KEYS[3], ARGV[1], ARGV[i])
+        table.insert(reply, etag)
+        table.insert(reply, redis.call('HGET', KEYS[1], ARGV[i]) or '')
+        table.insert(reply, redis.call('HGET', KEYS[4], ARGV[i]) or '')
+    else
+        table.insert(reply, '')
+        table.insert(reply, '')
+        table.insert(reply, '')
+    end
+    table.insert(reply, redis.call('GET', KEYS[3 + i]) or '0')
+end
+return reply
+"""
+
+# Stores games whose generation hasn't changed, then evicts the least recently
+# served games until the JSON fits.
+# KEYS: bodies, ETags, served, settled, size, then the generation key of each game.
+# ARGV: time, byte limit, then the id, ETag, JSON, settling time and generation of each game.
+_STORE_SCRIPT = """
+local size = tonumber(redis.call('GET', KEYS[5]) or '0')
+for i = 3, #ARGV, 5 do
+    local id = ARGV[i]
+    if (redis.call('GET', KEYS[5 + (i - 3) / 5 + 1]) or '0') == ARGV[i + 4] then
+        size = size - redis.call('HSTRLEN', KEYS[1], id) + string.len(ARGV[i + 2])
+        redis.call('HSET', KEYS[1], id, ARGV[i + 2])
+        redis.call('HSET', KEYS[2], id, ARGV[i + 1])
+        redis.call('HSET', KEYS[4], id, ARGV[i + 3])
+        redis.call('ZADD', KEYS[3], ARGV[1], id)
+    end
+end
+while size > tonumber(ARGV[2]) do
+    local oldest = redis.call('ZPOPMIN', KEYS[3])
+    if #oldest == 0 then
+        break
+    end
+    size = size - redis.call('HSTRLEN', KEYS[1], oldest[1])
+    redis.call('HDEL', KEYS[1], oldest[1])
+    redis.call('HDEL', KEYS[2], oldest[1])
+    redis.call('HDEL', KEYS[4], oldest[1])
+end
+redis.call('SET', KEYS[5], math.max(size, 0))
+"""
+
+# Drops games and bumps their generations.
+# KEYS: bodies, ETags, served, settled, size, then the generation key of each game.
+# ARGV: generation TTL, then the game ids.
+_INVALIDATE_SCRIPT = """
+local size = tonumber(redis.call('GET', KEYS[5]) or '0')
+for i = 2, #ARGV do
+    size = size - redis.call('HSTRLEN', KEYS[1], ARGV[i])
+    redis.call('HDEL', KEYS[1], ARGV[i])
+    redis.call('HDEL', KEYS[2], ARGV[i])
+    redis.call('HDEL', KEYS[4], ARGV[i])
+    redis.call('ZREM', KEYS[3], ARGV[i])
+    redis.call('INCR', KEYS[4 + i])
+    redis.call('EXPIRE', KEYS[4 + i], ARGV[1])
+end
+redis.call('SET', KEYS[5], math.max(size, 0))
+"""
+
+_lookup_script = redis_conn.register_script(_LOOKUP_SCRIPT)
+_store_script = redis_conn.register_script(_STORE_SCRIPT)
+_invalidate_script = redis_conn.register_script(_INVALIDATE_SCRIPT)
+
+
+def generation_key(game_id):
+    """Redis key counting the invalidations of a game's cached JSON"""
+    return f"{game_id}:response_generation"
+
+
+def render(game):
+    """The JSON of a game, as `jsonify` would write it"""
+    return app.json.dumps(game.to_dict()).encode()
+
+
+def settles_at(game):
+    """
+    Unix time from which a finished game's JSON can't change any more, or None
+    while its archived state or analysis is still to come
+    """
+    if game.state is None or game.analysis is None:
+        return None
+    if game.updated_at is None:
+        return 0
+    return game.updated_at.replace(tzinfo=timezone.utc).timestamp() + SETTLE_SECONDS
+
+
+def settled(settling_time):
+    """Whether a game with this `settles_at` has settled"""
+    return settling_time is not None and settling_time <= time.time()
+
+
+def lookup(game_ids):
+    """
+    Returns an (ETag, JSON, settling time, generation) tuple for each game id, with
+    ETag, JSON and settling time None for a game that isn't stored. Pass the
+    generation to `store`.
+    """
+    if not game_ids:
+        return []
+    reply = _lookup_script(keys=[BODIES_KEY, ETAGS_KEY, SERVED_KEY, SETTLED_KEY]
+                           + [generation_key(game_id) for game_id in game_ids],
+                           args=[time.time(), *game_ids])
+    return [(reply[i].decode() or None, reply[i + 1] or None,
+             float(reply[i + 2]) if reply[i + 2] else None, reply[i + 3].decode())
+            for i in range(0, len(reply), 4)]
+
+
+def store(entries):
+    """
+    Stores the JSON of finished games, given as (game id, JSON, settling time,
+    generation) tuples, unless they were invalidated since their generation was
+    looked up. Returns the ETag of each.
+    """
+    etags = [hashlib.sha256(body).hexdigest()[:32] for _, body, _, _ in entries]
+    if entries:
+        _store_script(keys=[BODIES_KEY, ETAGS_KEY, SERVED_KEY, SETTLED_KEY, SIZE_KEY]
+                      + [generation_key(game_id) for game_id, _, _, _ in entries],
+                      args=[time.time(), app.config["RESPONSE_CACHE_BYTES"]]
+                      + [value for (game_id, body, settling_time, generation), etag in zip(entries, etags)
+                         for value in (game_id, etag, body, "" if settling_time is None else settling_time,
+                                       generation)])
+    return etags
+
+
+def invalidate(*game_ids):
+    """Drops the stored JSON of games whose rows changed"""
+    game_ids = list(dict.fromkeys(game_ids))
+    if game_ids:
+        _invalidate_script(keys=[BODIES_KEY, ETAGS_KEY, SERVED_KEY, SETTLED_KEY, SIZE_KEY]
+                           + [generation_key(game_id) for game_id in game_ids],
+                           args=[GENERATION_TTL, *game_ids])
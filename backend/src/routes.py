@@ -1,7 +1,9 @@
-from flask import request, jsonify, session
+import hmac
+
+from flask import Response, request, jsonify, session, stream_with_context
 
 from src.models import Game, Player
-from src import app, db, bcrypt
+from src import app, db, export, friends, identity, leaderboard, metrics, passwords, response_cache
 
 
 @app.before_request
@@ -9,6 +11,10 @@ def manage_db():
     db.create_all()
     db.session.close()
 
+def busy():
+    """Response telling the client to retry a login or registration shortly"""
+    return jsonify({"error": "Too many logins at once, try again shortly"}), 503, {"Retry-After": "1"}
+
 @app.route("/@me")
 def get_current_user():
     """
@@ -20,12 +26,11 @@ def get_current_user():
         - 200 OK: A JSON object with the user's `id` and `email`.
         - 401 Unauthorized: A JSON object with an `error` message if no user is logged in.
     """
-    user_id = session.get("user_id")
+    user = identity.current_player()
 
-    if not user_id:
+    if not user:
         return jsonify({"error": "Unauthorized"}), 401
     
-    user = Player.query.filter_by(id=user_id).first()
     return jsonify({
         "id": user.id,
         "username": user.username,
@@ -47,6 +52,7 @@ def register_user():
     Returns:
         - 201 Created: A JSON object with the newly created user's `id` and `email`.
         - 409 Conflict: A JSON object with an `error` message if a user with the given email already exists.
+        - 503 Service Unavailable: A JSON object with an `error` message if too many passwords are being hashed.
     """
     email = request.json["email"]
     password = request.json["password"]
@@ -57,10 +63,14 @@ def register_user():
     if user_exists:
         return jsonify({"error": "User already exists"}), 409
 
-    hashed_password = bcrypt.generate_password_hash(password)
+    try:
+        hashed_password = passwords.hash_password(password)
+    except passwords.PasswordsBusy:
+        return busy()
     new_user = Player(username=username,email=email, password=hashed_password)
     db.session.add(new_user)
     db.session.commit()
+    leaderboard.add_player(new_user)
   
     session["user_id"] = new_user.id
 
@@ -83,6 +93,7 @@ def login_user_():
     Returns:
         - 200 OK: A JSON object with the authenticated user's `id` and `email`.
         - 401 Unauthorized: A JSON object with an `error` message if the credentials are incorrect.
+        - 503 Service Unavailable: A JSON object with an `error` message if too many passwords are being checked.
     """
     email = request.json["email"]
     password = request.json["password"]
@@ -93,8 +104,11 @@ def login_user_():
     if user is None:
         return jsonify({"error": "Unauthorized"}), 401
 
-    if not bcrypt.check_password_hash(user.password, password):
-        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        if not passwords.check_password(user.password, password):
+            return jsonify({"error": "Unauthorized"}), 401
+    except passwords.PasswordsBusy:
+        return busy()
     
     session["user_id"] = user.id
 
@@ -113,21 +127,32 @@ def logout_user():
     Returns:
         - 200 OK: A JSON object with a success message.
     """
+    user_id = session.pop("user_id", None)
+    if user_id:
+        identity.forget(user_id)
     return jsonify({"message": "Logged out successfully"}), 200
 
 @app.route("/available_games")
 def get_available_games():
-    """Get all available games"""
-    current_user = Player.query.get(session["user_id"])
+    """
+    Get a page of the available games, newest first.
+
+    Query parameters:
+        - `page` (int): The page number, starting at 1.
+        - `per_page` (int): Games per page, at most 100.
+    """
+    current_user = identity.current_player()
     if current_user:
-        games = current_user.get_available_games()
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(max(request.args.get("per_page", 20, type=int), 1), 100)
+        games = current_user.get_available_games(page, per_page)
         return jsonify([game.to_dict() for game in games])
     return jsonify({"error": "Unauthorized"}), 401
 
 @app.route("/send_friend_request", methods=["POST"])
 def send_friend_request():
     """Sends friend request to specified player"""
-    current_user = Player.query.get(session["user_id"])
+    current_user = identity.current_player()
     if current_user:
         post_data = request.json
         friend_request = current_user.send_friend_request(post_data["username"])
@@ -139,7 +164,7 @@ def send_friend_request():
 @app.route("/friend_requests")
 def get_friend_requests():
     """Returns all friend requests received by player"""
-    current_user = Player.query.get(session["user_id"])
+    current_user = identity.current_player()
     if current_user:
         friend_requests = current_user.get_friend_requests()
         return jsonify([f_request.to_dict() for f_request in friend_requests])
@@ -148,7 +173,7 @@ def get_friend_requests():
 @app.route("/accept_friend_request", methods=["POST"])
 def accept_friend_request():
     """Accepts a friend request"""
-    current_user = Player.query.get(session["user_id"])
+    current_user = identity.current_player()
     if current_user:
         friendship = current_user.accept_friend_request(request.json.get("request_id"))
         if friendship:
@@ -159,54 +184,230 @@ def accept_friend_request():
 @app.route("/reject_friend_request", methods=["POST"])
 def reject_friend_request():
     """Rejects friend request"""
-    current_user = Player.query.get(session["user_id"])
+    current_user = identity.current_player()
     if current_user:
         confirm = current_user.reject_friend_request(request.json.get("request_id"))
         if confirm:
-            return jsonify(confirm.to_dict())
-        return jsonify({"error": "Could not accept friend request"}), 400
+            return jsonify({"message": "Friend request rejected"})
+        return jsonify({"error": "Could not reject friend request"}), 400
     return jsonify({"error": "Unauthorized"}), 401
 
 @app.route("/friends")
 def get_friends():
-    """Returns all friends of requesting user"""
-    current_user = Player.query.get(session["user_id"])
+    """
+    Returns all friends of requesting user, read from Redis (see `src.friends`)
+
+    Returns:
+        - 200 OK: A JSON list of the friends' `id`, `username`, `score` and whether they are `online`.
+    """
+    current_user = identity.current_player()
     if current_user:
-        friends = current_user.get_all_friends()
-        return jsonify([friend.to_dict() for friend in friends])
+        return jsonify(friends.with_presence(current_user.id))
     return jsonify({"error": "Unauthorized"}), 401
 
 @app.route("/history")
 def get_previous_games():
-    """Retrieves all previous games of user"""
-    current_user = Player.query.get(session["user_id"])
+    """
+    Retrieves a page of the previous games of user, newest first
+
+    Query parameters:
+        - `cursor` (str): The `next_cursor` of the previous page, omitted for the first page.
+        - `limit` (int): Games per page, at most 100. Defaults to 20.
+
+    Returns:
+        - 200 OK: A JSON object with the `games` and the `next_cursor`, null on the last page.
+        - 400 Bad Request: A JSON object with an `error` message if the cursor is invalid.
+    """
+    current_user = identity.current_player()
     if current_user:
-        games = current_user.get_previous_games()
-        return jsonify([game.to_dict() for game in games])
+        limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+        try:
+            games, next_cursor = current_user.get_previous_games(request.args.get("cursor"), limit,
+                                                                 details=False)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        cached = response_cache.lookup([game.id for game in games])
+        bodies = [body for _, body, _, _ in cached]
+        missing = [game.id for game, body in zip(games, bodies) if body is None]
+        if missing:
+            # The page's rows are already loaded; this loads what to_dict needs for the rest
+            loaded = {game.id: game for game in Game.query.with_details()
+                      .filter(Game.id.in_(missing)).populate_existing()}
+            entries = []
+            for index, game in enumerate(games):
+                if bodies[index] is None:
+                    bodies[index] = response_cache.render(loaded[game.id])
+                    entries.append((game.id, bodies[index], response_cache.settles_at(loaded[game.id]),
+                                    cached[index][3]))
+            response_cache.store(entries)
+        body = (b'{"games": [' + b", ".join(bodies) + b'], "next_cursor": '
+                + app.json.dumps(next_cursor).encode() + b"}")
+        return Response(body, mimetype="application/json")
     return jsonify({"error": "Unauthorized"}), 401
 
+def finished_game_response(body, etag, settling_time):
+    """
+    Response with the JSON of a finished game, or 304 Not Modified if the request's
+    If-None-Match has the same ETag. Clients may keep a settled game for good, and
+    revalidate one that may still change.
+    """
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if response_cache.settled(settling_time):
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route("/game_details/<game_id>")
 def get_game_details(game_id):
-    """Returns the details of a game"""
-    current_user = Player.query.get(session["user_id"])
+    """
+    Returns the details of a game
+
+    Finished games are served from `src.response_cache` with a strong ETag, without
+    touching the database; a request whose If-None-Match matches gets 304 Not Modified.
+    They are only marked immutable once settled, as their analysis comes later.
+    """
+    current_user = identity.current_player()
     if current_user:
-        game = Game.query.get(game_id)
-        if game:
+        ((etag, body, settling_time, generation),) = response_cache.lookup([game_id])
+        if body is not None:
+            return finished_game_response(body, etag, settling_time)
+        game = Game.query.with_details().filter_by(id=game_id).first()
+        if game is None:
+            return jsonify({"error": "Could not find game"}), 400
+        if not game.finished:
             return jsonify(game.to_dict())
-        return jsonify({"error": "Could not find game"}), 400
+        body, settling_time = response_cache.render(game), response_cache.settles_at(game)
+        (etag,) = response_cache.store([(game.id, body, settling_time, generation)])
+        return finished_game_response(body, etag, settling_time)
     return jsonify({"error": "Unauthorized"}), 401
     
+@app.route("/game_messages/<game_id>")
+def get_game_messages(game_id):
+    """
+    Retrieves a page of the chat messages of a game, newest first
+
+    Query parameters:
+        - `cursor` (str): The `next_cursor` of the previous page, omitted for the first page.
+        - `limit` (int): Messages per page, at most 200. Defaults to 50.
+
+    Messages reach this history within CHAT_FLUSH_INTERVAL seconds of being sent;
+    players in the game get the latest ones as `chat_history` when they join.
+
+    Returns:
+        - 200 OK: A JSON object with the `messages` and the `next_cursor`, null on the last page.
+        - 400 Bad Request: A JSON object with an `error` message if the game is unknown or the cursor is invalid.
+    """
+    current_user = identity.current_player()
+    if current_user:
+        game = Game.query.filter_by(id=game_id).first()
+        if game is None:
+            return jsonify({"error": "Could not find game"}), 400
+        limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+        try:
+            messages, next_cursor = game.get_messages(request.args.get("cursor"), limit)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        return jsonify({
+            "messages": [message.to_dict() for message in messages],
+            "next_cursor": next_cursor
+        })
+    return jsonify({"error": "Unauthorized"}), 401
+
 @app.route('/leaderboard', methods=['GET'])
 def get_leaderboard():
     """
     Get the leaderboard with the top players based on their scores.
 
+    Query parameters:
+        - `page` (int): The page number, starting at 1.
+        - `per_page` (int): Players per page, at most 100. Defaults to 10.
+
+    Response:
+    - 200 OK: List of players with their rank, username and score.
+    """
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", 10, type=int), 1), 100)
+    return jsonify(leaderboard.top(page, per_page)), 200
+
+@app.route('/leaderboard/rank', methods=['GET'])
+def get_leaderboard_rank():
+    """
+    Get the rank of the current user.
+
+    Response:
+    - 200 OK: A JSON object with the user's `rank`, None if they are not ranked.
+    - 401 Unauthorized: A JSON object with an `error` message if no user is logged in.
+    """
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"rank": leaderboard.rank(user_id)}), 200
+
+@app.route('/leaderboard/around', methods=['GET'])
+def get_leaderboard_around():
+    """
+    Get the players ranked around the current user, or around `player_id` if given.
+
+    Query parameters:
+        - `player_id` (str): The player in the middle of the window.
+        - `radius` (int): Players to show above and below, at most 50. Defaults to 5.
+
     Response:
-    - 200 OK: List of players with their usernames and scores.
-    """
-    top_players = Player.query.order_by(Player.score.desc()).limit(10).all() # Limit to top 10 players
-    leaderboard = [{
-        'username': player.username,
-        'score': player.score
-    } for player in top_players]
-    return jsonify(leaderboard), 200
\ No newline at end of file
+    - 200 OK: List of players with their rank, username and score.
+    - 401 Unauthorized: A JSON object with an `error` message if no user is logged in.
+    """
+    player_id = request.args.get("player_id") or session.get("user_id")
+    if not player_id:
+        return jsonify({"error": "Unauthorized"}), 401
+    radius = min(max(request.args.get("radius", 5, type=int), 0), 50)
+    return jsonify(leaderboard.around(player_id, radius)), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Latency histograms and SQL, Redis and error counters of this worker's
+    HTTP routes and Socket.IO events, in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/export/<table>")
+def get_export(table):
+    """
+    Streams a table as gzip-compressed NDJSON, for analytics
+
+    Path parameters:
+        - `table` (str): games, game_players, moves or messages.
+
+    Query parameters:
+        - `since` (str): ISO 8601 time; only rows written since then. The whole table by default.
+        - `until` (str): ISO 8601 time; only rows written before then. A minute ago by default.
+
+    Needs the EXPORT_TOKEN as a bearer token.
+
+    Returns:
+        - 200 OK: The rows, one JSON object per line. The X-Export-Until header has the
+          `until` covered, to pass as `since` to the next export.
+        - 400 Bad Request: A JSON object with an `error` message if the table or a time is invalid.
+        - 401 Unauthorized: A JSON object with an `error` message without the token.
+    """
+    token = app.config["EXPORT_TOKEN"]
+    given = request.headers.get("Authorization", "").encode()
+    if not token or not hmac.compare_digest(given, f"Bearer {token}".encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+    if table not in export.TABLES:
+        return jsonify({"error": "Unknown table"}), 400
+    since, until = request.args.get("since"), request.args.get("until")
+    try:
+        since = export.parse_time(since) if since else None
+        until = export.parse_time(until) if until else export.default_until()
+    except ValueError:
+        return jsonify({"error": "Invalid time"}), 400
+    chunks = export.gzipped(export.rows(table, since, until))
+    return Response(stream_with_context(chunks), mimetype="application/gzip", headers={
+        "Content-Disposition": f"attachment; filename={table}.ndjson.gz",
+        "X-Export-Until": until.isoformat(),
+    })
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+"""
+Depth and time limited game tree search for the AI.
+
+The search is a negamax with alpha-beta pruning and iterative deepening,
+backed by a Zobrist-hashed transposition table with LRU eviction. Each game
+difficulty maps to a depth limit and a per-move time budget, so easy levels
+stay cheap and every level has a bounded latency.
+
+It plays every board variant (see `src.state.Variant`). A move only tests
+the winning lines through its tile. On boards larger than 3x3 the search
+only considers the empty tiles next to a marker, as the others are almost
+never worth playing and there are too many of them to look at.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from src.state import CLASSIC, MAX_SIZE, X
+
+# difficulty -> (maximum depth in plies, time budget in seconds)
+DIFFICULTY_LEVELS = {
+    1: (1, 0.005),
+    2: (2, 0.010),
+    3: (4, 0.020),
+}
+# Difficulties at or above this level play perfectly from the solved table
+PERFECT_PLAY = 4
+
+TABLE_SIZE = 100000
+WIN_SCORE = 100
+
+# Exact score, lower bound (failed high) and upper bound (failed low)
+EXACT, LOWER, UPPER = 0, 1, 2
+
+_random = random.Random(0x7AC70E)
+ZOBRIST = tuple(tuple(_random.getrandbits(64) for _ in range(MAX_SIZE * MAX_SIZE)) for _ in range(2))
+ZOBRIST_SIDE = _random.getrandbits(64)
+# Keeps positions of different variants apart in the shared table; the classic board has none
+ZOBRIST_VARIANT = {(size, length): _random.getrandbits(64)
+                   for size in range(4, MAX_SIZE + 1) for length in range(3, size + 1)}
+
+
+def zobrist_hash(state):
+    """Full Zobrist hash of a state; the search updates it incrementally"""
+    game_variant = state.variant
+    key = ZOBRIST_VARIANT.get((game_variant.size, game_variant.win_length), 0)
+    if state.turn != X:
+        key ^= ZOBRIST_SIDE
+    for tile in range(game_variant.tiles):
+        if state.x_mask >> tile & 1:
+            key ^= ZOBRIST[0][tile]
+        elif state.o_mask >> tile & 1:
+            key ^= ZOBRIST[1][tile]
+    return key
+
+
+def evaluate(mine, theirs, game_variant=CLASSIC):
+    """
+    Heuristic score of an unfinished position for the side to move.
+    Lines still open to only one side count for that side, weighted by
+    how many markers it already has on them.
+    """
+    score = 0
+    for line in game_variant.win_masks:
+        if not line & theirs:
+            score += bin(line & mine).count("1") ** 2
+        elif not line & mine:
+            score -= bin(line & theirs).count("1") ** 2
+    return score
+
+
+class TranspositionTable():
+    """Bounded map of Zobrist keys to search results, evicting the least recently used"""
+
+    def __init__(self, size=TABLE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns (depth, score, bound, move) for the key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """Stores an entry, evicting the least recently used one when full"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget runs out"""
+
+
+class SearchEngine():
+    """Iterative deepening alpha-beta search sharing a transposition table"""
+
+    def __init__(self, table):
+        self.table = table
+        self.nodes = 0
+        self.depth = 0
+        self.variant = CLASSIC
+        self._deadline = None
+        self._check_mask = 255
+
+    def search(self, state, max_depth, time_budget):
+        """
+        Search the state to at most max_depth plies within time_budget seconds.
+        Returns the best move of the deepest completed iteration, or None if the
+        game is already over.
+        """
+        if state.finished or state.moves == state.variant.tiles:
+            return None
+        self.nodes = 0
+        self.depth = 0
+        self.variant = state.variant
+        self._deadline = time.perf_counter() + time_budget
+        # A leaf of a large board evaluates hundreds of lines, so the clock is read at every node there
+        self._check_mask = 255 if state.variant is CLASSIC else 0
+
+        if state.turn == X:
+            mine, theirs = state.x_mask, state.o_mask
+        else:
+            mine, theirs = state.o_mask, state.x_mask
+        key = zobrist_hash(state)
+
+        best_move = self._ordered_moves(mine | theirs, None)[0]
+        for depth in range(1, min(max_depth, state.variant.tiles - state.moves) + 1):
+            try:
+                score, best_move = self._root(mine, theirs, state.turn, key, depth, best_move)
+            except SearchTimeout:
+                break
+            self.depth = depth
+            if abs(score) >= WIN_SCORE:
+                break  # The result is forced, deeper searches won't change it
+        return best_move
+
+    def score(self, state, depth):
+        """
+        Returns (score, best move) of an unfinished state for the side to move,
+        searched to depth plies with no time limit. At depth 0 it is the static
+        evaluation, with no move.
+        """
+        self.variant = state.variant
+        self._deadline = float("inf")
+        if state.turn == X:
+            mine, theirs = state.x_mask, state.o_mask
+        else:
+            mine, theirs = state.o_mask, state.x_mask
+        if depth == 0:
+            return evaluate(mine, theirs, state.variant), None
+        return self._root(mine, theirs, state.turn, zobrist_hash(state), depth, None)
+
+    def _root(self, mine, theirs, turn, key, depth, first_move):
+        """Search every move at the root, trying the previous best move first"""
+        alpha, beta = -float("inf"), float("inf")
+        best_move = None
+        for tile in self._ordered_moves(mine | theirs, first_move):
+            score = -self._negamax(theirs, mine | 1 << tile, tile, turn ^ 1,
+                                   key ^ ZOBRIST[turn][tile] ^ ZOBRIST_SIDE,
+                                   depth - 1, -beta, -alpha)
+            if score > alpha:
+                alpha, best_move = score, tile
+        return alpha, best_move
+
+    def _negamax(self, mine, theirs, last_move, turn, key, depth, alpha, beta):
+        """Score of the position for the side to move, whose mask is `mine`"""
+        self.nodes += 1
+        if not self.nodes & self._check_mask and time.perf_counter() > self._deadline:
+            raise SearchTimeout()
+
+        occupied = mine | theirs
+        empty = bin(self.variant.full_board & ~occupied).count("1")
+        if self.variant.wins(theirs, last_move):
+            return -(WIN_SCORE + empty)  # The previous move won; faster wins score higher
+        if not empty:
+            return 0
+        if depth == 0:
+            return evaluate(mine, theirs, self.variant)
+
+        alpha_orig = alpha
+        tt_move = None
+        entry = self.table.get(key)
+        if entry is not None:
+            entry_depth, entry_score, bound, tt_move = entry
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return entry_score
+                if bound == LOWER:
+                    alpha = max(alpha, entry_score)
+                else:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+
+        best_score, best_move = -float("inf"), None
+        for tile in self._ordered_moves(occupied, tt_move):
+            score = -self._negamax(theirs, mine | 1 << tile, tile, turn ^ 1,
+                                   key ^ ZOBRIST[turn][tile] ^ ZOBRIST_SIDE,
+                                   depth - 1, -beta, -alpha)
+            if score > best_score:
+                best_score, best_move = score, tile
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= alpha_orig:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.put(key, (depth, best_score, bound, best_move))
+        return best_score
+
+    def _ordered_moves(self, occupied, first_move):
+        """
+        Free tiles, with first_move (e.g. from the table) searched first. Past 3x3
+        only the tiles next to a marker, or the centre of an empty board.
+        """
+        game_variant = self.variant
+        if game_variant is CLASSIC:
+            candidates = game_variant.full_board & ~occupied
+        elif not occupied:
+            candidates = 1 << game_variant.tiles // 2
+        else:
+            candidates, remaining = 0, occupied
+            while remaining:
+                tile = (remaining & -remaining).bit_length() - 1
+                candidates |= game_variant.neighbours[tile]
+                remaining &= remaining - 1
+            candidates &= ~occupied
+        moves = [tile for tile in range(game_variant.tiles) if candidates >> tile & 1]
+        if first_move in moves:
+            moves.remove(first_move)
+            moves.insert(0, first_move)
+        return moves
+
+
+transposition_table = TranspositionTable()
+
+
+def search_limits(difficulty):
+    """Returns (maximum depth, time budget) for a difficulty below PERFECT_PLAY"""
+    return DIFFICULTY_LEVELS[min(max(difficulty, 1), PERFECT_PLAY - 1)]
+
+
+def search_best_move(state, difficulty):
+    """
+    Search for the AI's move within the limits of the given difficulty.
+    Returns a (move, engine) tuple, the engine carrying the search statistics.
+    """
+    engine = SearchEngine(transposition_table)
+    max_depth, time_budget = search_limits(difficulty)
+    return engine.search(state, max_depth, time_budget), engine
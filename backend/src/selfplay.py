@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+"""
+Batch self-play for tuning the AI's difficulty levels, offline.
+
+Thousands of games are played at once, each board a row of NumPy arrays.
+A matrix of the variant's winning lines turns win checks, and the search's
+evaluation, into array operations over the whole batch. All the boards of a
+batch are at the same ply, so every step picks the moves of all of them.
+
+The players mirror the live AI of `find_best_move`: a difficulty searches
+to the depth of `search.DIFFICULTY_LEVELS` with the same evaluation and
+candidate moves, and from `search.PERFECT_PLAY` up a 3x3 game reads the
+solved table of `src.solver`. "random" plays any free tile. Unlike the live
+search there is no time budget, and ties between equally good moves are
+broken at random, so games from the same opening differ.
+
+Batches run in a process pool. Run it with `flask --app src selfplay`.
+NumPy is only needed here, not by the server.
+"""
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from src import search, solver
+from src.state import CLASSIC, DRAW, NO_RESULT, O_WINS, X_WINS, GameState, O, X, variant
+
+RANDOM = "random"
+# Games simulated at once by one task, over all openings
+BATCH_SIZE = 4096
+# Positions searched at once at the deepest ply, which bounds the memory a search takes
+SEARCH_POSITIONS = 1 << 20
+# Score of a move that can't be played
+_ILLEGAL = -1 << 30
+
+
+@lru_cache(maxsize=None)
+def line_matrix(size, win_length):
+    """Lines x tiles matrix of the variant, with a 1 where a line passes through a tile"""
+    game_variant = variant(size, win_length)
+    matrix = np.zeros((len(game_variant.lines), game_variant.tiles), dtype=np.int8)
+    for number, line in enumerate(game_variant.lines):
+        matrix[number, list(line)] = 1
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def _neighbour_matrix(size, win_length):
+    """Tiles x tiles matrix with a 1 where two tiles touch"""
+    game_variant = variant(size, win_length)
+    matrix = np.zeros((game_variant.tiles, game_variant.tiles), dtype=np.int8)
+    for tile, neighbours in enumerate(game_variant.neighbours):
+        matrix[tile] = [neighbours >> other & 1 for other in range(game_variant.tiles)]
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def _solved_moves():
+    """Best move of every 3x3 position from the solved table, indexed by `_position_keys`"""
+    moves = np.zeros(3 ** 9, dtype=np.int64)
+    for cells in itertools.product((0, 1, 2), repeat=9):
+        x_mask = sum(1 << tile for tile, cell in enumerate(cells) if cell == 1)
+        o_mask = sum(1 << tile for tile, cell in enumerate(cells) if cell == 2)
+        move, _ = solver.lookup(GameState(x_mask, o_mask))
+        if move is not None:
+            moves[sum(cell * 3 ** tile for tile, cell in enumerate(cells))] = move
+    return moves
+
+
+def _position_keys(markers):
+    """Base-3 key of each 3x3 board, tile i holding 1 for X and 2 for O as digit i"""
+    powers = 3 ** np.arange(9)
+    return markers[X] @ powers + 2 * (markers[O] @ powers)
+
+
+def evaluate(mine, theirs):
+    """
+    `search.evaluate` of a batch of positions, from the line counts of the
+    side to move (mine) and of the other side (theirs).
+    """
+    mine, theirs = mine.astype(np.int32), theirs.astype(np.int32)
+    return (np.where(theirs == 0, mine * mine, 0).sum(axis=1)
+            - np.where(mine == 0, theirs * theirs, 0).sum(axis=1))
+
+
+def _candidates(game_variant, occupied):
+    """Tiles the search would try on each board, as `SearchEngine._ordered_moves`"""
+    if game_variant is CLASSIC:
+        return ~occupied
+    touching = occupied.astype(np.int16) @ _neighbour_matrix(game_variant.size, game_variant.win_length) > 0
+    candidates = touching & ~occupied
+    empty_boards = ~occupied.any(axis=1)
+    candidates[empty_boards, game_variant.tiles // 2] = True
+    return candidates
+
+
+def _last_ply_scores(game_variant, lines, mine, theirs, occupied):
+    """
+    `_child_scores` at depth 1, without building the positions after each move.
+    A move only changes the lines through its tile, so the evaluation after it
+    is the current one plus the change on each line, summed with the line matrix.
+    """
+    # Floats for the products, which BLAS does far faster than integers; the sums are small and exact
+    lines = lines.astype(np.float32)
+    empty = game_variant.tiles - occupied.sum(axis=1, keepdims=True) - 1
+    # One more marker on a line adds 2m + 1 to m squared, or takes away the other side's claim
+    change = np.where(theirs == 0, 2 * mine.astype(np.float32) + 1,
+                      np.where(mine == 0, theirs.astype(np.float32) ** 2, 0))
+    scores = evaluate(mine, theirs)[:, None] + change @ lines
+    scores = np.where(empty == 0, 0, scores)
+    wins = ((mine == game_variant.win_length - 1) & (theirs == 0)).astype(np.float32) @ lines > 0
+    scores = np.where(wins, search.WIN_SCORE + empty, scores)
+    return np.where(_candidates(game_variant, occupied), scores, _ILLEGAL).astype(np.int32)
+
+
+def _child_scores(game_variant, mine, theirs, occupied, depth):
+    """
+    Boards x tiles scores of each move for the side to move, as its search
+    sees them at the given depth, or _ILLEGAL where it wouldn't play. The
+    positions after every move of every board are searched as one batch.
+    """
+    lines = line_matrix(game_variant.size, game_variant.win_length)
+    if depth == 1:
+        return _last_ply_scores(game_variant, lines, mine, theirs, occupied)
+    boards, tiles = np.nonzero(_candidates(game_variant, occupied))
+    child_occupied = occupied[boards]
+    child_occupied[np.arange(len(boards)), tiles] = True
+    scores = np.full(occupied.shape, _ILLEGAL, dtype=np.int32)
+    scores[boards, tiles] = -negamax(game_variant, theirs[boards], mine[boards] + lines.T[tiles],
+                                     child_occupied, depth - 1)
+    return scores
+
+
+def negamax(game_variant, mine, theirs, occupied, depth):
+    """
+    Scores of a batch of positions for the side to move, as `SearchEngine._negamax`
+    finds them without pruning. theirs holds the line counts of the side that
+    just moved, mine those of the side to move, occupied the tiles in use.
+    """
+    empty = game_variant.tiles - occupied.sum(axis=1)
+    won = (theirs == game_variant.win_length).any(axis=1)
+    scores = np.zeros(len(mine), dtype=np.int32)
+    if depth == 0:
+        scores = evaluate(mine, theirs)
+    else:
+        going = np.flatnonzero(~won & (empty > 0))
+        if going.size:
+            scores[going] = _child_scores(game_variant, mine[going], theirs[going],
+                                          occupied[going], depth).max(axis=1)
+    scores[empty == 0] = 0
+    return np.where(won, -(search.WIN_SCORE + empty), scores)
+
+
+def choose_moves(player, game_variant, markers, counts, turn, rng):
+    """
+    The tiles the player picks on a batch of unfinished boards.
+    Args:
+        player (str): RANDOM or a game difficulty, as a string.
+        game_variant (Variant): The variant of every board.
+        markers (tuple): Boards x tiles boolean arrays of X's and O's markers.
+        counts (tuple): Boards x lines arrays of X's and O's markers on each line.
+        turn (int): The side to move, X or O.
+        rng (numpy.random.Generator): Source of the random choices.
+    Returns:
+        numpy.ndarray: A tile per board.
+    """
+    occupied = markers[X] | markers[O]
+    if player == RANDOM:
+        return np.argmax(np.where(occupied, -1, rng.random(occupied.shape)), axis=1)
+    difficulty = int(player)
+    if difficulty >= search.PERFECT_PLAY and game_variant is CLASSIC:
+        return _solved_moves()[_position_keys(markers)]
+    depth, _ = search.search_limits(difficulty)
+    # Search few enough boards at once that their positions at full depth fit in SEARCH_POSITIONS
+    branching = _candidates(game_variant, occupied).sum(axis=1).max()
+    positions = np.prod(np.maximum(branching - np.arange(depth), 1), dtype=np.float64)
+    chunk = max(1, int(SEARCH_POSITIONS // positions))
+    scores = np.concatenate([
+        _child_scores(game_variant, counts[turn][start:start + chunk],
+                      counts[turn ^ 1][start:start + chunk], occupied[start:start + chunk], depth)
+        for start in range(0, len(occupied), chunk)])
+    # Scores are whole numbers, so noise below 1 only breaks ties
+    return np.argmax(scores + rng.random(scores.shape), axis=1)
+
+
+def play_games(size, win_length, x_player, o_player, openings, games, seed):
+    """
+    Play games between two players, X opening with each of the given tiles
+    in turn. Returns an openings x 3 array of X's wins, draws and O's wins.
+    """
+    game_variant = variant(size, win_length)
+    lines = line_matrix(size, win_length)
+    rng = np.random.default_rng(seed)
+    boards = len(openings) * games
+    markers = tuple(np.zeros((boards, game_variant.tiles), dtype=bool) for _ in (X, O))
+    counts = tuple(np.zeros((boards, len(lines)), dtype=np.int8) for _ in (X, O))
+    results = np.full(boards, NO_RESULT, dtype=np.int8)
+    players = (x_player, o_player)
+
+    for ply in range(game_variant.tiles):
+        going = np.flatnonzero(results == NO_RESULT)
+        if not going.size:
+            break
+        turn = ply % 2
+        if ply == 0:
+            tiles = np.repeat(np.asarray(openings), games)
+        else:
+            tiles = choose_moves(players[turn], game_variant, tuple(side[going] for side in markers),
+                                 tuple(side[going] for side in counts), turn, rng)
+        markers[turn][going, tiles] = True
+        counts[turn][going] += lines[:, tiles].T
+        won = (counts[turn][going] == win_length).any(axis=1)
+        results[going[won]] = X_WINS if turn == X else O_WINS
+    results[results == NO_RESULT] = DRAW
+
+    results = results.reshape(len(openings), games)
+    return np.stack([(results == result).sum(axis=1) for result in (X_WINS, DRAW, O_WINS)], axis=1)
+
+
+def simulate(size, win_length, players, games, openings=None, workers=0, seed=0):
+    """
+    Play every ordered pair of players against each other, `games` times from
+    each opening (by default every tile). Batches run in a pool of `workers`
+    processes, or inline without workers.
+    Returns a dict of (X player, O player) to an openings x 3 array of X's
+    wins, draws and O's wins.
+    """
+    openings = list(range(variant(size, win_length).tiles)) if openings is None else list(openings)
+    per_batch = max(1, BATCH_SIZE // len(openings))
+    tasks = [(size, win_length, x_player, o_player, openings, min(per_batch, games - start))
+             for x_player, o_player in itertools.product(players, repeat=2)
+             for start in range(0, games, per_batch)]
+    seeds = np.random.SeedSequence(seed).generate_state(len(tasks))
+
+    if workers:
+        # A fork server, as the caller may have threads (Redis, Flask) forking would copy
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+            outcomes = list(pool.map(play_games, *zip(*tasks), seeds))
+    else:
+        outcomes = [play_games(*task, task_seed) for task, task_seed in zip(tasks, seeds)]
+
+    totals = {}
+    for task, outcome in zip(tasks, outcomes):
+        matchup = task[2:4]
+        totals[matchup] = totals.get(matchup, 0) + outcome
+    return totals
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+"""
+Solved-game table for 3x3 Tic-Tac-Toe.
+
+Every reachable position is enumerated once when the module is imported.
+Positions that are rotations or reflections of each other are folded into a
+single canonical entry, so the whole game fits in a few hundred table slots.
+Each slot stores the best move and the outcome with perfect play, which turns
+the AI's move choice into a constant-time lookup.
+"""
+from src.state import LINES
+
+# The 8 symmetries of the square. Each one is a permutation where
+# transformed[i] = board[symmetry[i]].
+SYMMETRIES = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8),  # identity
+    (6, 3, 0, 7, 4, 1, 8, 5, 2),  # rotate 90
+    (8, 7, 6, 5, 4, 3, 2, 1, 0),  # rotate 180
+    (2, 5, 8, 1, 4, 7, 0, 3, 6),  # rotate 270
+    (2, 1, 0, 5, 4, 3, 8, 7, 6),  # mirror vertical axis
+    (6, 7, 8, 3, 4, 5, 0, 1, 2),  # mirror horizontal axis
+    (0, 3, 6, 1, 4, 7, 2, 5, 8),  # mirror main diagonal
+    (8, 5, 2, 7, 4, 1, 6, 3, 0),  # mirror anti diagonal
+)
+
+WIN, DRAW, LOSS = 1, 0, -1
+
+# canonical key -> packed entry (best move in the low nibble, outcome + 1 above it)
+_table = {}
+
+
+def encode(cells):
+    """Encode a board of 0/1/2 cell values as a base-3 integer"""
+    key = 0
+    for cell in cells:
+        key = key * 3 + cell
+    return key
+
+
+def canonicalize(cells):
+    """
+    Return the canonical key of a board and the symmetry that produces it.
+    The canonical key is the smallest encoding among the 8 symmetric boards.
+    """
+    best_key, best_symmetry = None, None
+    for symmetry in SYMMETRIES:
+        key = encode([cells[i] for i in symmetry])
+        if best_key is None or key < best_key:
+            best_key, best_symmetry = key, symmetry
+    return best_key, best_symmetry
+
+
+def _winner(cells):
+    """Return 1 or 2 for the winning side, or 0 if nobody has three in a row"""
+    for a, b, c in LINES:
+        if cells[a] and cells[a] == cells[b] == cells[c]:
+            return cells[a]
+    return 0
+
+
+def _solve(cells, to_move, scores):
+    """
+    Negamax over canonical positions, filling the table as it goes.
+    Returns the score of the position for the side to move: positive for a
+    win, negative for a loss, with faster wins and slower losses preferred.
+    """
+    key, symmetry = canonicalize(cells)
+    if key in scores:
+        return scores[key]
+
+    best_score, best_move = None, None
+    for tile in range(9):
+        if cells[tile]:
+            continue
+        cells[tile] = to_move
+        if _winner(cells):
+            score = cells.count(0) + 1
+        elif 0 not in cells:
+            score = 0
+        else:
+            score = -_solve(cells, 3 - to_move, scores)
+        cells[tile] = 0
+        if best_score is None or score > best_score:
+            best_score, best_move = score, tile
+
+    # Store the move in canonical coordinates so any symmetric board can use it
+    canonical_move = symmetry.index(best_move)
+    outcome = (best_score > 0) - (best_score < 0)
+    _table[key] = canonical_move | (outcome + 1) << 4
+    scores[key] = best_score
+    return best_score
+
+
+def build_table():
+    """Enumerate every reachable position and (re)build the solved table"""
+    _table.clear()
+    _solve([0] * 9, 1, {})
+    return len(_table)
+
+
+def lookup(state):
+    """
+    Look up a position in the solved table.
+    Args:
+        state (GameState): The position, with the side to move implied by the masks.
+    Returns:
+        tuple: (best move, outcome for the side to move), or (None, None) if
+        the game is already over.
+    """
+    x_mask, o_mask = state.x_mask, state.o_mask
+    cells = [1 if x_mask >> tile & 1 else 2 if o_mask >> tile & 1 else 0 for tile in range(9)]
+    key, symmetry = canonicalize(cells)
+    entry = _table.get(key)
+    if entry is None:
+        return None, None
+    return symmetry[entry & 0x0F], (entry >> 4) - 1
+
+
+build_table()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+"""
+Spectators of a game, kept in a room of their own next to the players' room.
+
+Spectators join read-only: they get a snapshot of the state when they start
+watching, then the game's deltas (see `GameState.delta`). Those are not sent
+per move but gathered per game and broadcast every SPECTATOR_TICK seconds as
+one 'game_deltas' list, so a popular game costs one broadcast per tick
+however many moves it sees. A broadcast to a room is encoded once and the
+same packet is written to every socket in it, so the cost per spectator is
+only the write.
+
+With several workers, each one gathers the deltas of the moves it handled
+and the message queue carries its broadcasts to the other workers. Clients
+apply deltas in version order and skip those at or below their snapshot's.
+"""
+import threading
+
+from flask_socketio import join_room, leave_room
+
+from src import app, socketio
+
+_lock = threading.Lock()
+# game code -> deltas waiting for the next tick
+_pending = {}
+
+
+def room(game_code):
+    """Name of the Socket.IO room of a game's spectators"""
+    return f"{game_code}:spectators"
+
+
+def watch(game_code):
+    """Adds the client of the current event to a game's spectators"""
+    join_room(room(game_code))
+
+
+def unwatch(game_code):
+    """Removes the client of the current event from a game's spectators"""
+    leave_room(room(game_code))
+
+
+def publish(game_code, delta):
+    """Queues a delta for a game's spectators, or sends it straight away without a tick"""
+    if not app.config["SPECTATOR_TICK"]:
+        socketio.emit("game_deltas", [delta], to=room(game_code))
+        return
+    with _lock:
+        _pending.setdefault(game_code, []).append(delta)
+
+
+def broadcast():
+    """Sends every game's queued deltas to its spectators. Returns the number of games"""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    for game_code, deltas in pending.items():
+        socketio.emit("game_deltas", deltas, to=room(game_code))
+    return len(pending)
+
+
+def broadcaster():
+    """Background task that broadcasts the queued deltas every SPECTATOR_TICK seconds"""
+    while True:
+        socketio.sleep(app.config["SPECTATOR_TICK"] or 1)
+        try:
+            broadcast()
+        except Exception:
+            app.logger.exception("Broadcasting to spectators failed")
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+"""
+Compact representation of a live game.
+
+A board is held as two masks, one per marker, where bit i is set when tile
+i holds that marker. Boards are size x size tiles and a game is won by
+win_length markers in a row, the classic game being 3x3 with 3 in a row.
+The winning lines of each variant are precomputed as masks, grouped by the
+tiles they pass through, so a move only tests the lines through its tile.
+A move counter tells a full board, and so a draw, without scanning it.
+The whole state packs into a few bytes for Redis.
+"""
+import struct
+from functools import lru_cache
+
+X, O = 0, 1
+MARKERS = ("X", "O")
+MAX_DIFFICULTY = 15
+
+# Result codes
+NO_RESULT, X_WINS, O_WINS, DRAW = 0, 1, 2, 3
+RESULTS = (None, "X", "O", "Draw")
+
+# Board sizes and win lengths a game may use
+MIN_SIZE, MAX_SIZE = 3, 15
+# Directions a line runs in, as (row, column) steps: across, down and both diagonals
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+class Variant():
+    """A board size and win length, with the winning lines of that board precomputed"""
+    __slots__ = ("size", "win_length", "tiles", "full_board", "lines", "win_masks",
+                 "masks_through", "neighbours")
+
+    def __init__(self, size, win_length):
+        self.size = size
+        self.win_length = win_length
+        self.tiles = size * size
+        self.full_board = (1 << self.tiles) - 1
+        lines = []
+        for row in range(size):
+            for column in range(size):
+                for row_step, column_step in DIRECTIONS:
+                    end_row = row + row_step * (win_length - 1)
+                    end_column = column + column_step * (win_length - 1)
+                    if 0 <= end_row < size and 0 <= end_column < size:
+                        lines.append(tuple((row + row_step * i) * size + column + column_step * i
+                                           for i in range(win_length)))
+        self.lines = tuple(lines)
+        self.win_masks = tuple(sum(1 << tile for tile in line) for line in lines)
+        # The winning lines through each tile, for checks that only look at the last move
+        self.masks_through = tuple(
+            tuple(mask for mask in self.win_masks if mask >> tile & 1) for tile in range(self.tiles))
+        # The tiles around each tile, where moves worth searching on large boards are
+        self.neighbours = tuple(
+            sum(1 << (tile // size + row_step) * size + tile % size + column_step
+                for row_step in (-1, 0, 1) for column_step in (-1, 0, 1)
+                if (row_step or column_step) and 0 <= tile // size + row_step < size
+                and 0 <= tile % size + column_step < size)
+            for tile in range(self.tiles))
+
+    def __repr__(self):
+        return f"Variant({self.size}x{self.size}, {self.win_length} in a row)"
+
+    def wins(self, mask, tile):
+        """Whether the mask holds a winning line through the tile"""
+        for line in self.masks_through[tile]:
+            if mask & line == line:
+                return True
+        return False
+
+
+@lru_cache(maxsize=None)
+def variant(size=3, win_length=3):
+    """
+    The variant of the given board size and win length, built once and shared.
+    Raises ValueError for a size outside MIN_SIZE to MAX_SIZE, or a win length
+    shorter than 3 or longer than the board.
+    """
+    if not MIN_SIZE <= size <= MAX_SIZE or not 3 <= win_length <= size:
+        raise ValueError(f"No {size}x{size} variant with {win_length} in a row")
+    return Variant(size, win_length)
+
+
+CLASSIC = variant(3, 3)
+FULL_BOARD = CLASSIC.full_board
+LINES = CLASSIC.lines
+WIN_MASKS = CLASSIC.win_masks
+LINES_THROUGH = tuple(tuple(line for line in LINES if tile in line) for tile in range(9))
+
+# Header of the packed state: version, flags (bit 0: turn, bits 1-2: result,
+# bit 3: single player, bits 4-7: AI difficulty), board size, win length and
+# number of moves played. It is followed by the x and o masks as little-endian
+# bytes of equal length, so tile i is bit i % 8 of byte i // 8.
+_HEADER = struct.Struct(">IBBBH")
+# States packed before there were variants: version and flags, then 2-byte masks of a 3x3 board
+_LEGACY_HEADER = struct.Struct(">IB")
+_LEGACY_SIZE = _LEGACY_HEADER.size + 4
+
+
+def has_line(mask):
+    """Returns True if the mask contains any winning line of the classic board"""
+    for line in WIN_MASKS:
+        if mask & line == line:
+            return True
+    return False
+
+
+class GameState():
+    """State of a single game: both markers' masks, the turn, the result and the variant"""
+    __slots__ = ("x_mask", "o_mask", "turn", "result", "single_player", "difficulty", "version",
+                 "variant", "moves")
+
+    def __init__(self, x_mask=0, o_mask=0, turn=X, result=NO_RESULT, single_player=False,
+                 difficulty=1, version=0, variant=CLASSIC, moves=None):
+        self.x_mask = x_mask
+        self.o_mask = o_mask
+        self.turn = turn
+        self.result = result
+        self.single_player = single_player
+        self.difficulty = difficulty
+        self.version = version  # Incremented on every stored change
+        self.variant = variant
+        # Markers on the board
+        self.moves = bin(x_mask | o_mask).count("1") if moves is None else moves
+
+    @property
+    def occupied(self):
+        """Mask of all tiles holding a marker"""
+        return self.x_mask | self.o_mask
+
+    @property
+    def finished(self):
+        """Whether the game has a result"""
+        return self.result != NO_RESULT
+
+    @property
+    def winner(self):
+        """The winner as 'X', 'O' or 'Draw', or None while the game is on"""
+        return RESULTS[self.result]
+
+    def is_free(self, tile):
+        """Whether the given tile is on the board and empty"""
+        return 0 <= tile < self.variant.tiles and not self.occupied >> tile & 1
+
+    def free_tiles(self):
+        """Indices of all empty tiles"""
+        occupied = self.occupied
+        return [tile for tile in range(self.variant.tiles) if not occupied >> tile & 1]
+
+    def play(self, tile):
+        """
+        Place the marker of the side to move on the tile, switch the turn and
+        update the result. The tile must be free. Returns the new result code.
+        """
+        if self.turn == X:
+            self.x_mask |= 1 << tile
+            if self.variant.wins(self.x_mask, tile):
+                self.result = X_WINS
+        else:
+            self.o_mask |= 1 << tile
+            if self.variant.wins(self.o_mask, tile):
+                self.result = O_WINS
+        self.moves += 1
+        if self.result == NO_RESULT and self.moves == self.variant.tiles:
+            self.result = DRAW
+        self.turn ^= 1
+        return self.result
+
+    def undo(self, tile):
+        """Take back the last move, which was played on the given tile"""
+        self.x_mask &= ~(1 << tile)
+        self.o_mask &= ~(1 << tile)
+        self.moves -= 1
+        self.result = NO_RESULT
+        self.turn ^= 1
+
+    def copy(self):
+        """Returns an independent copy of the state"""
+        return GameState(self.x_mask, self.o_mask, self.turn, self.result,
+                         self.single_player, self.difficulty, self.version, self.variant, self.moves)
+
+    def pack(self):
+        """Serialize the state to bytes"""
+        flags = self.turn | self.result << 1 | self.single_player << 3 | self.difficulty << 4
+        mask_bytes = (self.variant.tiles + 7) // 8
+        return (_HEADER.pack(self.version, flags, self.variant.size, self.variant.win_length,
+                             self.moves)
+                + self.x_mask.to_bytes(mask_bytes, "little")
+                + self.o_mask.to_bytes(mask_bytes, "little"))
+
+    @classmethod
+    def unpack(cls, data):
+        """Deserialize a state produced by `pack`, or by its 3x3 only predecessor"""
+        if len(data) == _LEGACY_SIZE:
+            (version, flags), game_variant, moves = _LEGACY_HEADER.unpack_from(data), CLASSIC, None
+            masks = data[_LEGACY_HEADER.size:]
+        else:
+            version, flags, size, win_length, moves = _HEADER.unpack_from(data)
+            game_variant = variant(size, win_length)
+            masks = data[_HEADER.size:]
+        half = len(masks) // 2
+        x_mask = int.from_bytes(masks[:half], "little")
+        o_mask = int.from_bytes(masks[half:], "little")
+        return cls(x_mask, o_mask, flags & 1, flags >> 1 & 3, bool(flags >> 3 & 1), flags >> 4,
+                   version, game_variant, moves)
+
+    def board(self):
+        """The board as a list of 'X', 'O' or '' strings, row by row"""
+        return ["X" if self.x_mask >> tile & 1 else "O" if self.o_mask >> tile & 1 else ""
+                for tile in range(self.variant.tiles)]
+
+    def to_dict(self):
+        """Dictionary representation sent to the clients"""
+        return {
+            "version": self.version,
+            "board": self.board(),
+            "size": self.variant.size,
+            "win_length": self.variant.win_length,
+            "turn": MARKERS[self.turn],
+            "winner": self.winner,
+            "finished": self.finished,
+            "single_player": self.single_player,
+        }
+
+    def delta(self, previous):
+        """
+        The changes from the previous state to this one, as sent to the clients:
+        the new version, turn and result, plus the tile and marker of a move or
+        the new single player flag when a second player took over from the AI.
+        """
+        delta = {
+            "version": self.version,
+            "turn": MARKERS[self.turn],
+            "winner": self.winner,
+            "finished": self.finished,
+        }
+        placed = self.occupied & ~previous.occupied
+        if placed:
+            tile = placed.bit_length() - 1
+            delta["tile"] = tile
+            delta["marker"] = MARKERS[self.o_mask >> tile & 1]
+        if self.single_player != previous.single_player:
+            delta["single_player"] = self.single_player
+        return delta
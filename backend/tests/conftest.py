@@ -0,0 +1,132 @@
+"""
+Shared fixtures for the backend tests.
+
+The app is configured before `src` is imported: fakeredis stands in for
+Redis (lupa gives it Lua for the move scripts), the database is a scratch
+SQLite file, Socket.IO runs without a message queue, which the test client
+can't use, and passwords are hashed at the lowest cost. Redis and the tables
+are emptied after every test.
+
+Socket.IO tests read what a client was sent with `received`, imported from
+here, and most start from the `players` fixture's two-player game.
+
+Tests that start real workers use the Redis server at TEST_REDIS_URL and
+are skipped when it isn't reachable.
+"""
+import os
+import tempfile
+import uuid
+
+import fakeredis
+import pytest
+import redis
+from sqlalchemy import event
+
+# Keep a handle on the real client for the tests that need a running server
+RealRedis = redis.Redis
+redis.Redis = fakeredis.FakeRedis
+redis.from_url = fakeredis.FakeRedis.from_url
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://127.0.0.1:6379/15")
+
+_database = os.path.join(tempfile.mkdtemp(), "tests.db")
+os.environ["DATABASE_URI"] = f"sqlite:///{_database}"
+os.environ["SOCKETIO_MESSAGE_QUEUE"] = ""
+os.environ["BCRYPT_LOG_ROUNDS"] = "4"  # The lowest cost bcrypt allows, to keep tests fast
+
+from src import app as flask_app, db, redis_conn, socketio  # noqa: E402
+from src.models import Player  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+    redis_conn.flushall()
+
+
+@pytest.fixture
+def make_player(app):
+    """Creates a player directly in the database, skipping the password hash"""
+    def make_player(username=None):
+        username = username or f"player-{uuid.uuid4().hex[:8]}"
+        player = Player(username=username, email=f"{username}@test", password="-")
+        db.session.add(player)
+        db.session.commit()
+        return player
+    return make_player
+
+
+@pytest.fixture
+def register(app):
+    """Registers a user through /register; returns a logged-in HTTP client"""
+    def register(username=None):
+        username = username or f"user-{uuid.uuid4().hex[:8]}"
+        client = app.test_client()
+        response = client.post("/register", json={
+            "email": f"{username}@test", "password": "secret", "username": username})
+        assert response.status_code == 200, response.json
+        return client
+    return register
+
+
+@pytest.fixture
+def socket_client(app):
+    """Opens a Socket.IO test client sharing the session of an HTTP client"""
+    clients = []
+
+    def socket_client(http_client=None):
+        client = socketio.test_client(app, flask_test_client=http_client)
+        clients.append(client)
+        return client
+    yield socket_client
+    for client in clients:
+        if client.is_connected():
+            client.disconnect()
+
+
+def received(client, name):
+    """The first argument of each event called name that client received, None for events without one"""
+    return [event["args"][0] if event["args"] else None
+            for event in client.get_received() if event["name"] == name]
+
+
+@pytest.fixture
+def players(register, socket_client):
+    """Two connected players in a fresh game; returns (creator, joiner, code)"""
+    creator, joiner = socket_client(register()), socket_client(register())
+    creator.emit("create_game", {"difficulty": 1})
+    code = received(creator, "game_created")[0].split()[-1]
+    joiner.emit("join_game", {"game_code": code})
+    return creator, joiner, code
+
+
+@pytest.fixture
+def count_queries(app):
+    """Counts the SQL statements issued while calling a function"""
+    def count_queries(function):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            result = function()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+        return result, len(statements)
+    return count_queries
+
+
+@pytest.fixture
+def redis_url():
+    """URL of a real, emptied Redis database, skipping the test if there is none"""
+    server = RealRedis.from_url(TEST_REDIS_URL)
+    try:
+        server.ping()
+    except redis.ConnectionError:
+        pytest.skip(f"no Redis server at {TEST_REDIS_URL}")
+    server.flushdb()
+    yield TEST_REDIS_URL
+    server.flushdb()
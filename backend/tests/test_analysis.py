@@ -0,0 +1,81 @@
+"""Tests for the post-game analysis"""
+import uuid
+
+from src import analysis, db
+from src.models import Game, GamePlayerAssociation, Move, Player
+from src.state import CLASSIC, GameState, variant
+
+
+def add_game(player, tiles, game_variant=CLASSIC):
+    """Inserts an archived, finished game in which these tiles were played"""
+    state = GameState(variant=game_variant)
+    for tile in tiles:
+        state.play(tile)
+    game_id = str(uuid.uuid4())
+    db.session.execute(db.insert(Game), [{"id": game_id, "code": uuid.uuid4().hex[:10],
+                                          "finished": True, "state": state.pack()}])
+    db.session.execute(db.insert(GamePlayerAssociation), [{"game_id": game_id, "player_id": player.id}])
+    db.session.execute(db.insert(Move), [
+        {"id": str(uuid.uuid4()), "game_id": game_id, "number": number, "tile_number": tile,
+         "player_id": player.id if number % 2 else None}
+        for number, tile in enumerate(tiles, start=1)])
+    db.session.commit()
+    return game_id
+
+
+def test_moves_are_rated_against_perfect_play():
+    # O answers the corner with the edge next to it, which loses; X then forks and wins
+    annotations = analysis.analyse_moves(CLASSIC, [0, 1, 4, 8, 6, 2, 3])
+    ratings = [annotation["rating"] for annotation in annotations]
+    assert ratings == ["best", "blunder", "best", "best", "best", "best", "best"]
+    assert annotations[1]["lost"] > 0 and annotations[1]["best_tile"] == 4
+    assert [annotation["number"] for annotation in annotations] == list(range(1, 8))
+
+
+def test_slower_wins_are_inaccuracies():
+    # X could complete 2, 5, 8 at once, but plays 6 and only wins a move later
+    annotations = analysis.analyse_moves(CLASSIC, [2, 1, 5, 3, 6, 4, 8])
+    assert annotations[4]["rating"] == "inaccuracy" and annotations[4]["best_tile"] == 8
+    assert annotations[4]["lost"] == 2
+    assert annotations[6]["rating"] == "best"
+
+
+def test_analysis_stops_at_impossible_moves():
+    assert len(analysis.analyse_moves(CLASSIC, [0, 0, 1])) == 1
+
+
+def test_large_boards_are_searched_to_a_depth(app):
+    # X lines up 0, 1, 2 against the edge and O doesn't block 3
+    annotations = analysis.analyse_moves(variant(7, 4), [0, 10, 1, 20, 2, 30, 3])
+    assert len(annotations) == 7
+    assert annotations[5]["rating"] == "blunder" and annotations[5]["best_tile"] == 3
+    assert annotations[6]["rating"] == "best"
+
+
+def test_pending_games_are_analysed_in_a_batch(app, make_player, count_queries):
+    player = make_player()
+    game_ids = [add_game(player, [0, 1, 4, 8, 6, 2, 3]), add_game(player, [4, 0, 8, 2, 1, 7, 6, 3, 5])]
+    unfinished = add_game(player, [4])
+    Game.query.filter_by(id=unfinished).update({"finished": False})
+    db.session.commit()
+
+    analysed, queries = count_queries(lambda: analysis.analyse_pending(10))
+    # The games, their moves and one update
+    assert analysed == 2 and queries == 3
+    db.session.expire_all()
+    games = {game.id: game for game in Game.query.all()}
+    assert games[game_ids[0]].analysis[1]["rating"] == "blunder"
+    assert len(games[game_ids[1]].analysis) == 9
+    assert games[unfinished].analysis is None
+    assert analysis.analyse_pending(10) == 0
+
+
+def test_game_details_serve_the_stored_analysis(register, make_player):
+    client = register("analyst")
+    player = Player.query.filter_by(username="analyst").first()
+    game_id = add_game(player, [0, 1, 4, 8, 6, 2, 3])
+    assert client.get(f"/game_details/{game_id}").json["analysis"] is None
+    analysis.analyse_pending(10)
+    details = client.get(f"/game_details/{game_id}").json
+    assert details["analysis"][1] == {"number": 2, "tile": 1, "rating": "blunder",
+                                      "lost": details["analysis"][1]["lost"], "best_tile": 4}
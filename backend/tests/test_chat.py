@@ -0,0 +1,116 @@
+"""Tests for the game chat: recent messages, batched writes, paging and rate limits"""
+from collections import OrderedDict
+
+import pytest
+
+from src import app, chat, db, redis_conn
+from src.chat import PENDING_MESSAGES_KEY, RECENT_MESSAGES, flush_all, flush_messages, recent_key
+from src.models import Game, Message
+
+from conftest import received
+
+
+@pytest.fixture
+def chat_game(register, socket_client):
+    """A logged-in player and a connection in their fresh game; returns (http, socket, code)"""
+    http = register()
+    socket = socket_client(http)
+    socket.emit("create_game", {"difficulty": 1})
+    code = received(socket, "game_created")[0].split()[-1]
+    return http, socket, code
+
+
+def say(socket, code, *texts):
+    for text in texts:
+        socket.emit("chat_message", {"game_code": code, "text": text})
+
+
+def test_messages_are_queued_then_written_in_one_insert(chat_game, count_queries):
+    _, socket, code = chat_game
+    say(socket, code, "one", "two", "three")
+    assert [message["text"] for message in received(socket, "chat_message")] == ["one", "two", "three"]
+    assert Message.query.count() == 0
+    assert redis_conn.llen(PENDING_MESSAGES_KEY) == 3
+
+    assert count_queries(flush_all) == (3, 1)  # One INSERT for the batch
+    assert [message.text for message in Game.query.filter_by(code=code).one().messages] == [
+        "one", "two", "three"]
+    assert redis_conn.llen(PENDING_MESSAGES_KEY) == 0
+
+
+def test_a_failed_write_keeps_the_messages_queued(chat_game, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    _, socket, code = chat_game
+    say(socket, code, "kept")
+    monkeypatch.setattr(db.session, "execute", fail)
+    with pytest.raises(RuntimeError):
+        flush_messages()
+    monkeypatch.undo()
+    assert flush_messages() == 1
+
+
+def test_joiners_get_the_recent_messages(chat_game, register, socket_client):
+    _, socket, code = chat_game
+    say(socket, code, "hi", "anyone?")
+    joiner = socket_client(register())
+    joiner.emit("join_game", {"game_code": code})
+    history, = received(joiner, "chat_history")
+    assert [message["text"] for message in history] == ["hi", "anyone?"]
+
+
+def test_recent_messages_are_capped(chat_game, monkeypatch):
+    monkeypatch.setitem(app.config, "CHAT_BURST", RECENT_MESSAGES + 10)
+    _, socket, code = chat_game
+    say(socket, code, *map(str, range(RECENT_MESSAGES + 10)))
+    assert redis_conn.llen(recent_key(code)) == RECENT_MESSAGES
+
+
+def test_history_is_paged_newest_first(chat_game, monkeypatch):
+    monkeypatch.setitem(app.config, "CHAT_BURST", 25)
+    http, socket, code = chat_game
+    say(socket, code, *map(str, range(25)))
+    flush_all()
+    game_id = Game.query.filter_by(code=code).one().id
+
+    texts, cursor = [], None
+    while True:
+        page = http.get(f"/game_messages/{game_id}", query_string={"limit": 10, "cursor": cursor}
+                        if cursor else {"limit": 10}).json
+        texts += [message["text"] for message in page["messages"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert texts == [str(number) for number in reversed(range(25))]
+    assert http.get(f"/game_messages/{game_id}?cursor=nonsense").status_code == 400
+
+
+def test_senders_are_rate_limited(chat_game, monkeypatch):
+    monkeypatch.setitem(app.config, "CHAT_BURST", 3)
+    monkeypatch.setitem(app.config, "CHAT_RATE", 0.001)
+    _, socket, code = chat_game
+    say(socket, code, "a", "b", "c", "d", "e")
+    events = socket.get_received()
+    assert [event["name"] for event in events].count("chat_message") == 3
+    assert [event["name"] for event in events].count("chat_error") == 2
+    assert redis_conn.llen(PENDING_MESSAGES_KEY) == 3
+
+
+def test_empty_and_long_messages_are_refused(chat_game):
+    _, socket, code = chat_game
+    say(socket, code, "   ", "x" * 501)
+    assert len(received(socket, "chat_error")) == 2
+
+
+def test_game_ids_are_remembered_for_the_latest_games(make_player, monkeypatch, count_queries):
+    monkeypatch.setattr(chat, "GAME_IDS_CACHED", 2)
+    monkeypatch.setattr(chat, "_game_ids", OrderedDict())
+    player = make_player()
+    games = [player.create_game(1) for _ in range(3)]
+    for game in games:
+        assert chat.game_id(game.code) == game.id
+    assert list(chat._game_ids) == [games[1].code, games[2].code]
+    assert count_queries(lambda: chat.game_id(games[2].code)) == (games[2].id, 0)
+    assert count_queries(lambda: chat.game_id(games[0].code)) == (games[0].id, 1)
+    assert chat.game_id("NOPE00") is None and len(chat._game_ids) == 2
@@ -0,0 +1,98 @@
+"""
+Tests that room broadcasts cross worker processes.
+
+Two workers are started with the launcher against a real Redis and a
+scratch SQLite database. A player connected to one worker must receive
+what is broadcast by the other.
+"""
+import os
+import queue
+import sys
+import tempfile
+import time
+
+import pytest
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("websocket")
+import socketio  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from launch import start_workers, stop_workers  # noqa: E402
+
+PORT = 5600
+TIMEOUT = 10
+
+
+def wait_until_up(url):
+    """Polls a worker until it answers HTTP requests"""
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url + "/leaderboard", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    pytest.fail(f"{url} did not start")
+
+
+def connect(url, username):
+    """Registers a player on a worker and opens a Socket.IO connection as them"""
+    http = requests.Session()
+    response = http.post(url + "/register", json={
+        "email": f"{username}@cross", "password": "-", "username": username})
+    response.raise_for_status()
+    events = queue.Queue()
+    client = socketio.Client()
+    client.on("*", lambda event, *args: events.put((event, args)))
+    client.connect(url, headers={"Cookie": "; ".join(f"{k}={v}" for k, v in http.cookies.items())},
+                   transports=["websocket"])
+    return client, events
+
+
+def expect(events, name):
+    """Waits for an event by name and returns its arguments"""
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            event, args = events.get(timeout=deadline - time.monotonic())
+        except queue.Empty:
+            break
+        if event == name:
+            return args
+    pytest.fail(f"'{name}' was not delivered across workers")
+
+
+@pytest.fixture
+def workers(redis_url):
+    database = os.path.join(tempfile.mkdtemp(), "cross_worker.db")
+    env = dict(os.environ, DATABASE_URI=f"sqlite:///{database}",
+               REDIS_URL=redis_url, SOCKETIO_MESSAGE_QUEUE=redis_url)
+    processes = start_workers(2, port=PORT, env=env)
+    urls = [f"http://127.0.0.1:{PORT}", f"http://127.0.0.1:{PORT + 1}"]
+    try:
+        for url in urls:
+            wait_until_up(url)
+        yield urls
+    finally:
+        stop_workers(processes)
+        os.remove(database)
+
+
+def test_broadcasts_reach_clients_on_both_workers(workers):
+    first, second = workers
+    creator, creator_events = connect(first, "creator")
+    joiner, joiner_events = connect(second, "joiner")
+    try:
+        creator.emit("create_game", {"difficulty": 1})
+        code = expect(creator_events, "game_created")[0].split()[-1]
+
+        joiner.emit("join_game", {"game_code": code})
+        assert expect(creator_events, "game_joined")[0].startswith("joiner has joined")
+
+        creator.emit("make_move", {"game_code": code, "tile_number": 4})
+        delta = expect(joiner_events, "game_delta")[0]
+        assert (delta["tile"], delta["marker"]) == (4, "X")
+    finally:
+        creator.disconnect()
+        joiner.disconnect()
@@ -0,0 +1,67 @@
+"""Tests for the move deltas broadcast to a game's room and for resyncing clients"""
+from src import redis_conn
+from src.game import DELTA_HISTORY, history_key
+
+from conftest import received
+
+
+def test_join_sends_a_snapshot_and_the_handover(players):
+    creator, joiner, _ = players
+    assert received(creator, "game_delta") == [
+        {"version": 1, "turn": "X", "winner": None, "finished": False, "single_player": False}]
+    assert received(joiner, "game_state_update") == [
+        {"version": 1, "board": [""] * 9, "size": 3, "win_length": 3, "turn": "X", "winner": None,
+         "finished": False, "single_player": False}]
+
+
+def test_moves_broadcast_deltas(players):
+    creator, joiner, code = players
+    creator.get_received()
+    joiner.get_received()
+    creator.emit("make_move", {"game_code": code, "tile_number": 4})
+    joiner.emit("make_move", {"game_code": code, "tile_number": 0})
+    assert received(creator, "game_delta") == [
+        {"version": 2, "tile": 4, "marker": "X", "turn": "O", "winner": None, "finished": False},
+        {"version": 3, "tile": 0, "marker": "O", "turn": "X", "winner": None, "finished": False},
+    ]
+    assert not received(joiner, "game_state_update")
+
+
+def test_resync_replays_missed_deltas(players):
+    creator, joiner, code = players
+    for number, tile in enumerate((0, 3, 1)):
+        (creator, joiner)[number % 2].emit("make_move", {"game_code": code, "tile_number": tile})
+    joiner.get_received()
+
+    joiner.emit("resync", {"game_code": code, "version": 2})
+    deltas, = received(joiner, "game_deltas")
+    assert [(delta["version"], delta["tile"]) for delta in deltas] == [(3, 3), (4, 1)]
+
+    joiner.emit("resync", {"game_code": code, "version": 4})
+    assert received(joiner, "game_deltas") == [[]]
+
+
+def test_resync_sends_a_snapshot_when_the_history_is_gone(players):
+    creator, joiner, code = players
+    creator.emit("make_move", {"game_code": code, "tile_number": 4})
+    redis_conn.ltrim(history_key(code), -1, -1)
+    joiner.get_received()
+
+    joiner.emit("resync", {"game_code": code, "version": 1})
+    snapshot, = received(joiner, "game_state_update")
+    assert snapshot["version"] == 2 and snapshot["board"][4] == "X"
+    joiner.emit("resync", {"game_code": code})
+    assert received(joiner, "game_state_update")[0]["version"] == 2
+
+
+def test_history_is_capped(players):
+    creator, _, code = players
+    redis_conn.rpush(history_key(code), *[redis_conn.lindex(history_key(code), -1)] * DELTA_HISTORY)
+    creator.emit("make_move", {"game_code": code, "tile_number": 4})
+    assert redis_conn.llen(history_key(code)) == DELTA_HISTORY
+
+
+def test_resync_of_an_unknown_game(socket_client, register):
+    client = socket_client(register())
+    client.emit("resync", {"game_code": "NOPE00", "version": 0})
+    assert received(client, "resync_error") == ["Game not found."]
@@ -0,0 +1,101 @@
+"""Tests for the NDJSON exports"""
+import gzip
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from src import db, export
+from src.models import Game, GamePlayerAssociation, Move
+from src.state import GameState, variant
+
+TOKEN = {"Authorization": "Bearer secret"}
+
+
+@pytest.fixture(autouse=True)
+def small_pages(app, monkeypatch):
+    """Pages of four rows read two at a time, so a few rows span several pages"""
+    monkeypatch.setattr(export, "PAGE_SIZE", 4)
+    monkeypatch.setattr(export, "CHUNK_SIZE", 2)
+    monkeypatch.setitem(app.config, "EXPORT_TOKEN", "secret")
+
+
+def add_games(player_id, count, written_at, moves=3):
+    """Inserts finished 5x5 games with their moves, all written at the given time"""
+    state = GameState(variant=variant(5, 4)).pack()
+    game_ids = [str(uuid.uuid4()) for _ in range(count)]
+    db.session.execute(db.insert(Game), [
+        {"id": game_id, "code": uuid.uuid4().hex[:10], "finished": True, "state": state,
+         "created_at": written_at, "updated_at": written_at} for game_id in game_ids])
+    db.session.execute(db.insert(GamePlayerAssociation), [
+        {"game_id": game_id, "player_id": player_id} for game_id in game_ids])
+    db.session.execute(db.insert(Move), [
+        {"id": str(uuid.uuid4()), "game_id": game_id, "number": number, "tile_number": number,
+         "player_id": player_id, "created_at": written_at, "updated_at": written_at}
+        for game_id in game_ids for number in range(1, moves + 1)])
+    db.session.commit()
+    return game_ids
+
+
+def download(client, table, **params):
+    """Returns the rows of an export and its X-Export-Until"""
+    response = client.get(f"/export/{table}", query_string=params, headers=TOKEN)
+    assert response.status_code == 200, response.data
+    lines = gzip.decompress(response.data).decode().splitlines()
+    return [json.loads(line) for line in lines], response.headers["X-Export-Until"]
+
+
+def test_tables_are_exported_across_pages(app, make_player):
+    player_id = make_player().id
+    game_ids = add_games(player_id, 5, datetime.utcnow() - timedelta(hours=1))
+    client = app.test_client()
+
+    moves, _ = download(client, "moves")
+    assert len(moves) == 15 and len({move["id"] for move in moves}) == 15
+    assert {move["game_id"] for move in moves} == set(game_ids)
+    assert set(moves[0]) == {"id", "game_id", "number", "tile_number", "player_id",
+                             "created_at", "updated_at"}
+
+    games, _ = download(client, "games")
+    assert sorted(game["id"] for game in games) == sorted(game_ids)
+    assert {(game["size"], game["win_length"]) for game in games} == {(5, 4)}
+
+    game_players, _ = download(client, "game_players")
+    assert sorted(row["game_id"] for row in game_players) == sorted(game_ids)
+    assert download(client, "messages")[0] == []
+
+
+def test_incremental_exports_pick_up_where_the_last_ended(app, make_player):
+    player_id = make_player().id
+    add_games(player_id, 3, datetime.utcnow() - timedelta(hours=2))
+    client = app.test_client()
+    _, until = download(client, "moves", until=(datetime.utcnow() - timedelta(hours=1)).isoformat())
+
+    newer = add_games(player_id, 2, datetime.utcnow() - timedelta(minutes=30))
+    moves, _ = download(client, "moves", since=until)
+    assert len(moves) == 6 and {move["game_id"] for move in moves} == set(newer)
+    # Rows written too recently are left for the next export
+    add_games(player_id, 1, datetime.utcnow())
+    assert len(download(client, "moves", since=until)[0]) == 6
+
+
+def test_exports_need_the_token(app, monkeypatch):
+    client = app.test_client()
+    assert client.get("/export/moves").status_code == 401
+    assert client.get("/export/moves", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/export/players", headers=TOKEN).status_code == 400
+    assert client.get("/export/moves?since=yesterday", headers=TOKEN).status_code == 400
+    monkeypatch.setitem(app.config, "EXPORT_TOKEN", "")
+    assert client.get("/export/moves", headers={"Authorization": "Bearer "}).status_code == 401
+
+
+def test_export_command_writes_every_table(app, make_player, tmp_path):
+    add_games(make_player().id, 2, datetime.utcnow() - timedelta(hours=1))
+    result = app.test_cli_runner().invoke(args=["export", str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert "Exported 6 moves" in result.output
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        f"{table}.ndjson.gz" for table in export.TABLES)
+    with gzip.open(tmp_path / "games.ndjson.gz") as games:
+        assert len(games.read().splitlines()) == 2
@@ -0,0 +1,98 @@
+"""Tests for friend requests, the cached friend graph and friends' presence"""
+import pytest
+from sqlalchemy import event
+
+from src import app, db, redis_conn
+from src.friends import friends_key
+
+
+@pytest.fixture(autouse=True)
+def cached_identity(monkeypatch):
+    """Keeps the player cached between requests, so only the friends lookups are measured"""
+    monkeypatch.setitem(app.config, "IDENTITY_CACHE_TTL", 3600)
+
+
+def me(client):
+    return client.get("/@me").json
+
+
+def befriend(sender, receiver):
+    """Sends a friend request from one HTTP client to another, which accepts it"""
+    assert sender.post("/send_friend_request", json={"username": me(receiver)["username"]}).status_code == 200
+    request_id = receiver.get("/friend_requests").json[0]["id"]
+    return receiver.post("/accept_friend_request", json={"request_id": request_id})
+
+
+def test_requests_are_accepted_into_friendships(register):
+    alice, bob = register(), register()
+    assert alice.post("/send_friend_request", json={"username": me(bob)["username"]}).status_code == 200
+    requests = bob.get("/friend_requests").json
+    assert [(request["sender"]["username"], request["receiver"]["username"]) for request in requests] == [
+        (me(alice)["username"], me(bob)["username"])]
+
+    # Only the receiver can answer a request
+    assert alice.post("/accept_friend_request", json={"request_id": requests[0]["id"]}).status_code == 400
+    response = bob.post("/accept_friend_request", json={"request_id": requests[0]["id"]})
+    assert response.status_code == 200
+    assert {response.json["player1"]["id"], response.json["player2"]["id"]} == {me(alice)["id"], me(bob)["id"]}
+    assert [friend["username"] for friend in alice.get("/friends").json] == [me(bob)["username"]]
+    assert [friend["username"] for friend in bob.get("/friends").json] == [me(alice)["username"]]
+
+    # Friends can't send each other requests any more
+    assert alice.post("/send_friend_request", json={"username": me(bob)["username"]}).status_code == 400
+
+
+def test_rejected_requests_are_dropped(register):
+    alice, bob = register(), register()
+    alice.post("/send_friend_request", json={"username": me(bob)["username"]})
+    request_id = bob.get("/friend_requests").json[0]["id"]
+    assert bob.post("/reject_friend_request", json={"request_id": request_id}).status_code == 200
+    assert bob.get("/friend_requests").json == []
+    assert alice.get("/friends").json == []
+
+
+def test_friends_are_listed_from_redis(register):
+    alice, bob, carol = register(), register(), register()
+    befriend(alice, bob)
+    befriend(carol, alice)
+    alice.get("/friends")  # Loads the friends set
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        response = alice.get("/friends")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    # Only the schema checks of `manage_db`, which runs before every request
+    assert [statement for statement in statements if not statement.startswith("PRAGMA")] == []
+    assert sorted(friend["username"] for friend in response.json) == sorted(
+        [me(bob)["username"], me(carol)["username"]])
+    assert all(set(friend) == {"id", "username", "score", "online"} for friend in response.json)
+
+
+def test_accepting_refreshes_the_cached_friends(register):
+    alice, bob = register(), register()
+    assert alice.get("/friends").json == []
+    assert redis_conn.exists(friends_key(me(alice)["id"]))  # Cached although empty
+    befriend(alice, bob)
+    assert [friend["id"] for friend in alice.get("/friends").json] == [me(bob)["id"]]
+
+
+def test_friends_see_each_other_come_and_go(register, socket_client):
+    alice, bob = register(), register()
+    befriend(alice, bob)
+    alice_socket = socket_client(alice)
+    assert [friend["online"] for friend in bob.get("/friends").json] == [True]
+
+    bob_socket = socket_client(bob)
+    assert alice_socket.get_received()[-1] == {
+        "name": "friend_presence", "args": [{"id": me(bob)["id"], "online": True}], "namespace": "/"}
+    second_bob_socket = socket_client(bob)
+    assert not alice_socket.get_received()  # Bob was online already
+
+    bob_socket.disconnect()
+    assert not alice_socket.get_received()  # Bob is still online elsewhere
+    second_bob_socket.disconnect()
+    assert alice_socket.get_received()[-1]["args"] == [{"id": me(bob)["id"], "online": False}]
+    assert [friend["online"] for friend in alice.get("/friends").json] == [False]
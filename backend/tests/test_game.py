@@ -0,0 +1,44 @@
+"""Tests for playing a game over Socket.IO and recording its result"""
+from src import db, redis_conn
+from src.game import moves_key
+from src.models import Game, Move
+
+from conftest import received
+
+
+def play(players, tiles):
+    creator, joiner, code = players
+    for number, tile in enumerate(tiles):
+        (creator, joiner)[number % 2].emit("make_move", {"game_code": code, "tile_number": tile})
+
+
+def test_win_is_recorded_with_its_moves(players):
+    creator, _, code = players
+    play(players, (0, 3, 1, 4, 2))
+    game = Game.query.filter_by(code=code).first()
+    assert game.finished and game.winner is not None
+    assert [move.tile_number for move in game.moves] == [0, 3, 1, 4, 2]
+    assert [move.number for move in game.moves] == [1, 2, 3, 4, 5]
+    assert not redis_conn.exists(moves_key(code))
+    assert received(creator, "game_delta")[-1]["winner"] == "X"
+
+
+def test_result_is_recorded_when_writing_moves_fails(players, monkeypatch):
+    execute = db.session.execute
+
+    def fail(statement, *args, **kwargs):
+        if getattr(getattr(statement, "table", None), "name", None) == Move.__tablename__:
+            raise RuntimeError("database unavailable")
+        return execute(statement, *args, **kwargs)
+
+    creator, _, code = players
+    monkeypatch.setattr(db.session, "execute", fail)
+    play(players, (0, 3, 1, 4, 2))
+    monkeypatch.undo()
+
+    db.session.expire_all()
+    game = Game.query.filter_by(code=code).first()
+    assert game.finished and game.winner is not None
+    assert Move.query.count() == 0
+    assert redis_conn.llen(moves_key(code)) == 5  # Left for the idle flusher
+    assert received(creator, "game_delta")[-1]["finished"]
@@ -0,0 +1,85 @@
+"""Tests for the paginated game history"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from src import db
+from src.models import Game, GamePlayerAssociation, Message, Move, Player
+
+
+def add_games(player, opponent, count):
+    """Bulk-inserts count finished games between the two players, one second apart"""
+    start = datetime.utcnow() - timedelta(days=1)
+    games, players, moves, messages = [], [], [], []
+    for number in range(count):
+        game_id = str(uuid.uuid4())
+        games.append({"id": game_id, "code": uuid.uuid4().hex[:10], "finished": True,
+                      "winner_id": player.id, "created_at": start + timedelta(seconds=number)})
+        players += [{"game_id": game_id, "player_id": player.id},
+                    {"game_id": game_id, "player_id": opponent.id}]
+        for tile in range(5):
+            moves.append({"id": str(uuid.uuid4()), "game_id": game_id, "number": tile + 1,
+                          "tile_number": tile, "player_id": (player, opponent)[tile % 2].id})
+        messages.append({"id": str(uuid.uuid4()), "game_id": game_id,
+                         "player_id": opponent.id, "text": "good game"})
+    for model, rows in ((Game, games), (GamePlayerAssociation, players),
+                        (Move, moves), (Message, messages)):
+        db.session.execute(db.insert(model), rows)
+    db.session.commit()
+
+
+@pytest.fixture(autouse=True)
+def cached_identity(app, monkeypatch):
+    """Keeps the player cached after the first request, so every page is measured the same"""
+    monkeypatch.setitem(app.config, "IDENTITY_CACHE_TTL", 3600)
+
+
+def history_pages(client, count_queries, limit):
+    """Walks every /history page; returns the games and the queries each page took"""
+    games, queries, cursor = [], [], None
+    client.get("/@me")
+    while True:
+        url = f"/history?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        response, page_queries = count_queries(lambda: client.get(url))
+        games += response.json["games"]
+        queries.append(page_queries)
+        cursor = response.json["next_cursor"]
+        if not cursor:
+            return games, queries
+
+
+def test_history_pages_cost_the_same_queries(register, make_player, count_queries):
+    client = register("historian")
+    player = Player.query.filter_by(username="historian").first()
+    add_games(player, make_player(), 45)
+
+    games, queries = history_pages(client, count_queries, limit=10)
+    assert len(games) == 45 and len({game["id"] for game in games}) == 45
+    newest_first = Game.query.order_by(Game.created_at.desc()).all()
+    assert [game["id"] for game in games] == [game.id for game in newest_first]
+    assert len(queries) == 5 and len(set(queries)) == 1
+    assert [move["number"] for move in games[0]["moves"]] == [1, 2, 3, 4, 5]
+
+    # The games are cached now, so pages only query their rows
+    _, small = history_pages(client, count_queries, limit=2)
+    assert len(set(small)) == 1 and small[0] < queries[0]
+
+
+def test_game_details_query_count_does_not_grow_with_moves(register, make_player, count_queries):
+    client = register("historian")
+    player = Player.query.filter_by(username="historian").first()
+    add_games(player, make_player(), 2)
+    first, second = (game.id for game in Game.query.order_by(Game.created_at))
+    db.session.add_all(Message(game_id=second, player_id=player.id, text=f"line {number}")
+                       for number in range(20))
+    db.session.commit()
+
+    client.get("/@me")
+    _, few = count_queries(lambda: client.get(f"/game_details/{first}"))
+    response, many = count_queries(lambda: client.get(f"/game_details/{second}"))
+    assert len(response.json["messages"]) == 21 and many == few
+
+
+def test_invalid_cursor_is_rejected(register):
+    assert register().get("/history?cursor=not-a-cursor").status_code == 400
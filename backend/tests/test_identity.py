@@ -0,0 +1,75 @@
+"""Tests for the cached player identity of sockets and HTTP requests"""
+import pytest
+from sqlalchemy import event
+
+from src import app as flask_app, db
+
+
+@pytest.fixture
+def statements(app):
+    """The SQL statements issued during the test"""
+    issued = []
+    listener = lambda *args: issued.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    yield issued
+    event.remove(db.engine, "before_cursor_execute", listener)
+
+
+@pytest.fixture
+def session_reads(app, monkeypatch):
+    """Counts the sessions loaded from the session store"""
+    interface = flask_app.session_interface.interface
+    reads = []
+    open_session = interface.open_session
+
+    def counted(*args):
+        reads.append(args)
+        return open_session(*args)
+    monkeypatch.setattr(interface, "open_session", counted)
+    return reads
+
+
+def player_lookups(statements):
+    return [statement for statement in statements if "FROM players" in statement]
+
+
+def test_socket_events_reuse_the_connection_player(register, socket_client, statements, session_reads):
+    http = register()
+    socket = socket_client(http)
+    socket.emit("create_game", {"difficulty": 1})
+    code = socket.get_received()[0]["args"][0].split()[-1]
+    statements.clear()
+    session_reads.clear()
+
+    socket.emit("chat_message", {"game_code": code, "text": "hello"})
+    socket.emit("make_move", {"game_code": code, "tile_number": 0})
+    assert player_lookups(statements) == []
+    assert session_reads == []
+    assert [event["name"] for event in socket.get_received()][0] == "chat_message"
+
+
+def test_logout_disconnects_the_player_sockets(register, socket_client):
+    http = register()
+    socket = socket_client(http)
+    assert socket.is_connected()
+    assert http.post("/logout").status_code == 200
+    assert not socket.is_connected()
+    assert http.get("/@me").status_code == 401
+
+
+def test_http_requests_share_the_player_briefly(app, register, statements, monkeypatch):
+    http = register("cached")
+    http.get("/@me")
+    statements.clear()
+    assert http.get("/@me").json["username"] == "cached"
+    assert http.get("/friends").status_code == 200
+    assert player_lookups(statements) == []
+
+
+def test_http_cache_expires(app, register, statements, monkeypatch):
+    monkeypatch.setitem(app.config, "IDENTITY_CACHE_TTL", 0)
+    http = register()
+    statements.clear()
+    http.get("/@me")
+    http.get("/@me")
+    assert len(player_lookups(statements)) == 2
@@ -0,0 +1,131 @@
+"""Tests for the Redis leaderboard and its routes"""
+import pytest
+
+from src import db, leaderboard, redis_conn
+from src.models import Player
+
+
+@pytest.fixture
+def ranked(make_player):
+    """Creates players with the given scores and puts them on the leaderboard"""
+    def ranked(*scores):
+        players = []
+        for score in scores:
+            player = make_player()
+            player.score = score
+            db.session.commit()
+            leaderboard.add_player(player)
+            players.append(player)
+        return players
+    return ranked
+
+
+def usernames(entries):
+    return [entry["username"] for entry in entries]
+
+
+def test_players_are_ordered_by_score(ranked):
+    low, high, middle = ranked(100, 300, 200)
+    assert leaderboard.top() == [
+        {"rank": 1, "username": high.username, "score": 300},
+        {"rank": 2, "username": middle.username, "score": 200},
+        {"rank": 3, "username": low.username, "score": 100},
+    ]
+    assert usernames(leaderboard.top(page=2, per_page=2)) == [low.username]
+    assert leaderboard.top(page=3, per_page=2) == []
+    assert [leaderboard.rank(player.id) for player in (low, high, middle)] == [3, 1, 2]
+
+
+def test_ties_are_broken_the_same_way_everywhere(ranked):
+    players = ranked(100, 100, 100, 50)
+    # Equal scores rank by descending player id, so every query agrees on the order
+    tied = sorted(players[:3], key=lambda player: player.id, reverse=True)
+    assert usernames(leaderboard.top()) == [player.username for player in tied] + [players[3].username]
+    assert [leaderboard.rank(player.id) for player in tied] == [1, 2, 3]
+    assert usernames(leaderboard.around(tied[1].id, radius=1)) == [player.username for player in tied]
+
+
+def test_unranked_players(app, ranked, make_player):
+    ranked(100)
+    outsider = make_player()
+    assert leaderboard.rank(outsider.id) is None
+    assert leaderboard.around(outsider.id) == []
+
+
+def test_around_is_cut_off_at_both_ends(ranked):
+    players = ranked(*range(1000, 0, -100))
+    names = [player.username for player in players]
+
+    top_window = leaderboard.around(players[0].id, radius=2)
+    assert usernames(top_window) == names[:3]
+    assert [entry["rank"] for entry in top_window] == [1, 2, 3]
+
+    bottom_window = leaderboard.around(players[-1].id, radius=2)
+    assert usernames(bottom_window) == names[-3:]
+    assert [entry["rank"] for entry in bottom_window] == [8, 9, 10]
+
+    assert usernames(leaderboard.around(players[4].id, radius=2)) == names[2:7]
+    assert usernames(leaderboard.around(players[4].id, radius=0)) == [names[4]]
+
+
+def test_rebuild_matches_the_players_table(ranked):
+    players = ranked(300, 200, 100)
+    # Scores drift from the table, e.g. Redis lost writes, and a player is missing
+    leaderboard.add_score(players[2].id, 1000)
+    redis_conn.zrem(leaderboard.LEADERBOARD_KEY, players[1].id)
+
+    count = leaderboard.rebuild(db.session.query(Player.id, Player.username, Player.score))
+    assert count == 3
+    expected = [{"rank": rank, "username": username, "score": score}
+                for rank, (username, score) in enumerate(
+                    db.session.query(Player.username, Player.score).order_by(Player.score.desc()), 1)]
+    assert leaderboard.top() == expected
+
+
+def test_rebuild_command(app, ranked):
+    ranked(10, 20)
+    redis_conn.delete(leaderboard.LEADERBOARD_KEY, leaderboard.USERNAMES_KEY)
+    result = app.test_cli_runner().invoke(args=["rebuild-leaderboard"])
+    assert result.exit_code == 0, result.output
+    assert "Ranked 2 players" in result.output
+    assert [entry["score"] for entry in leaderboard.top()] == [20, 10]
+
+
+def test_results_move_players_up(ranked):
+    winner, loser = ranked(0, 150)
+    game = winner.create_game(2)
+    loser.join_game_with_code(game.code)
+    game.declare_winner(winner.id)
+    assert leaderboard.top() == [
+        {"rank": 1, "username": winner.username, "score": 200},
+        {"rank": 2, "username": loser.username, "score": 150},
+    ]
+    assert leaderboard.rank(winner.id) == 1
+
+    # Draws and losses score nothing
+    game = winner.create_game(2)
+    loser.join_game_with_code(game.code)
+    game.declare_draw()
+    assert [entry["score"] for entry in leaderboard.top()] == [200, 150]
+
+
+def test_routes(register):
+    leader, follower = register(), register()
+    leader_id = leader.get("/@me").json["id"]
+    leaderboard.add_score(leader_id, 500)
+
+    page = follower.get("/leaderboard").json
+    assert [entry["score"] for entry in page] == [500, 0]
+    assert follower.get("/leaderboard?page=2&per_page=1").json == page[1:]
+    # Out-of-range paging is clamped
+    assert follower.get("/leaderboard?page=0&per_page=1000").json == page
+
+    assert leader.get("/leaderboard/rank").json == {"rank": 1}
+    assert follower.get("/leaderboard/rank").json == {"rank": 2}
+    assert follower.get("/leaderboard/around?radius=0").json == page[1:]
+    assert follower.get(f"/leaderboard/around?player_id={leader_id}&radius=1").json == page
+
+    anonymous = follower.application.test_client()
+    assert anonymous.get("/leaderboard").status_code == 200
+    assert anonymous.get("/leaderboard/rank").status_code == 401
+    assert anonymous.get("/leaderboard/around").status_code == 401
@@ -0,0 +1,116 @@
+"""Tests for game state expiry, the abandoned game sweeper and archiving"""
+import time
+
+import pytest
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src import db, metrics, redis_conn
+from src.game import (ACTIVE_GAMES_KEY, ARCHIVED_GAMES_KEY, SWEEP_LOCK_KEY, apply_move, archive_game,
+                      get_game_state, moves_key, players_key, save_game_state, create_game_state,
+                      sweep_games)
+from src.models import Game, Move
+from src.state import O, X
+
+
+@pytest.fixture
+def game(make_player):
+    """A two-player game stored in Redis; returns (game, x player, o player)"""
+    x_player, o_player = make_player(), make_player()
+    game = x_player.create_game(1)
+    save_game_state(game.code, create_game_state(), players={x_player.id: X, o_player.id: O})
+    return game, x_player, o_player
+
+
+def make_idle(code, seconds=7200):
+    redis_conn.zadd(ACTIVE_GAMES_KEY, {code: time.time() - seconds})
+
+
+def test_moves_renew_the_expiry(app, game, monkeypatch):
+    game, x_player, _ = game
+    monkeypatch.setitem(app.config, "GAME_TTL", 100)
+    save_game_state(game.code, create_game_state(), players={x_player.id: X})
+    assert 0 < redis_conn.ttl(game.code) <= 100
+    redis_conn.expire(game.code, 10)
+    apply_move(game.code, 4, x_player.id)
+    for key in (game.code, players_key(game.code), moves_key(game.code)):
+        assert 10 < redis_conn.ttl(key) <= 100
+
+
+def test_finished_games_are_archived(register, socket_client):
+    creator, joiner = socket_client(register()), socket_client(register())
+    creator.emit("create_game", {"difficulty": 1})
+    code = creator.get_received()[0]["args"][0].split()[-1]
+    joiner.emit("join_game", {"game_code": code})
+    for number, tile in enumerate((0, 3, 1, 4, 2)):
+        (creator, joiner)[number % 2].emit("make_move", {"game_code": code, "tile_number": tile})
+
+    game = Game.query.filter_by(code=code).first()
+    assert game.state == redis_conn.get(code)
+    assert redis_conn.ttl(code) <= 300 and redis_conn.zscore(ACTIVE_GAMES_KEY, code) is None
+    redis_conn.delete(code)
+    assert get_game_state(code).winner == "X"
+
+
+def test_sweeper_draws_abandoned_games(game):
+    game, x_player, _ = game
+    apply_move(game.code, 4, x_player.id)
+    make_idle(game.code)
+    assert sweep_games(3600) == 1
+
+    db.session.expire_all()
+    assert game.finished and game.winner_id is None and game.state is not None
+    assert [move.tile_number for move in Move.query.filter_by(game_id=game.id)] == [4]
+    assert redis_conn.zscore(ACTIVE_GAMES_KEY, game.code) is None
+    assert not redis_conn.exists(moves_key(game.code))
+
+
+def test_sweeper_records_results_reached_in_redis(game):
+    game, x_player, o_player = game
+    for tile, player in ((0, x_player), (3, o_player), (1, x_player), (4, o_player), (2, x_player)):
+        apply_move(game.code, tile, player.id)
+    make_idle(game.code)
+    sweep_games(3600)
+    db.session.expire_all()
+    assert game.finished and game.winner_id == x_player.id
+    assert db.session.get(type(x_player), x_player.id).score == 100
+
+
+def test_sweeper_leaves_recent_games_alone(game):
+    game, x_player, _ = game
+    apply_move(game.code, 4, x_player.id)
+    assert sweep_games(3600) == 0
+    assert not db.session.get(Game, game.id).finished
+
+
+def test_one_sweeper_at_a_time(game):
+    game, _, _ = game
+    make_idle(game.code)
+    redis_conn.set(SWEEP_LOCK_KEY, 1)
+    assert sweep_games(3600) is None
+    assert not db.session.get(Game, game.id).finished
+
+
+def test_live_and_archived_gauges(app, game, count_queries):
+    game, _, _ = game
+    make_idle(game.code)
+    before = metrics.render()
+    assert "tictactoe_games_live 1" in before and "tictactoe_games_archived 0" in before
+    sweep_games(3600)
+    after, queries = count_queries(metrics.render)
+    assert "tictactoe_games_live 0" in after and "tictactoe_games_archived 1" in after
+    assert queries == 0
+
+
+def test_games_are_counted_once_however_often_archived(app, game):
+    game, _, _ = game
+    archive_game(game)
+    # Another worker that loaded the game before it was archived
+    set_committed_value(game, "state", None)
+    archive_game(game)
+    assert redis_conn.get(ARCHIVED_GAMES_KEY) == b"1"
+
+    redis_conn.delete(ARCHIVED_GAMES_KEY)
+    result = app.test_cli_runner().invoke(args=["recount-archived-games"])
+    assert result.exit_code == 0, result.output
+    assert "Counted 1 archived games" in result.output
+    assert redis_conn.get(ARCHIVED_GAMES_KEY) == b"1"
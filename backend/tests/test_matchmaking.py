@@ -0,0 +1,152 @@
+"""Tests for the open games index and for joining games"""
+import threading
+import time
+
+import pytest
+
+from src import app as flask_app, db, matchmaking, metrics, redis_conn
+from src.game import start_match
+from src.models import OPEN_GAMES_KEY, Game, Player
+
+from conftest import received
+
+
+def race(player_ids, join):
+    """Has every player call join(player) at the same moment; returns the games they got"""
+    barrier = threading.Barrier(len(player_ids))
+    results = {}
+
+    def worker(player_id):
+        with flask_app.app_context():
+            player = db.session.get(Player, player_id)
+            barrier.wait()
+            game = join(player)
+            results[player_id] = game.id if game else None
+            db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(player_id,)) for player_id in player_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_created_game_is_listed_until_joined(make_player):
+    creator, joiner = make_player(), make_player()
+    game = creator.create_game(1)
+    assert [listed.id for listed in joiner.get_available_games()] == [game.id]
+    assert joiner.join_game_with_code(game.code).id == game.id
+    assert joiner.get_available_games() == []
+
+
+def test_listing_uses_a_fixed_number_of_queries(make_player, count_queries):
+    creator, joiner = make_player(), make_player()
+    for _ in range(3):
+        creator.create_game(1)
+    db.session.expire_all()
+    _, few = count_queries(lambda: [game.to_dict() for game in joiner.get_available_games()])
+    for _ in range(10):
+        creator.create_game(1)
+    db.session.expire_all()
+    games, many = count_queries(lambda: [game.to_dict() for game in joiner.get_available_games()])
+    assert len(games) == 13 and many == few
+
+
+def test_creator_cannot_join_own_game(make_player):
+    creator = make_player()
+    game = creator.create_game(1)
+    assert creator.join_game_with_code(game.code) is None
+    assert creator.join_random_game() is None
+    assert redis_conn.zscore(OPEN_GAMES_KEY, game.id) is not None
+
+
+def test_one_winner_when_joining_by_code(make_player):
+    game = make_player().create_game(1)
+    players = [make_player().id for _ in range(6)]
+    results = race(players, lambda player: player.join_game_with_code(game.code))
+    assert list(results.values()).count(game.id) == 1
+    assert len(db.session.get(Game, game.id).game_players) == 2
+
+
+def test_one_winner_when_joining_by_code_and_at_random(make_player):
+    game = make_player().create_game(1)
+    players = [make_player().id for _ in range(6)]
+    results = race(players, lambda player: player.join_game_with_code(game.code)
+                   if player.id in players[::2] else player.join_random_game())
+    assert list(results.values()).count(game.id) == 1
+    assert len(db.session.get(Game, game.id).game_players) == 2
+
+
+def test_game_missing_from_the_index_can_be_joined_by_code_once(make_player):
+    game = make_player().create_game(1)
+    redis_conn.delete(OPEN_GAMES_KEY)
+    players = [make_player().id for _ in range(4)]
+    results = race(players, lambda player: player.join_game_with_code(game.code))
+    assert list(results.values()).count(game.id) == 1
+
+
+
+def test_nearest_score_within_the_window_is_paired(app):
+    assert matchmaking.join("far", 1000) is None
+    assert matchmaking.join("near", 150) is None
+    (player, _, _), (opponent, score, _) = matchmaking.join("joiner", 100)
+    assert (player, opponent, score) == ("joiner", "near", 150)
+    assert redis_conn.zrange(matchmaking.QUEUE_KEY, 0, -1) == [b"far"]
+    assert redis_conn.zrange(matchmaking.WAITING_KEY, 0, -1) == [b"far"]
+
+
+def test_windows_widen_while_players_wait(app):
+    matchmaking.join("low", 0)
+    matchmaking.join("high", 500)
+    assert matchmaking.pair_waiting() == []
+    # 100 points to start with, plus 20 a second
+    assert matchmaking.pair_waiting(now=time.time() + 19) == []
+    [match] = matchmaking.pair_waiting(now=time.time() + 21)
+    assert [player_id for player_id, _, _ in match] == ["low", "high"]
+    assert redis_conn.zcard(matchmaking.QUEUE_KEY) == 0
+
+
+def test_matched_players_get_a_game_together(register, socket_client):
+    metrics.reset()
+    first, second = socket_client(register()), socket_client(register())
+    first.emit("find_match")
+    assert received(first, "matchmaking_queued") == [{"window": 100}]
+    second.emit("find_match")
+    found = received(first, "match_found") + received(second, "match_found")
+    assert [match["marker"] for match in found] == ["O", "X"]
+    assert found[0]["game_code"] == found[1]["game_code"]
+
+    game = Game.query.filter_by(code=found[0]["game_code"]).first()
+    assert len(game.game_players) == 2 and redis_conn.zscore(OPEN_GAMES_KEY, game.id) is None
+    second.emit("join_game", {"game_code": game.code})
+    first.emit("join_game", {"game_code": game.code})
+    assert received(second, "game_state_update")[0]["single_player"] is False
+    second.emit("make_move", {"game_code": game.code, "tile_number": 4})
+    assert received(first, "game_delta")[-1]["marker"] == "X"
+    first.emit("make_move", {"game_code": game.code, "tile_number": 0})
+    assert received(second, "game_delta")[-1]["marker"] == "O"
+    assert "tictactoe_matchmaking_wait_seconds_count 2" in metrics.render()
+
+
+def test_players_leave_the_queue_when_they_cancel_or_go(register, socket_client):
+    client = socket_client(register())
+    client.emit("find_match")
+    client.emit("cancel_match")
+    assert received(client, "matchmaking_cancelled") == [None]
+    assert redis_conn.zcard(matchmaking.QUEUE_KEY) == 0
+    client.emit("find_match")
+    client.disconnect()
+    assert redis_conn.zcard(matchmaking.QUEUE_KEY) == 0
+    assert redis_conn.zcard(matchmaking.WAITING_KEY) == 0
+
+
+def test_players_are_queued_again_when_their_game_cannot_be_created(app, make_player, monkeypatch):
+    players = make_player(), make_player()
+    monkeypatch.setattr(Game, "create_match", lambda player_ids: 1 / 0)
+    matchmaking.join(players[0].id, 10)
+    match = matchmaking.join(players[1].id, 20)
+    with pytest.raises(ZeroDivisionError):
+        start_match(match)
+    assert redis_conn.zscore(matchmaking.QUEUE_KEY, players[1].id) == 20
+    assert redis_conn.zcard(matchmaking.WAITING_KEY) == 2
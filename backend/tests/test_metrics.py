@@ -0,0 +1,69 @@
+"""Tests for the per-handler metrics on /metrics"""
+import logging
+import re
+
+import pytest
+
+from src import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    metrics.reset()
+
+
+def scrape(client):
+    """Parses /metrics into {(metric name, labels): value}"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    samples = {}
+    for line in response.text.splitlines():
+        if not line.startswith("#"):
+            name, labels, value = re.match(r"(\w+)(?:\{(.*)\})? (\S+)", line).groups()
+            samples[(name, labels or "")] = float(value)
+    return samples
+
+
+def test_socket_events_are_timed_and_counted(register, socket_client):
+    http = register()
+    socket = socket_client(http)
+    socket.emit("create_game", {"difficulty": 1})
+    code = socket.get_received()[0]["args"][0].split()[-1]
+    socket.emit("make_move", {"game_code": code, "tile_number": 4})
+
+    samples = scrape(http)
+    labels = 'kind="socketio",handler="make_move"'
+    assert samples[("tictactoe_handler_seconds_count", labels)] == 1
+    assert samples[("tictactoe_handler_seconds_bucket", labels + ',le="+Inf"')] == 1
+    assert samples[("tictactoe_handler_redis_commands_total", labels)] >= 1
+    assert samples[("tictactoe_handler_errors_total", labels)] == 0
+    assert samples[("tictactoe_handler_sql_queries_total", 'kind="socketio",handler="create_game"')] >= 1
+
+
+def test_http_routes_are_recorded_by_rule(register):
+    http = register()
+    http.get("/game_details/missing")
+    http.get("/game_details/other")
+    samples = scrape(http)
+    labels = 'kind="http",handler="/game_details/<game_id>"'
+    assert samples[("tictactoe_handler_seconds_count", labels)] == 2
+    assert samples[("tictactoe_handler_sql_queries_total", labels)] >= 2
+    assert samples[("tictactoe_handler_redis_commands_total", labels)] >= 2  # The session
+
+
+def test_errors_are_counted(register, socket_client):
+    http = register()
+    with pytest.raises(KeyError):
+        socket_client(http).emit("make_move", {})
+    labels = 'kind="socketio",handler="make_move"'
+    assert scrape(http)[("tictactoe_handler_errors_total", labels)] == 1
+
+
+def test_slow_calls_are_logged_with_their_queries(app, register, monkeypatch, caplog):
+    http = register()
+    monkeypatch.setitem(app.config, "SLOW_EVENT_MS", 1e-6)
+    with caplog.at_level(logging.WARNING):
+        http.get("/friends")
+    assert "Slow http /friends" in caplog.text
+    assert "SELECT" in caplog.text
@@ -0,0 +1,92 @@
+"""Tests for the atomic move script and the AI reply"""
+import random
+import threading
+
+from src import redis_conn
+from src.game import MOVE_OK, apply_move, create_game_state, get_game_state, players_key, save_game_state
+from src.state import O, X
+
+THREADS = 8
+
+
+def start_game(code, single_player=False):
+    save_game_state(code, create_game_state(single_player_mode=single_player))
+    redis_conn.hset(players_key(code), mapping={"player-x": X, "player-o": O})
+
+
+def test_move_is_played_and_stored(app):
+    start_game("game")
+    status, state = apply_move("game", 4, "player-x")
+    assert status == MOVE_OK
+    assert state.board()[4] == "X" and state.version == 1
+    assert get_game_state("game").pack() == state.pack()
+
+
+def test_rejected_moves(app):
+    start_game("game")
+    assert apply_move("other", 0, "player-x") == ("missing", None)
+    assert apply_move("game", 0, "player-o") == ("turn", None)
+    assert apply_move("game", 0, "stranger") == ("turn", None)
+    assert apply_move("game", 9, "player-x") == ("invalid", None)
+    assert apply_move("game", "4", "player-x") == ("invalid", None)
+    apply_move("game", 0, "player-x")
+    assert apply_move("game", 0, "player-o") == ("invalid", None)
+    assert apply_move("game", 1, "player-o", expected_version=0) == ("stale", None)
+
+
+def test_win_finishes_the_game(app):
+    start_game("game")
+    for tile, player in ((0, "player-x"), (3, "player-o"), (1, "player-x"), (4, "player-o")):
+        apply_move("game", tile, player)
+    status, state = apply_move("game", 2, "player-x")
+    assert status == MOVE_OK and state.winner == "X" and state.finished
+    assert apply_move("game", 5, "player-o") == ("finished", None)
+
+
+def test_ai_only_moves_in_single_player_games(app):
+    start_game("game")
+    apply_move("game", 0, "player-x")
+    assert apply_move("game", 4, None) == ("turn", None)
+
+    start_game("solo", single_player=True)
+    apply_move("solo", 0, "player-x")
+    status, state = apply_move("solo", 4, None)
+    assert status == MOVE_OK and state.board()[4] == "O"
+
+
+def test_concurrent_moves_are_serialized(app):
+    """Threads racing on one game never get two moves accepted for the same version"""
+    start_game("race")
+    accepted = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(THREADS)
+
+    def worker():
+        tiles = list(range(9))
+        random.shuffle(tiles)
+        barrier.wait()
+        for tile in tiles:
+            for player in ("player-x", "player-o"):
+                status, state = apply_move("race", tile, player)
+                if status == MOVE_OK:
+                    with lock:
+                        accepted.append((state.version, tile, player, state))
+
+    workers = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    # Replaying the accepted moves in version order must give the stored state
+    accepted.sort(key=lambda move: move[0])
+    assert [move[0] for move in accepted] == list(range(1, len(accepted) + 1))
+    replay = create_game_state()
+    for version, tile, player, state in accepted:
+        assert player == ("player-x", "player-o")[replay.turn]
+        assert replay.is_free(tile) and not replay.finished
+        replay.play(tile)
+        replay.version = version
+        assert replay.pack() == state.pack()
+    assert replay.finished
+    assert get_game_state("race").pack() == replay.pack()
@@ -0,0 +1,45 @@
+"""Tests for password hashing in the worker pool"""
+import threading
+
+import bcrypt
+import pytest
+
+from src import passwords
+
+
+def test_hash_and_check_in_the_pool(app):
+    assert app.config["PASSWORD_WORKERS"] > 0
+    password_hash = passwords.hash_password("secret")
+    assert password_hash.startswith("$2b$04$")
+    assert passwords.check_password(password_hash, "secret")
+    assert not passwords.check_password(password_hash, "wrong")
+
+
+def test_hashes_from_flask_bcrypt_still_match(app):
+    old_hash = bcrypt.hashpw(b"secret", bcrypt.gensalt(4))  # Stored as bytes before
+    assert passwords.check_password(old_hash, "secret")
+    assert not passwords.check_password("not a hash", "secret")
+
+
+def test_inline_without_workers(app, monkeypatch):
+    monkeypatch.setitem(app.config, "PASSWORD_WORKERS", 0)
+    assert passwords.check_password(passwords.hash_password("secret"), "secret")
+
+
+def test_login_gets_503_when_the_queue_is_full(app, register, monkeypatch):
+    register("crowded")
+    monkeypatch.setattr(passwords, "_slots", threading.BoundedSemaphore(1))
+    passwords._slots.acquire()
+    response = app.test_client().post("/login", json={"email": "crowded@test", "password": "secret"})
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+    passwords._slots.release()
+    response = app.test_client().post("/login", json={"email": "crowded@test", "password": "secret"})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("password, status", [("secret", 200), ("wrong", 401)])
+def test_login(app, register, password, status):
+    register("returning")
+    response = app.test_client().post("/login", json={"email": "returning", "password": password})
+    assert response.status_code == status
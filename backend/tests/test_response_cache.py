@@ -0,0 +1,104 @@
+"""Tests for the cached JSON of finished games"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from src import analysis, db, redis_conn, response_cache
+from src.models import Game, GamePlayerAssociation, Player
+from src.state import GameState
+
+
+def add_game(player, finished=True):
+    """Inserts a game of one player, finished unless told otherwise"""
+    game_id = str(uuid.uuid4())
+    db.session.execute(db.insert(Game), [{"id": game_id, "code": uuid.uuid4().hex[:10],
+                                          "finished": finished, "winner_id": player.id}])
+    db.session.execute(db.insert(GamePlayerAssociation), [{"game_id": game_id, "player_id": player.id}])
+    db.session.commit()
+    return game_id
+
+
+@pytest.fixture
+def client(app, register, monkeypatch):
+    """Client of a registered player who stays cached, so requests only run the SQL of the route"""
+    monkeypatch.setitem(app.config, "IDENTITY_CACHE_TTL", 3600)
+    client = register("archivist")
+    client.get("/@me")
+    return client
+
+
+def test_finished_games_are_served_without_sql(client, count_queries):
+    game_id = add_game(Player.query.filter_by(username="archivist").first())
+    _, routing = count_queries(lambda: client.get("/no-such-route"))
+
+    first = client.get(f"/game_details/{game_id}")
+    assert first.status_code == 200 and first.json["id"] == game_id
+    assert first.get_etag() == (response_cache.lookup([game_id])[0][0], False)
+
+    second, queries = count_queries(lambda: client.get(f"/game_details/{game_id}"))
+    assert second.data == first.data and second.headers["ETag"] == first.headers["ETag"]
+    assert queries == routing
+
+    unchanged, queries = count_queries(lambda: client.get(
+        f"/game_details/{game_id}", headers={"If-None-Match": first.headers["ETag"]}))
+    assert unchanged.status_code == 304 and not unchanged.data and queries == routing
+
+
+def test_unfinished_games_are_not_cached(client):
+    game_id = add_game(Player.query.filter_by(username="archivist").first(), finished=False)
+    response = client.get(f"/game_details/{game_id}")
+    assert response.status_code == 200 and "ETag" not in response.headers
+    assert response_cache.lookup([game_id])[0][1] is None
+
+
+def test_games_are_only_immutable_once_settled(client):
+    game_id = add_game(Player.query.filter_by(username="archivist").first())
+    Game.query.filter_by(id=game_id).update({"state": GameState().pack()})
+    db.session.commit()
+    before = client.get(f"/game_details/{game_id}")
+    assert before.json["analysis"] is None
+    assert "no-cache" in before.headers["Cache-Control"] and "immutable" not in before.headers["Cache-Control"]
+
+    analysis.analyse_games(Game.query.filter_by(id=game_id).all())
+    after = client.get(f"/game_details/{game_id}", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200 and after.json["analysis"] == []
+    assert after.headers["ETag"] != before.headers["ETag"]
+    # Chat queued before the game finished may still be written out for a while
+    assert "no-cache" in after.headers["Cache-Control"]
+
+    analysed_at = datetime.utcnow() - timedelta(seconds=response_cache.SETTLE_SECONDS)
+    Game.query.filter_by(id=game_id).update({"updated_at": analysed_at})
+    db.session.commit()
+    response_cache.invalidate(game_id)
+    settled = client.get(f"/game_details/{game_id}")
+    assert settled.headers["ETag"] == after.headers["ETag"]
+    assert "immutable" in settled.headers["Cache-Control"] and "max-age=31536000" in settled.headers["Cache-Control"]
+
+
+def test_store_skips_games_invalidated_while_rendering(app):
+    ((_, _, _, generation),) = response_cache.lookup(["game"])
+    response_cache.invalidate("game")
+    response_cache.store([("game", b"{}", None, generation)])
+    assert response_cache.lookup(["game"])[0][1] is None
+
+
+def test_least_recently_served_games_are_evicted(app, monkeypatch):
+    monkeypatch.setitem(app.config, "RESPONSE_CACHE_BYTES", 250)
+    for name in "abc":
+        response_cache.store([(name, b"x" * 100, None, "0")])
+        response_cache.lookup(["a"])
+    assert [body is not None for _, body, _, _ in response_cache.lookup(["a", "b", "c"])] == [True, False, True]
+    response_cache.invalidate("a", "c")
+    assert int(redis_conn.get(response_cache.SIZE_KEY)) == 0
+
+
+def test_warm_history_pages_only_query_the_page(client, count_queries):
+    player = Player.query.filter_by(username="archivist").first()
+    game_ids = {add_game(player) for _ in range(3)}
+    _, routing = count_queries(lambda: client.get("/no-such-route"))
+
+    cold, _ = count_queries(lambda: client.get("/history"))
+    warm, queries = count_queries(lambda: client.get("/history"))
+    assert warm.json == cold.json and {game["id"] for game in warm.json["games"]} == game_ids
+    assert queries == routing + 1
@@ -0,0 +1,76 @@
+"""Tests for the AI's depth and time limited search"""
+import pytest
+
+from src.search import (DIFFICULTY_LEVELS, SearchEngine, TranspositionTable, search_best_move,
+                        search_limits)
+from src.state import GameState, variant
+
+
+def played(*tiles, game_variant=None):
+    """The state after playing the tiles in turn, X first"""
+    state = GameState(variant=game_variant) if game_variant else GameState()
+    for tile in tiles:
+        state.play(tile)
+    return state
+
+
+@pytest.mark.parametrize("difficulty", sorted(DIFFICULTY_LEVELS))
+def test_searches_stop_at_their_depth(difficulty):
+    max_depth, _ = DIFFICULTY_LEVELS[difficulty]
+    engine = SearchEngine(TranspositionTable())
+    # The empty board is forced by no depth, so only the cap ends the search
+    assert engine.search(GameState(), max_depth, 10) is not None
+    assert engine.depth == max_depth
+    assert search_limits(difficulty) == DIFFICULTY_LEVELS[difficulty]
+
+
+def test_table_evicts_the_least_recently_used():
+    table = TranspositionTable(size=2)
+    table.put(1, (1, 0, 0, 4))
+    table.put(2, (1, 0, 0, 5))
+    assert table.get(1) == (1, 0, 0, 4)
+    table.put(3, (1, 0, 0, 6))
+    assert len(table) == 2
+    assert table.get(2) is None
+    assert table.get(1) == (1, 0, 0, 4) and table.get(3) == (1, 0, 0, 6)
+
+    # Storing a key again refreshes it too
+    table.put(1, (2, 0, 0, 4))
+    table.put(4, (1, 0, 0, 7))
+    assert table.get(3) is None
+    assert table.get(1) == (2, 0, 0, 4)
+
+
+def test_timeouts_return_the_last_completed_iteration():
+    engine = SearchEngine(TranspositionTable())
+    move = engine.search(GameState(), 9, 0)
+    # The clock is only read every few hundred nodes on 3x3, so the first plies complete
+    assert 0 < engine.depth < 9
+    completed = SearchEngine(TranspositionTable())
+    assert completed.search(GameState(), engine.depth, 10) == move
+    assert completed.depth == engine.depth
+
+
+def test_timeouts_before_any_iteration_still_move():
+    state = played(112, game_variant=variant(15, 5))
+    engine = SearchEngine(TranspositionTable())
+    move = engine.search(state, 4, 0)
+    assert engine.depth == 0
+    # The fallback is the first move the search would have tried, next to the marker
+    assert move in (96, 97, 98, 111, 113, 126, 127, 128)
+
+
+@pytest.mark.parametrize("difficulty", sorted(DIFFICULTY_LEVELS))
+def test_immediate_wins_are_taken(difficulty):
+    # X on 0 and 1, O on 3 and 4: X wins on 2
+    assert search_best_move(played(0, 3, 1, 4), difficulty)[0] == 2
+    # X on 0, 1 and 2 of a 5x5 board, four to win: X wins on 3
+    state = played(0, 5, 1, 6, 2, 20, game_variant=variant(5, 4))
+    assert search_best_move(state, difficulty)[0] == 3
+
+
+@pytest.mark.parametrize("difficulty", [level for level, (depth, _) in DIFFICULTY_LEVELS.items()
+                                        if depth >= 2])
+def test_immediate_losses_are_blocked(difficulty):
+    # X on 0 and 8, O on 3 and 4 threatening 5
+    assert search_best_move(played(0, 3, 8, 4), difficulty)[0] == 5
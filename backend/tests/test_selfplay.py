@@ -0,0 +1,71 @@
+"""Tests for the batch self-play simulator"""
+import random
+
+import numpy as np
+import pytest
+
+from src import search, selfplay
+from src.state import GameState, X, variant
+
+
+def batch_of(state):
+    """The markers and line counts of a single state, as a batch of one board"""
+    game_variant = state.variant
+    lines = selfplay.line_matrix(game_variant.size, game_variant.win_length)
+    markers = tuple(np.array([[mask >> tile & 1 for tile in range(game_variant.tiles)]], dtype=bool)
+                    for mask in (state.x_mask, state.o_mask))
+    counts = tuple((side.astype(np.int8) @ lines.T).astype(np.int8) for side in markers)
+    return markers, counts
+
+
+@pytest.mark.parametrize("size, win_length, depth", ((3, 3, 4), (5, 4, 2), (7, 4, 2)))
+def test_batch_search_scores_moves_like_the_engine(size, win_length, depth):
+    rng = random.Random(size)
+    for _ in range(20):
+        state = GameState(variant=variant(size, win_length))
+        for _ in range(rng.randrange(1, state.variant.tiles // 2)):
+            state.play(rng.choice(state.free_tiles()))
+            if state.finished:
+                break
+        if state.finished:
+            continue
+        markers, counts = batch_of(state)
+        scores = selfplay._child_scores(state.variant, counts[state.turn], counts[state.turn ^ 1],
+                                        markers[0] | markers[1], depth)
+
+        engine = search.SearchEngine(search.TranspositionTable())
+        engine.variant, engine._deadline = state.variant, float("inf")
+        mine, theirs = (state.x_mask, state.o_mask) if state.turn == X else (state.o_mask, state.x_mask)
+        best_score, best_move = engine._root(mine, theirs, state.turn, search.zobrist_hash(state), depth, None)
+        assert scores.max() == best_score
+        assert scores[0, best_move] == best_score
+
+
+def test_perfect_play_never_loses():
+    outcomes = selfplay.simulate(3, 3, ["random", "4"], 30, seed=1)
+    assert outcomes[("random", "4")][:, 0].sum() == 0  # X never wins against it
+    assert outcomes[("4", "random")][:, 2].sum() == 0
+    assert (outcomes[("4", "4")][:, 1] == 30).all()
+    # Every game is counted once, per opening
+    assert outcomes[("random", "random")].shape == (9, 3)
+    assert (outcomes[("random", "random")].sum(axis=1) == 30).all()
+
+
+def test_search_takes_wins_and_blocks():
+    state = GameState()
+    for tile in (0, 4, 1):
+        state.play(tile)  # O must block at 2
+    markers, counts = batch_of(state)
+    rng = np.random.default_rng(0)
+    assert selfplay.choose_moves("1", state.variant, markers, counts, state.turn, rng)[0] == 2
+    state.play(8)  # Now X can win at 2
+    markers, counts = batch_of(state)
+    assert selfplay.choose_moves("1", state.variant, markers, counts, state.turn, rng)[0] == 2
+
+
+def test_pool_gives_the_same_outcomes_as_inline():
+    inline = selfplay.simulate(5, 4, ["random", "1"], 20, openings=[12], seed=3)
+    pooled = selfplay.simulate(5, 4, ["random", "1"], 20, openings=[12], workers=2, seed=3)
+    assert inline.keys() == pooled.keys()
+    for matchup, counts in inline.items():
+        assert (counts == pooled[matchup]).all()
@@ -0,0 +1,74 @@
+"""Tests for the solved 3x3 table, checked against a plain minimax of every position"""
+from functools import lru_cache
+
+from src import solver
+from src.state import GameState, variant
+
+LINES = variant(3, 3).lines
+
+
+def won(cells, marker):
+    return any(all(cells[tile] == marker for tile in line) for line in LINES)
+
+
+@lru_cache(maxsize=None)
+def value(cells, to_move):
+    """WIN, DRAW or LOSS for the side to move with perfect play, over the raw board"""
+    best = solver.LOSS
+    for tile in range(9):
+        if cells[tile]:
+            continue
+        best = max(best, move_value(cells, to_move, tile))
+    return best
+
+
+def move_value(cells, to_move, tile):
+    """The outcome for the side to move of playing tile, then perfect play"""
+    after = cells[:tile] + (to_move,) + cells[tile + 1:]
+    if won(after, to_move):
+        return solver.WIN
+    if 0 not in after:
+        return solver.DRAW
+    return -value(after, 3 - to_move)
+
+
+def reachable():
+    """Every position reachable from the empty board, with the side to move"""
+    seen, frontier = set(), [((0,) * 9, 1)]
+    while frontier:
+        cells, to_move = frontier.pop()
+        if (cells, to_move) in seen:
+            continue
+        seen.add((cells, to_move))
+        if won(cells, 1) or won(cells, 2) or 0 not in cells:
+            continue
+        for tile in range(9):
+            if not cells[tile]:
+                frontier.append((cells[:tile] + (to_move,) + cells[tile + 1:], 3 - to_move))
+    return seen
+
+
+def state_of(cells):
+    return GameState(sum(1 << tile for tile in range(9) if cells[tile] == 1),
+                     sum(1 << tile for tile in range(9) if cells[tile] == 2))
+
+
+def test_lookup_plays_perfectly_in_every_reachable_position():
+    positions = reachable()
+    assert len(positions) == 5478
+    checked = 0
+    for cells, to_move in positions:
+        move, outcome = solver.lookup(state_of(cells))
+        if won(cells, 1) or won(cells, 2) or 0 not in cells:
+            assert (move, outcome) == (None, None), cells
+            continue
+        expected = value(cells, to_move)
+        assert outcome == expected, cells
+        assert cells[move] == 0, cells
+        assert move_value(cells, to_move, move) == expected, cells
+        checked += 1
+    assert checked == 4520
+
+
+def test_the_empty_board_is_a_draw():
+    assert solver.lookup(GameState())[1] == solver.DRAW
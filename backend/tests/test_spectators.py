@@ -0,0 +1,47 @@
+"""Tests for watching a game as a spectator"""
+from src import app, spectators
+
+from conftest import received
+
+
+def test_spectators_get_a_snapshot_then_batched_deltas(players, socket_client, monkeypatch):
+    monkeypatch.setitem(app.config, "SPECTATOR_TICK", 0.25)
+    creator, joiner, code = players
+    creator.emit("make_move", {"game_code": code, "tile_number": 4})
+    spectators.broadcast()
+
+    spectator = socket_client()  # Not logged in
+    spectator.emit("spectate_game", {"game_code": code})
+    snapshot, = received(spectator, "game_state_update")
+    assert snapshot["version"] == 2 and snapshot["board"][4] == "X"
+
+    joiner.emit("make_move", {"game_code": code, "tile_number": 0})
+    creator.emit("make_move", {"game_code": code, "tile_number": 8})
+    assert not received(spectator, "game_deltas")
+    assert spectators.broadcast() == 1
+    deltas, = received(spectator, "game_deltas")
+    assert [(delta["version"], delta["tile"], delta["marker"]) for delta in deltas] == [
+        (3, 0, "O"), (4, 8, "X")]
+
+    spectator.emit("stop_spectating", {"game_code": code})
+    joiner.emit("make_move", {"game_code": code, "tile_number": 1})
+    spectators.broadcast()
+    assert not received(spectator, "game_deltas")
+
+
+def test_spectators_cannot_move(players, register, socket_client, monkeypatch):
+    monkeypatch.setitem(app.config, "SPECTATOR_TICK", 0)
+    creator, _, code = players
+    spectator = socket_client(register())
+    spectator.emit("spectate_game", {"game_code": code})
+    spectator.emit("make_move", {"game_code": code, "tile_number": 4})
+    assert received(spectator, "move_error") == ["turn"]
+
+    creator.emit("make_move", {"game_code": code, "tile_number": 4})
+    assert [deltas[0]["tile"] for deltas in received(spectator, "game_deltas")] == [4]
+
+
+def test_spectating_an_unknown_game(socket_client):
+    spectator = socket_client()
+    spectator.emit("spectate_game", {"game_code": "NOPE00"})
+    assert received(spectator, "spectate_error") == ["Game not found."]
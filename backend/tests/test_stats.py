@@ -0,0 +1,102 @@
+"""Tests for the scores and per-player stats recorded when games end"""
+import pytest
+from sqlalchemy import event
+
+from src import db, redis_conn
+from src.leaderboard import LEADERBOARD_KEY
+from src.models import Game, Player
+
+
+@pytest.fixture
+def pair(make_player):
+    """Two players; returns a function making a finished-to-be game between them"""
+    x_player, o_player = make_player(), make_player()
+
+    def new_game(difficulty=1):
+        game = x_player.create_game(difficulty)
+        o_player.join_game_with_code(game.code)
+        return game
+    return x_player, o_player, new_game
+
+
+def stats(player):
+    player = db.session.get(Player, player.id)
+    db.session.refresh(player)
+    return (player.score, player.wins, player.losses, player.draws, player.streak, player.best_streak)
+
+
+def test_results_update_scores_and_stats(pair):
+    x_player, o_player, new_game = pair
+    new_game(2).declare_winner(x_player.id)
+    assert stats(x_player) == (200, 1, 0, 0, 1, 1)
+    assert stats(o_player) == (0, 0, 1, 0, -1, 0)
+    assert redis_conn.zscore(LEADERBOARD_KEY, x_player.id) == 200
+
+    new_game().declare_draw()
+    assert stats(x_player) == (200, 1, 0, 1, 0, 1)
+    assert stats(o_player) == (0, 0, 1, 1, 0, 0)
+
+
+def test_streaks(pair):
+    x_player, o_player, new_game = pair
+    for winner in (x_player, x_player, o_player, o_player, o_player, x_player):
+        new_game().declare_winner(winner.id)
+    assert stats(x_player)[1:] == (3, 3, 0, 1, 2)
+    assert stats(o_player)[1:] == (3, 3, 0, -1, 3)
+
+
+def test_losing_to_the_ai(make_player):
+    player = make_player()
+    player.create_game(1).declare_winner(None)
+    assert stats(player) == (0, 0, 1, 0, -1, 0)
+
+
+def test_a_game_is_only_counted_once(pair):
+    x_player, o_player, new_game = pair
+    game = new_game()
+    game.declare_winner(x_player.id)
+    Game.query.filter_by(id=game.id).one().declare_winner(o_player.id)
+    game.declare_draw()
+    assert stats(x_player) == (100, 1, 0, 0, 1, 1)
+    assert stats(o_player) == (0, 0, 1, 0, -1, 0)
+    assert Game.query.filter_by(id=game.id).one().winner_id == x_player.id
+
+
+def test_stale_instances_do_not_lose_points(pair):
+    x_player, _, new_game = pair
+    first, second = new_game(), new_game()
+    db.session.get(Player, x_player.id).score  # Loaded, then changed behind its back
+    first.declare_winner(x_player.id)
+    second.declare_winner(x_player.id)
+    assert stats(x_player)[0] == 200
+
+
+def test_results_do_not_load_players(pair):
+    x_player, _, new_game = pair
+    game, winner_id = new_game(), x_player.id
+    game.difficulty  # Loaded, as it is when a move ends the game
+    db.session.expunge(x_player)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        game.declare_winner(winner_id)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    # The game, the winner and the loser; the game is only reloaded after the commit
+    assert [statement.split()[0] for statement in statements[:3]] == ["UPDATE"] * 3
+    assert not [statement for statement in statements if "FROM players" in statement]
+
+
+def test_rebuilding_matches_the_recorded_stats(pair, make_player):
+    x_player, o_player, new_game = pair
+    for winner in (x_player, None, o_player, o_player):
+        game = new_game()
+        game.declare_winner(winner.id) if winner else game.declare_draw()
+    loner = make_player()
+    loner.create_game(1).declare_winner(None)  # Counts as a draw without an archived state
+    recorded = [stats(player) for player in (x_player, o_player)]
+
+    assert Player.rebuild_stats() == 3
+    assert [stats(player) for player in (x_player, o_player)] == recorded
+    assert stats(loner) == (0, 0, 0, 1, 0, 0)
@@ -0,0 +1,122 @@
+"""Tests for boards of other sizes and win lengths"""
+import random
+import time
+
+import pytest
+
+from src import redis_conn
+from src.game import MOVE_OK, apply_move, find_best_move, get_game_state, players_key, save_game_state
+from src.search import SearchEngine, TranspositionTable, search_limits
+from src.state import CLASSIC, GameState, O, X, variant
+
+from conftest import received
+
+VARIANTS = ((3, 3), (4, 3), (7, 4), (15, 5))
+
+
+def test_lines_are_precomputed_per_variant():
+    assert len(CLASSIC.lines) == 8
+    assert len(variant(7, 4).lines) == 2 * 7 * 4 + 2 * 4 * 4
+    assert len(variant(15, 5).lines) == 2 * 15 * 11 + 2 * 11 * 11
+    # Five windows of five through the centre in each direction, one through a corner
+    assert len(variant(15, 5).masks_through[7 * 15 + 7]) == 4 * 5
+    assert len(variant(15, 5).masks_through[0]) == 3
+    assert variant(7, 4) is variant(7, 4)
+    for size, length in ((2, 2), (16, 5), (5, 6), (5, 2)):
+        with pytest.raises(ValueError):
+            variant(size, length)
+
+
+def test_wins_are_found_through_the_last_move():
+    state = GameState(variant=variant(7, 4))
+    for x_tile, o_tile in ((0, 1), (8, 2), (16, 3)):
+        state.play(x_tile)
+        state.play(o_tile)
+    assert not state.finished
+    assert state.play(24) and state.winner == "X"  # The diagonal 0, 8, 16, 24
+
+
+def test_draws_are_counted_by_moves():
+    state = GameState()
+    for tile in (0, 1, 2, 4, 3, 5, 7, 6):
+        state.play(tile)
+    assert not state.finished and state.moves == 8
+    state.play(8)
+    assert state.winner == "Draw"
+    state.undo(8)
+    assert not state.finished and state.moves == 8
+
+
+def test_packing_round_trips_and_reads_old_states():
+    state = GameState(variant=variant(15, 5), single_player=True, difficulty=3, version=7)
+    for tile in (0, 224, 112, 17):
+        state.play(tile)
+    copy = GameState.unpack(state.pack())
+    assert copy.pack() == state.pack() and copy.variant is variant(15, 5) and copy.moves == 4
+
+    old = bytes([0, 0, 0, 5, 0b10001]) + (0b101).to_bytes(2, "little") + (0b10000).to_bytes(2, "little")
+    state = GameState.unpack(old)
+    assert state.variant is CLASSIC and state.moves == 3 and state.board()[:5] == ["X", "", "X", "", "O"]
+
+
+@pytest.mark.parametrize("size, length", VARIANTS)
+def test_the_move_script_plays_like_the_state(app, size, length):
+    rng = random.Random(size * 100 + length)
+    for game in range(5):
+        code = f"variant-{size}-{length}-{game}"
+        state = GameState(variant=variant(size, length))
+        save_game_state(code, state)
+        redis_conn.hset(players_key(code), mapping={"player-x": X, "player-o": O})
+        while not state.finished:
+            tile = rng.choice(state.free_tiles())
+            status, stored = apply_move(code, tile, ("player-x", "player-o")[state.turn])
+            state.play(tile)
+            state.version += 1
+            assert status == MOVE_OK and stored.pack() == state.pack()
+        assert apply_move(code, 0, "player-x")[0] == "finished"
+    assert apply_move(code, size * size, "player-x")[0] in ("finished", "invalid")
+
+
+def test_old_states_are_played_and_upgraded(app):
+    redis_conn.set("old", bytes([0, 0, 0, 2, 0]) + (0b1).to_bytes(2, "little") + (0b10).to_bytes(2, "little"))
+    redis_conn.hset(players_key("old"), mapping={"player-x": X})
+    status, state = apply_move("old", 4, "player-x")
+    assert status == MOVE_OK and state.version == 3 and state.moves == 3
+    assert get_game_state("old").board()[:5] == ["X", "O", "", "", "X"]
+
+
+def test_the_ai_plays_near_the_markers_on_large_boards():
+    state = GameState(variant=variant(15, 5), difficulty=3)
+    assert find_best_move(state) == 112  # The centre of an empty board
+    for tile in (112, 113, 127, 128):
+        state.play(tile)
+    move = find_best_move(state)
+    assert state.is_free(move) and state.variant.neighbours[move] & state.occupied
+
+
+@pytest.mark.parametrize("difficulty", [1, 2, 3])
+def test_searches_keep_to_their_budget_on_the_largest_board(difficulty):
+    max_depth, budget = search_limits(difficulty)
+    rng, worst = random.Random(difficulty), 0
+    for _ in range(10):
+        state = GameState(variant=variant(15, 5))
+        free = state.free_tiles()
+        rng.shuffle(free)
+        while state.moves < 60 and not state.finished:
+            state.play(free.pop())
+        start = time.perf_counter()
+        SearchEngine(TranspositionTable()).search(state, max_depth, budget)
+        worst = max(worst, time.perf_counter() - start)
+    # Leaves of 15x15 evaluate 572 lines; reading the clock every 256 nodes overshot 4-5 times
+    assert worst < budget * 1.5 + 0.003
+
+
+def test_games_are_created_with_a_variant(register, socket_client):
+    client = socket_client(register())
+    client.emit("create_game", {"difficulty": 1, "board_size": 7, "win_length": 4})
+    snapshot, = received(client, "game_state_update")
+    assert (snapshot["size"], snapshot["win_length"], len(snapshot["board"])) == (7, 4, 49)
+
+    client.emit("create_game", {"board_size": 40, "win_length": "x"})
+    snapshot, = received(client, "game_state_update")
+    assert (snapshot["size"], snapshot["win_length"]) == (3, 3)
@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+"""
+WSGI entry point for production servers.
+
+Flask-SocketIO needs every client to keep talking to the same process, so
+run one single-worker gunicorn per port, with threads for concurrency, and
+put them behind a load balancer with sticky sessions:
+
+    gunicorn --worker-class gthread --workers 1 --threads 100 --bind 0.0.0.0:5000 wsgi:app
+"""
+from src import analysis, app, chat, socketio, spectators
+from src.game import game_sweeper, matchmaker, move_flusher
+
+socketio.start_background_task(move_flusher)
+socketio.start_background_task(game_sweeper)
+socketio.start_background_task(spectators.broadcaster)
+socketio.start_background_task(chat.chat_flusher)
+socketio.start_background_task(analysis.game_analyser)
+socketio.start_background_task(matchmaker)